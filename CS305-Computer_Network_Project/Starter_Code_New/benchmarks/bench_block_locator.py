@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+比较两种区块清单对账方式每轮的消息大小和CPU开销：
+整链INV（发送方列出主链上所有区块ID，接收方逐个检查是否缺失）与区块定位器（GET_BLOCKS携带O(log n)个区块ID，
+对方找到分叉点后只用INV回复分叉点之后的区块）。接收方落后发送方--lag个区块，可选在--fork-depth处分叉。
+消息大小按json和binary两种编码计算。
+
+用法: python benchmarks/bench_block_locator.py --sizes 1000 10000 100000 --lag 10 --fork-depth 0
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from chain_store import ChainStore
+from block_handler import compute_block_hash
+from codec import CODECS, encode_payload
+from inv_message import LOCATOR_INV_LIMIT
+
+
+def make_chain(count, fork_height=None, miner="5001"):
+    blocks = []
+    previous = None
+    for height in range(1, count + 1):
+        # 分叉点之后的区块换一个出块节点，得到不同的哈希
+        peer_id = miner if fork_height is not None and height > fork_height else "5001"
+        block = {"type": "BLOCK", "peer_id": peer_id, "timestamp": float(height), "block_id": "",
+                 "previous_block_id": previous, "height": height, "transactions": [],
+                 "message_id": f"{height:032x}"}
+        block["block_id"] = compute_block_hash(block)
+        blocks.append(block)
+        previous = block["block_id"]
+    return blocks
+
+
+def sizes_of(message):
+    json_bytes = len(json.dumps(message).encode())
+    _, payload = encode_payload(message, CODECS["binary"])
+    return json_bytes, len(payload)
+
+
+def full_inv_round(sender, receiver):
+    """整链INV：返回(消息列表, 缺失区块ID)"""
+    inv = {"type": "INV", "sender_id": "5001", "block_ids": sender.inventory(), "message_id": "0" * 36}
+    missing = [block_id for block_id in inv["block_ids"] if block_id not in receiver]
+    return [inv], missing
+
+
+def locator_round(sender, receiver):
+    """区块定位器：接收方发出GET_BLOCKS，发送方回复分叉点之后的INV（满额时继续请求）。返回(消息列表, 缺失区块ID)"""
+    messages = []
+    missing = []
+    continue_from = None
+    while True:
+        locator = receiver.locator()
+        if continue_from is not None:
+            locator.insert(0, continue_from)
+        get_blocks = {"type": "GET_BLOCKS", "sender_id": "5002", "locator": locator,
+                      "tip_height": receiver.tip_height(), "message_id": "0" * 36}
+        messages.append(get_blocks)
+        fork_height = sender.find_fork(get_blocks["locator"])
+        start_height = 0 if fork_height is None else fork_height + 1
+        block_ids = []
+        for block in sender.iter_best_chain(start_height):
+            block_ids.append(block["block_id"])
+            if len(block_ids) >= LOCATOR_INV_LIMIT:
+                break
+        if not block_ids:
+            break
+        messages.append({"type": "INV", "sender_id": "5001", "block_ids": block_ids, "message_id": "0" * 36})
+        missing.extend(block_id for block_id in block_ids if block_id not in receiver)
+        if len(block_ids) < LOCATOR_INV_LIMIT:
+            break
+        continue_from = block_ids[-1]
+    return messages, missing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--lag", type=int, default=10, help="接收方比发送方少的区块数")
+    parser.add_argument("--fork-depth", type=int, default=0, help="接收方在距自己链顶多少个区块处分叉，0表示不分叉")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"lag={args.lag} fork_depth={args.fork_depth} inv_limit={LOCATOR_INV_LIMIT}")
+    print(f"{'blocks':>8} {'method':<9}{'messages':>10}{'ids':>8}{'json KB':>10}{'binary KB':>11}"
+          f"{'cpu ms':>9}{'missing':>9}")
+    for size in args.sizes:
+        sender = ChainStore()
+        for block in make_chain(size):
+            sender.add_block(block)
+        receiver = ChainStore()
+        receiver_height = size - args.lag
+        fork_height = receiver_height - args.fork_depth if args.fork_depth else None
+        for block in make_chain(receiver_height, fork_height, miner="5002"):
+            receiver.add_block(block)
+
+        for method, run in (("full-inv", full_inv_round), ("locator", locator_round)):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                messages, missing = run(sender, receiver)
+            cpu_ms = (time.perf_counter() - start) * 1000 / args.repeat
+            ids = sum(len(m.get("block_ids", m.get("locator", []))) for m in messages)
+            json_bytes = binary_bytes = 0
+            for message in messages:
+                j, b = sizes_of(message)
+                json_bytes += j
+                binary_bytes += b
+            print(f"{size:>8} {method:<9}{len(messages):>10}{ids:>8}{json_bytes / 1024:>10.1f}"
+                  f"{binary_bytes / 1024:>11.1f}{cpu_ms:>9.2f}{len(missing):>9}")
+
+
+if __name__ == "__main__":
+    main()
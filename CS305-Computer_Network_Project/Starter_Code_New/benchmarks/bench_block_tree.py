@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模拟多个相互竞争的矿工产生分叉，把所有区块按产生顺序加入ChainStore，
+测量每个区块的加入耗时（包括链顶切换和主链重组），并与每次链顶变化都从链顶回溯到创世区块重建主链的做法对比
+
+用法: python benchmarks/bench_block_tree.py --blocks 50000 --miners 4 --sync-prob 0.3
+"""
+
+import sys
+import os
+import argparse
+import random
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from chain_store import ChainStore
+
+
+def simulate_miners(count, miners, sync_prob, seed):
+    """
+    每一步随机一个矿工在自己看到的链顶上出块；每个矿工以sync_prob的概率同步到全网最高的链顶，
+    没有同步的矿工继续在自己的分支上挖，从而产生不同深度的分叉
+    """
+    rng = random.Random(seed)
+    genesis = {"block_id": "g", "previous_block_id": None, "height": 0}
+    blocks = [genesis]
+    tips = [genesis] * miners
+    best = genesis
+    for i in range(count):
+        miner = rng.randrange(miners)
+        parent = tips[miner]
+        block = {"block_id": f"{miner}-{i}", "previous_block_id": parent["block_id"],
+                 "height": parent["height"] + 1}
+        blocks.append(block)
+        tips[miner] = block
+        if block["height"] > best["height"]:
+            best = block
+        for other in range(miners):
+            if rng.random() < sync_prob:
+                tips[other] = best
+    return blocks
+
+
+def rebuild_best_chain(by_id, tip):
+    """对比方案：从链顶回溯到创世区块重建整条主链"""
+    best = {}
+    block = tip
+    while block is not None:
+        best[block["height"]] = block["block_id"]
+        block = by_id.get(block["previous_block_id"])
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=50000)
+    parser.add_argument("--miners", type=int, default=4)
+    parser.add_argument("--sync-prob", type=float, default=0.3)
+    parser.add_argument("--rebuild-blocks", type=int, default=5000,
+                        help="重建主链的方案是O(n)每次，只用较少的区块测量")
+    parser.add_argument("--seed", type=int, default=305)
+    args = parser.parse_args()
+
+    blocks = simulate_miners(args.blocks, args.miners, args.sync_prob, args.seed)
+    store = ChainStore()
+    start = time.perf_counter()
+    for block in blocks:
+        store.add_block(block)
+    elapsed = time.perf_counter() - start
+    stats = store.best_chain_stats()
+
+    # 主链必须是从链顶回溯得到的那条链
+    assert store.best == rebuild_best_chain(store.by_id, store.tip())
+
+    print(f"miners={args.miners} sync_prob={args.sync_prob}")
+    print(f"blocks={stats['blocks']} best_chain={stats['best_chain_length']} fork_blocks={stats['fork_blocks']} "
+          f"reorgs={stats['reorgs']} max_reorg_depth={stats['max_reorg_depth']}")
+    print(f"{'implementation':<20}{'blocks':>9}{'total s':>10}{'us/block':>10}")
+    print(f"{'incremental reorg':<20}{len(blocks):>9}{elapsed:>10.3f}{elapsed / len(blocks) * 1e6:>10.1f}")
+
+    subset = blocks[:args.rebuild_blocks]
+    by_id = {}
+    tip = None
+    start = time.perf_counter()
+    for block in subset:
+        by_id[block["block_id"]] = block
+        if tip is None or block["height"] > tip["height"]:
+            tip = block
+            rebuild_best_chain(by_id, tip)
+    elapsed = time.perf_counter() - start
+    print(f"{'rebuild from tip':<20}{len(subset):>9}{elapsed:>10.3f}{elapsed / len(subset) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
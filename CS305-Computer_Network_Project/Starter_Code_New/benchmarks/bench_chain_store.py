@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+向block_handler.handle_block连续加入大量区块，测量chain_store索引下的吞吐，
+并与旧的逐个扫描received_blocks的实现（查重、查创世区块、找父区块）对比；
+同时对比INV消息的缺失区块检查（列表 vs 哈希索引）以及按高度的范围查询（过滤+排序 vs 高度索引）
+
+用法: python benchmarks/bench_chain_store.py --blocks 100000 --legacy-blocks 5000 --inv-size 500
+"""
+
+import sys
+import os
+import argparse
+import logging
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import block_handler
+
+
+def make_chain(count):
+    """线性链，区块ID不做哈希计算（handle_block不校验哈希）"""
+    blocks = []
+    previous = None
+    for height in range(count):
+        block_id = f"{height:064x}"
+        blocks.append({"type": "BLOCK", "peer_id": "5001", "timestamp": 0, "block_id": block_id,
+                       "previous_block_id": previous, "height": height, "transactions": []})
+        previous = block_id
+    return blocks
+
+
+def legacy_handle_block(received_blocks, header_store, msg):
+    """旧的handle_block中对received_blocks的三次线性扫描"""
+    for block in received_blocks:
+        if block["block_id"] == msg["block_id"]:
+            return
+    previous_block_id = msg.get("previous_block_id")
+    if previous_block_id is None:
+        for block in received_blocks:
+            if block.get("previous_block_id") is None:
+                return
+    is_previous_block_exist = False
+    for block in received_blocks:
+        if block["block_id"] == previous_block_id:
+            is_previous_block_exist = True
+            break
+    if previous_block_id is None or is_previous_block_exist:
+        received_blocks.append(msg)
+        header_store.append({"block_id": msg["block_id"], "previous_block_id": previous_block_id,
+                             "height": msg.get("height", 0)})
+
+
+def run_ingest(handle, blocks):
+    start = time.perf_counter()
+    for block in blocks:
+        handle(block)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=100000)
+    parser.add_argument("--legacy-blocks", type=int, default=5000,
+                        help="旧实现是O(n^2)，只用较短的链测量")
+    parser.add_argument("--inv-size", type=int, default=500)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'implementation':<16}{'blocks':>9}{'total s':>10}{'us/block':>10}{'blocks/s':>11}")
+    legacy_blocks, legacy_headers = [], []
+    chain = make_chain(args.legacy_blocks)
+    elapsed = run_ingest(lambda b: legacy_handle_block(legacy_blocks, legacy_headers, b), chain)
+    print(f"{'linear scan':<16}{len(legacy_blocks):>9}{elapsed:>10.2f}{elapsed / len(chain) * 1e6:>10.1f}"
+          f"{len(chain) / elapsed:>11.0f}")
+
+    chain = make_chain(args.blocks)
+    elapsed = run_ingest(lambda b: block_handler.handle_block(b, "5001"), chain)
+    store = block_handler.chain_store
+    assert len(store) == args.blocks and len(block_handler.received_blocks) == args.blocks
+    print(f"{'chain_store':<16}{len(store):>9}{elapsed:>10.2f}{elapsed / len(chain) * 1e6:>10.1f}"
+          f"{len(chain) / elapsed:>11.0f}")
+
+    # INV检查：一半已知一半未知的区块ID
+    inv_ids = [b["block_id"] for b in chain[-args.inv_size // 2:]] + \
+              [f"{i:064x}" for i in range(args.blocks, args.blocks + args.inv_size // 2)]
+    local_list = [b["block_id"] for b in legacy_blocks]
+    start = time.perf_counter()
+    missing_list = [i for i in inv_ids if i not in local_list]
+    list_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    missing_index = [i for i in inv_ids if i not in store]
+    index_ms = (time.perf_counter() - start) * 1000
+    print(f"\nINV of {len(inv_ids)} ids: list of {len(local_list)} blocks {list_ms:.2f} ms "
+          f"({len(missing_list)} missing), chain_store of {len(store)} blocks {index_ms:.3f} ms "
+          f"({len(missing_index)} missing)")
+
+    # 范围查询：从链中间取50个区块（GET_LATEST_BLOCK分批同步的大小）
+    height = args.blocks // 2
+    start = time.perf_counter()
+    legacy = sorted([b for b in block_handler.received_blocks if b.get("height", 0) > height],
+                    key=lambda b: b.get("height", 0))[:50]
+    scan_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    indexed = block_handler.get_blocks_since_height(height, limit=50)
+    index_ms = (time.perf_counter() - start) * 1000
+    assert legacy == indexed
+    print(f"50 blocks after height {height}: filter+sort {scan_ms:.2f} ms, height index {index_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对比json与二进制编码在dispatch_message支持的各类消息上的大小和编解码耗时，
+以及超过压缩阈值时zlib压缩后的大小
+
+用法: python benchmarks/bench_codec.py --rounds 2000
+"""
+
+import sys
+import os
+import argparse
+import logging
+import random
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from codec import CODECS, encode_payload, decode_payload
+from framing import FLAG_ZLIB
+from transaction import TransactionMessage
+from block_handler import compute_block_hash, create_getblock
+from inv_message import create_inv
+from peer_manager import create_pong
+from utils import generate_message_id
+
+
+def make_tx():
+    return TransactionMessage(sender=str(random.randint(5000, 5010)),
+                              receiver=str(random.randint(5000, 5010)),
+                              amount=random.randint(0, 100)).to_dict()
+
+
+def make_block(height, previous_block_id, tx_count=5):
+    block = {
+        "type": "BLOCK",
+        "peer_id": "5001",
+        "timestamp": time.time(),
+        "block_id": "",
+        "previous_block_id": previous_block_id,
+        "height": height,
+        "transactions": [make_tx() for _ in range(tx_count)],
+        "message_id": generate_message_id()
+    }
+    block["block_id"] = compute_block_hash(block)
+    return block
+
+
+def sample_messages():
+    blocks = []
+    previous = None
+    for height in range(50):
+        block = make_block(height, previous)
+        blocks.append(block)
+        previous = block["block_id"]
+    headers = [{"block_id": b["block_id"], "previous_block_id": b["previous_block_id"], "height": b["height"]}
+               for b in blocks]
+    ping = {"type": "PING", "sender_id": "5001", "timestamp": time.time(), "message_id": generate_message_id()}
+
+    return {
+        "PING": ping,
+        "PONG": create_pong("5002", ping["timestamp"]),
+        "TX": make_tx(),
+        "BLOCK": blocks[-1],
+        "INV": create_inv("5001", [b["block_id"] for b in blocks]),
+        "GETBLOCK": create_getblock("5001", [b["block_id"] for b in blocks[:20]]),
+        "GET_BLOCK_HEADERS": {"type": "GET_BLOCK_HEADERS", "sender_id": "5001", "start_height": 0,
+                              "end_height": 99, "is_new_node": True, "message_id": generate_message_id()},
+        "BLOCK_HEADERS": {"type": "BLOCK_HEADERS", "sender_id": "5002", "headers": headers,
+                          "is_full_chain": True, "start_height": 0, "end_height": 49,
+                          "message_id": generate_message_id()},
+        "BLOCK_BATCH": {"type": "BLOCK_BATCH", "sender_id": "5002", "blocks": blocks, "has_more": False,
+                        "next_height": 0, "message_id": generate_message_id()},
+        "GET_LATEST_BLOCK": {"type": "GET_LATEST_BLOCK", "sender_id": "5001", "current_height": 10,
+                             "is_new_node": True, "message_id": generate_message_id()},
+        "RELAY": {"type": "RELAY", "sender_id": "5001", "target_id": "5003", "payload": make_tx()},
+        "GET_MEMPOOL": {"type": "GET_MEMPOOL", "sender_id": "5001", "message_id": generate_message_id()},
+        "MEMPOOL_DATA": {"type": "MEMPOOL_DATA", "sender_id": "5002",
+                         "transactions": [make_tx() for _ in range(30)], "message_id": generate_message_id()},
+        "HELLO": {"type": "HELLO", "sender_id": "5001", "ip": "172.28.0.11", "port": 5001,
+                  "flags": {"nat": False, "light": False, "framing": "length", "codecs": ["binary", "json"],
+                            "new_node": False},
+                  "message_id": generate_message_id()},
+        "NEW_PEER": {"type": "NEW_PEER", "new_peer_id": "5011", "new_peer_ip": "172.28.0.21",
+                     "new_peer_port": 5011, "new_peer_flags": {"nat": False, "light": True},
+                     "sender_id": "5001", "message_id": generate_message_id()},
+        "GOODBYE": {"type": "GOODBYE", "sender_id": "5001", "reason": "normal_shutdown",
+                    "pending_transactions": [make_tx() for _ in range(10)], "has_more_transactions": False,
+                    "message_id": generate_message_id(), "timestamp": time.time()},
+    }
+
+
+def time_per_op(func, arg, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(305)
+
+    json_codec = CODECS["json"]
+    binary_codec = CODECS["binary"]
+    print(f"{'type':<18}{'json B':>9}{'bin B':>9}{'ratio':>7}{'zlib B':>9}{'json enc us':>13}{'bin enc us':>12}"
+          f"{'json dec us':>13}{'bin dec us':>12}")
+    for msg_type, message in sample_messages().items():
+        json_payload = json_codec.encode(message)
+        flags, binary_payload = encode_payload(message, binary_codec)
+        # 二进制编码必须无损，否则区块哈希校验会失败
+        assert decode_payload(flags, memoryview(binary_payload)) == message, msg_type
+        if msg_type == "BLOCK":
+            assert compute_block_hash(decode_payload(flags, binary_payload)) == message["block_id"]
+
+        zlib_flags, zlib_payload = encode_payload(message, binary_codec, compress=True)
+        assert decode_payload(zlib_flags, zlib_payload) == message, msg_type
+        zlib_size = str(len(zlib_payload)) if zlib_flags & FLAG_ZLIB else "-"
+
+        fallback = "" if flags else "  (json回退)"
+        print(f"{msg_type:<18}{len(json_payload):>9}{len(binary_payload):>9}"
+              f"{len(binary_payload) / len(json_payload):>7.2f}{zlib_size:>9}"
+              f"{time_per_op(json_codec.encode, message, args.rounds):>13.1f}"
+              f"{time_per_op(lambda m: encode_payload(m, binary_codec), message, args.rounds):>12.1f}"
+              f"{time_per_op(json_codec.decode, json_payload, args.rounds):>13.1f}"
+              f"{time_per_op(lambda p: decode_payload(flags, p), binary_payload, args.rounds):>12.1f}"
+              f"{fallback}")
+
+
+if __name__ == "__main__":
+    main()
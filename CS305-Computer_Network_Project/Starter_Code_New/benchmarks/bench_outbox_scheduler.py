@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测量outbox发送调度器的空闲CPU占用和消息排队时间，
+并与旧的每10ms轮询一次队列的发送线程对比（实际网络发送被替换为空操作）
+
+用法: python benchmarks/bench_outbox_scheduler.py --workers 1 2 4 --messages 20000 --peers 50
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import subprocess
+import threading
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import outbox
+
+
+def fake_send(self_id, target_id, messages, on_complete=None):
+    # 只测量调度开销，不做实际发送
+    if on_complete:
+        on_complete([])
+    return []
+
+
+def start_polling_workers(workers):
+    """旧实现：每轮复制 list(queues.keys()) 轮询各节点，每轮sleep 10ms"""
+    def worker():
+        last_peer_index = 0
+        while True:
+            try:
+                peers = list(outbox.queues.keys())
+                if not peers:
+                    time.sleep(0.1)
+                    continue
+                if last_peer_index >= len(peers):
+                    last_peer_index = 0
+                target_id = peers[last_peer_index]
+                last_peer_index = (last_peer_index + 1) % len(peers)
+                with outbox.lock:
+                    batch = outbox.queues[target_id].pop_batch(outbox.BATCH_MAX_MESSAGES)
+                if batch:
+                    outbox.scheduler_stats.record(batch)
+                    fake_send(None, target_id, [entry[0] for entry in batch])
+            finally:
+                time.sleep(0.01)
+
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+
+def run_once(mode, workers, messages, peers, idle_seconds):
+    logging.getLogger().setLevel(logging.WARNING)
+    outbox.outbound_limiter.configure(limit=messages)
+    outbox.QUEUE_LIMIT = messages
+    outbox.relay_or_direct_send_batch = fake_send
+    peer_ids = [f"peer{i}" for i in range(peers)]
+    if mode == "polling":
+        # 旧实现轮询的是已出现过的节点，先让所有节点出现在queues中
+        for peer_id in peer_ids:
+            outbox.queues[peer_id]
+        start_polling_workers(workers)
+    else:
+        outbox.send_from_queue("bench", workers)
+
+    # 空闲时的CPU占用
+    time.sleep(0.2)
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / idle_seconds * 100
+
+    # 负载下的排队时间：生产者按固定速率入队
+    start = time.perf_counter()
+    for i in range(messages):
+        outbox.enqueue_message(peer_ids[i % peers], "127.0.0.1", 0, {"type": "PING", "sender_id": "bench", "n": i})
+        if i % 100 == 99:
+            time.sleep(0.001)
+    while outbox.scheduler_stats.messages < messages and time.perf_counter() - start < 120:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+
+    stats = outbox.scheduler_stats.stats()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "idle_cpu_pct": idle_cpu,
+        "messages": outbox.scheduler_stats.messages,
+        "seconds": elapsed,
+        "avg_wait_ms": stats["avg_wait_ms"],
+        "max_wait_ms": stats["max_wait_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--peers", type=int, default=50)
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    parser.add_argument("--run", choices=["polling", "event"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # 发送线程启动后无法停止，每种配置在单独的子进程中运行
+        print(json.dumps(run_once(args.run, args.workers[0], args.messages, args.peers, args.idle_seconds)))
+        return
+
+    print(f"{'mode':<9}{'workers':>8}{'idle cpu %':>12}{'messages':>10}{'seconds':>9}{'avg wait ms':>13}{'max wait ms':>13}")
+    for mode in ["polling", "event"]:
+        for workers in args.workers:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", mode,
+                                     "--workers", str(workers), "--messages", str(args.messages),
+                                     "--peers", str(args.peers), "--idle-seconds", str(args.idle_seconds)],
+                                    capture_output=True, text=True, check=True).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{r['mode']:<9}{r['workers']:>8}{r['idle_cpu_pct']:>12.2f}{r['messages']:>10}{r['seconds']:>9.2f}"
+                  f"{r['avg_wait_ms']:>13.2f}{r['max_wait_ms']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
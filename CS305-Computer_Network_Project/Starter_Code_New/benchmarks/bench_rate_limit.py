@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对比旧的基于时间戳列表的限流检查与rate_limits中滑动窗口计数器的单次检查耗时
+
+用法: python benchmarks/bench_rate_limit.py --checks 200000 --window 0.2 --limits 10 1000 10000
+"""
+
+import sys
+import os
+import argparse
+import time
+from collections import defaultdict
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from rate_limits import RateLimiterGroup
+
+
+def make_outbound_list_limiter(limit, window):
+    """旧的outbox.is_rate_limited：每个节点一个时间戳列表，用pop(0)清理过期时间戳"""
+    timestamps_by_peer = defaultdict(list)
+
+    def is_limited(peer_id):
+        current_time = time.time()
+        timestamps = timestamps_by_peer[str(peer_id)]
+        while timestamps and window < current_time - timestamps[0]:
+            timestamps.pop(0)
+        if len(timestamps) >= limit:
+            return True
+        timestamps.append(current_time)
+        return False
+
+    return is_limited
+
+
+def make_inbound_list_limiter(limit, window):
+    """旧的message_handler.is_inbound_limited：每条消息都用列表推导重建时间戳列表"""
+    timestamps_by_peer = defaultdict(list)
+
+    def is_limited(peer_id):
+        current_time = time.time()
+        str_peer_id = str(peer_id)
+        timestamps_by_peer[str_peer_id].append(current_time)
+        timestamps_by_peer[str_peer_id] = [ts for ts in timestamps_by_peer[str_peer_id]
+                                           if current_time - ts <= window]
+        return len(timestamps_by_peer[str_peer_id]) > limit
+
+    return is_limited
+
+
+def run(is_limited, checks, peers):
+    peer_ids = [str(5000 + i) for i in range(peers)]
+    rejected = 0
+    start = time.perf_counter()
+    for i in range(checks):
+        if is_limited(peer_ids[i % peers]):
+            rejected += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / checks * 1e9, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--peers", type=int, default=10)
+    parser.add_argument("--window", type=float, default=0.2,
+                        help="时间窗口（秒），较短的窗口让过期清理在测试期间持续发生")
+    parser.add_argument("--limits", type=int, nargs="+", default=[10, 1000, 10000],
+                        help="每个窗口允许的消息数，即旧实现中列表的最大长度")
+    args = parser.parse_args()
+
+    print(f"{'limiter':<22}{'limit':>8}{'ns/check':>12}{'rejected':>10}")
+    for limit in args.limits:
+        limiters = [
+            ("outbound list", make_outbound_list_limiter(limit, args.window)),
+            ("inbound list", make_inbound_list_limiter(limit, args.window)),
+            ("sliding window", RateLimiterGroup("bench", limit, args.window).is_limited),
+            ("sliding window (in)", RateLimiterGroup("bench", limit, args.window, count_rejected=True).is_limited),
+        ]
+        for name, is_limited in limiters:
+            ns_per_check, rejected = run(is_limited, args.checks, args.peers)
+            print(f"{name:<22}{limit:>8}{ns_per_check:>12.0f}{rejected:>10}")
+
+
+if __name__ == "__main__":
+    main()
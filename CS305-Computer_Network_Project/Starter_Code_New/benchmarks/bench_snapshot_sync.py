@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+比较新节点的两种初始同步方式从开始同步到链顶一致（time-to-synced）的时间：
+逐段同步（每轮请求100个区块头，再逐个接收区块）与快照同步（并行下载分块后只同步检查点之后的区块）。
+消息在进程内传递：编码/解码、哈希校验和加入ChainStore的CPU开销实际测量，网络往返按--rtt-ms计入。
+还给出逐段同步在默认出站限流（每个节点RATE_LIMIT条/TIME_WINDOW秒）下发送所有消息所需时间的下限。
+
+用法: python benchmarks/bench_snapshot_sync.py --sizes 1000 10000 100000 --rtt-ms 50 --peers 2
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import math
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from chain_store import ChainStore
+from block_handler import compute_block_hash
+from outbox import RATE_LIMIT, TIME_WINDOW
+import snapshot
+
+HEADERS_PER_REQUEST = 100  # 逐段同步每轮请求的区块头数
+
+
+def make_chain(count):
+    blocks = []
+    previous = None
+    for height in range(1, count + 1):
+        block = {"type": "BLOCK", "peer_id": "5001", "timestamp": float(height), "block_id": "",
+                 "previous_block_id": previous, "height": height, "transactions": [],
+                 "message_id": f"{height:032x}"}
+        block["block_id"] = compute_block_hash(block)
+        blocks.append(block)
+        previous = block["block_id"]
+    return blocks
+
+
+def transfer(message):
+    """模拟一条消息的编码和解码"""
+    return json.loads(json.dumps(message))
+
+
+def sync_by_ranges(source, client, start_height):
+    """逐段同步：每轮请求一段区块头，再接收其中缺失的区块。返回(轮数, 消息数)"""
+    rounds = messages = 0
+    height = start_height
+    tip_height = source.tip_height()
+    while height <= tip_height:
+        end_height = height + HEADERS_PER_REQUEST - 1
+        headers = transfer({"type": "BLOCK_HEADERS", "headers": list(source.iter_best_headers(height, end_height))})
+        missing = [h["block_id"] for h in headers["headers"] if h["block_id"] not in client]
+        messages += 2 + math.ceil(len(missing) / 20)  # GET_BLOCK_HEADERS, BLOCK_HEADERS, GETBLOCK
+        for block_id in missing:
+            block = transfer(source.get(block_id))
+            assert compute_block_hash(block) == block["block_id"]
+            client.add_block(block)
+            messages += 1
+        # 下一段的区块头请求在发出GETBLOCK后立即发送，区块传输与下一轮重叠，每段约一个往返
+        rounds += 1
+        height = end_height + 1
+    return rounds, messages
+
+
+def sync_by_snapshot(source, client, peers, window):
+    """快照同步：下载检查点快照，再逐段同步检查点之后的部分。返回(轮数, 消息数, 生成快照耗时)"""
+    producer = snapshot.SnapshotProducer(source)
+    start = time.perf_counter()
+    current = producer.refresh()
+    build_seconds = time.perf_counter() - start
+    if current is None:
+        rounds, messages = sync_by_ranges(source, client, 0)
+        return rounds, messages, build_seconds
+
+    download = snapshot.SnapshotDownload(window=window)
+    for peer in range(peers):
+        download.add_manifest(peer, transfer(current.manifest()))
+    download.choose()
+    rounds, messages = 1, 2 * peers
+    while not download.done:
+        for peer, index in download.next_requests():
+            chunk = transfer({"blocks": producer.get_chunk(current.snapshot_hash, index)})
+            assert download.add_chunk(current.snapshot_hash, index, chunk["blocks"])
+            messages += 2
+        download.apply_ready(client)
+        rounds += 1
+    tail_rounds, tail_messages = sync_by_ranges(source, client, current.height + 1)
+    return rounds + tail_rounds, messages + tail_messages, build_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    parser.add_argument("--peers", type=int, default=2, help="提供同一快照的节点数")
+    parser.add_argument("--window", type=int, default=snapshot.SNAPSHOT_WINDOW)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rtt = args.rtt_ms / 1000
+    print(f"rtt={args.rtt_ms}ms peers={args.peers} window={args.window} "
+          f"chunk={snapshot.SNAPSHOT_CHUNK_BLOCKS} blocks, checkpoint every {snapshot.SNAPSHOT_INTERVAL}")
+    print(f"{'blocks':>8} {'method':<10}{'rounds':>8}{'messages':>10}{'cpu s':>9}{'synced s':>10}"
+          f"{'rate-limited s':>16}{'build ms':>10}")
+    for size in args.sizes:
+        source = ChainStore()
+        # 链顶比检查点多出一段尾部，快照之后还需要逐段同步
+        for block in make_chain(size + snapshot.SNAPSHOT_CONFIRMATIONS + 50):
+            source.add_block(block)
+
+        for method in ("ranges", "snapshot"):
+            client = ChainStore()
+            start = time.perf_counter()
+            if method == "ranges":
+                rounds, messages = sync_by_ranges(source, client, 0)
+                build_ms = ""
+            else:
+                rounds, messages, build_seconds = sync_by_snapshot(source, client, args.peers, args.window)
+                build_ms = f"{build_seconds * 1000:.0f}"
+            cpu = time.perf_counter() - start
+            assert client.tip_id == source.tip_id
+            # 快照分块消息有单独的限流配额，不受默认限制影响
+            limited = f"{messages * TIME_WINDOW / RATE_LIMIT:.0f}" if method == "ranges" else "-"
+            print(f"{size:>8} {method:<10}{rounds:>8}{messages:>10}{cpu:>9.2f}{cpu + rounds * rtt:>10.2f}"
+                  f"{limited:>16}{build_ms:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对比asyncio模式与旧的每连接一线程模式的socket服务器:
+保持的连接数、服务器线程数以及每秒处理的消息数
+
+用法: python benchmarks/bench_socket_server.py --connections 200 --messages 50
+"""
+
+import sys
+import os
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from socket_server import start_socket_server
+
+
+def wait_until_listening(port, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def run_server_benchmark(use_asyncio, port, connections, messages):
+    total = connections * messages
+    senders = set()
+    received = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handler(msg, self_id, self_ip):
+        with lock:
+            received[0] += 1
+            senders.add(msg["sender_id"])
+            if received[0] >= total:
+                done.set()
+
+    start_socket_server("bench", "127.0.0.1", port, use_asyncio=use_asyncio, handler=handler)
+    if not wait_until_listening(port):
+        raise RuntimeError(f"服务器未能在端口 {port} 上启动")
+    # 探测连接本身也会占用一个处理线程，等待其结束
+    time.sleep(0.2)
+    threads_before = threading.active_count()
+
+    clients = []
+    for i in range(connections):
+        clients.append(socket.create_connection(("127.0.0.1", port), timeout=10))
+    time.sleep(0.5)
+    server_threads = threading.active_count() - threads_before
+
+    start = time.perf_counter()
+    for i, client in enumerate(clients):
+        line = json.dumps({"type": "PING", "sender_id": f"c{i}", "timestamp": time.time()}) + "\n"
+        client.sendall(line.encode() * messages)
+    finished = done.wait(timeout=120)
+    elapsed = time.perf_counter() - start
+
+    for client in clients:
+        client.close()
+
+    return {
+        "server": "asyncio" if use_asyncio else "threaded",
+        "connections_held": len(senders),
+        "server_threads": server_threads,
+        "messages": received[0],
+        "seconds": elapsed,
+        "msgs_per_sec": received[0] / elapsed if elapsed > 0 else 0.0,
+        "completed": finished
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50, help="每个连接发送的消息数")
+    parser.add_argument("--port", type=int, default=19500)
+    args = parser.parse_args()
+
+    # 压测时关闭逐条消息的INFO日志
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = [
+        run_server_benchmark(False, args.port, args.connections, args.messages),
+        run_server_benchmark(True, args.port + 1, args.connections, args.messages),
+    ]
+
+    print(f"{'server':<10}{'conns held':>12}{'threads':>10}{'messages':>10}{'seconds':>10}{'msgs/s':>12}")
+    for r in results:
+        print(f"{r['server']:<10}{r['connections_held']:>12}{r['server_threads']:>10}{r['messages']:>10}"
+              f"{r['seconds']:>10.3f}{r['msgs_per_sec']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import time
+import heapq
+import threading
+import logging
+from collections import deque
+from peer_discovery import known_peers, peer_flags
+from peer_manager import peer_status, rtt_tracker, blacklist
+from outbox import enqueue_message, outbound_limiter
+from block_handler import handle_block, create_getblock, chain_store
+
+logger = logging.getLogger(__name__)
+
+# === Parallel Block Download ===
+# 收到区块头后，缺失的区块按高度切成每段DOWNLOAD_RANGE_BLOCKS个的下载段，分配给所有ALIVE的完整节点：
+# 每次把下一段交给 (在途段数 + 1) * RTT 最小的节点（RTT来自rtt_tracker，未知时按DOWNLOAD_DEFAULT_RTT），
+# 每个节点最多DOWNLOAD_WINDOW个在途段。超时的段换一个节点重新请求，超过DOWNLOAD_MAX_ATTEMPTS次后放弃。
+# 收到的区块先缓存，按高度顺序交给handle_block，前面的区块还没到时后面的区块等待（放弃的区块不再等待）。
+DOWNLOAD_RANGE_BLOCKS = 16    # 每个下载段（一条GETBLOCK）的区块数
+DOWNLOAD_WINDOW = 4           # 每个节点的在途下载段上限
+DOWNLOAD_TIMEOUT = 5          # 下载段的基础超时（秒），实际超时再加上4倍RTT
+DOWNLOAD_DEFAULT_RTT = 0.5    # 没有RTT记录的节点按这个值计算（秒）
+DOWNLOAD_MAX_ATTEMPTS = 4     # 每个下载段最多请求的次数
+DOWNLOAD_TICK_SECONDS = 0.5   # 检查超时和补充请求的间隔
+DOWNLOAD_RATE_LIMIT = 200     # GETBLOCK和BLOCK单独的速率限制（每个限流窗口内的消息数）
+
+# 每个GETBLOCK会换来最多DOWNLOAD_RANGE_BLOCKS条BLOCK消息，默认的每节点消息配额只够下载零星几个区块
+for _msg_type in ("GETBLOCK", "BLOCK"):
+    outbound_limiter.set_type_limit(_msg_type, DOWNLOAD_RATE_LIMIT)
+
+class DownloadRange:
+    """一个下载段：一组按高度排列的区块ID"""
+    __slots__ = ("block_ids", "peer_id", "requested_at", "attempts", "failed_peers")
+
+    def __init__(self, block_ids):
+        self.block_ids = block_ids
+        self.peer_id = None
+        self.requested_at = 0.0
+        self.attempts = 0
+        self.failed_peers = set()
+
+class BlockDownloadScheduler:
+    """把缺失区块的下载分摊到多个节点，并按高度顺序处理收到的区块"""
+    def __init__(self, range_blocks=DOWNLOAD_RANGE_BLOCKS, window=DOWNLOAD_WINDOW, timeout=DOWNLOAD_TIMEOUT,
+                 max_attempts=DOWNLOAD_MAX_ATTEMPTS):
+        self.range_blocks = range_blocks
+        self.window = window
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.self_id = None
+        self.queued = deque()   # 等待分配的下载段（先进先出）
+        self.in_flight = {}     # {id(range): DownloadRange}
+        self.range_of = {}      # {block_id: DownloadRange}，尚未收到的区块
+        self.order = []         # 最小堆 [(height, block_id)]，尚未交给handle_block的已计划区块
+        self.arrived = {}       # {block_id: (block, sender_id)}，已收到但前面还有区块没到
+        self.skipped = set()    # 放弃下载的区块ID
+        self.peer_failures = {} # {peer_id: 超时次数}
+        self.header_peers = set() # 发来过区块头的节点，即使还不是ALIVE也可以请求
+        self.send = self._send_getblock
+        self.stats_counters = {"scheduled": 0, "requests": 0, "reassigned": 0, "delivered": 0, "abandoned": 0}
+        self.lock = threading.RLock()
+
+    def _send_getblock(self, peer_id, block_ids):
+        if peer_id not in known_peers:
+            return False
+        ip, port = known_peers[peer_id]
+        return enqueue_message(peer_id, ip, port, create_getblock(self.self_id, block_ids)) is not False
+
+    def candidate_peers(self):
+        """可以下载区块的节点：ALIVE、不在黑名单中的完整节点，以及发来过区块头的节点"""
+        peers = [peer_id for peer_id in known_peers
+                 if peer_id != self.self_id and peer_status.get(peer_id) == "ALIVE"
+                 and not peer_flags.get(peer_id, {}).get("light", False) and peer_id not in blacklist]
+        for peer_id in self.header_peers:
+            if peer_id not in peers and peer_id not in blacklist and peer_id in known_peers:
+                peers.append(peer_id)
+        return peers
+
+    def schedule(self, headers, self_id, hint_peer=None):
+        """为区块头中本地还没有的区块安排下载，返回新安排的区块数"""
+        with self.lock:
+            self.self_id = self_id
+            if hint_peer is not None:
+                self.header_peers.add(hint_peer)
+            block_ids = []
+            for header in sorted(headers, key=lambda h: h.get("height", 0)):
+                block_id = header.get("block_id")
+                if not block_id or block_id in chain_store or block_id in self.range_of or block_id in self.arrived:
+                    continue
+                block_ids.append(block_id)
+                heapq.heappush(self.order, (header.get("height", 0), block_id))
+                self.skipped.discard(block_id)
+            for i in range(0, len(block_ids), self.range_blocks):
+                download_range = DownloadRange(block_ids[i:i + self.range_blocks])
+                for block_id in download_range.block_ids:
+                    self.range_of[block_id] = download_range
+                self.queued.append(download_range)
+            self.stats_counters["scheduled"] += len(block_ids)
+            self.tick()
+            return len(block_ids)
+
+    def _rtt(self, peer_id):
+        rtt = rtt_tracker.get(peer_id)
+        return rtt if rtt is not None and rtt > 0 else DOWNLOAD_DEFAULT_RTT
+
+    def _range_timeout(self, peer_id):
+        return self.timeout + 4 * self._rtt(peer_id)
+
+    def tick(self, now=None):
+        """重新分配超时的下载段，并在各节点窗口允许的范围内发出新的请求"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            load = {}
+            for download_range in list(self.in_flight.values()):
+                if now - download_range.requested_at > self._range_timeout(download_range.peer_id):
+                    del self.in_flight[id(download_range)]
+                    download_range.failed_peers.add(download_range.peer_id)
+                    self.peer_failures[download_range.peer_id] = self.peer_failures.get(download_range.peer_id, 0) + 1
+                    if download_range.attempts >= self.max_attempts:
+                        self._abandon(download_range)
+                    else:
+                        self.stats_counters["reassigned"] += 1
+                        self.queued.appendleft(download_range)
+                else:
+                    load[download_range.peer_id] = load.get(download_range.peer_id, 0) + 1
+
+            peers = self.candidate_peers()
+            while self.queued:
+                available = [p for p in peers if load.get(p, 0) < self.window]
+                if not available:
+                    break
+                download_range = self.queued.popleft()
+                missing = [block_id for block_id in download_range.block_ids if self.range_of.get(block_id) is download_range]
+                if not missing:
+                    continue
+                # 优先交给没有在这一段上超时过的节点，都超时过时允许再试
+                choices = [p for p in available if p not in download_range.failed_peers] or available
+                # 预计完成时间最短的节点：超时过的节点额外降权
+                peer_id = min(choices, key=lambda p: (load.get(p, 0) + 1) * self._rtt(p)
+                              * (1 + self.peer_failures.get(p, 0)))
+                download_range.block_ids = missing
+                download_range.peer_id = peer_id
+                download_range.requested_at = now
+                download_range.attempts += 1
+                self.in_flight[id(download_range)] = download_range
+                load[peer_id] = load.get(peer_id, 0) + 1
+                self.stats_counters["requests"] += 1
+                self.send(peer_id, missing)
+            self._release()
+
+    def _abandon(self, download_range):
+        for block_id in download_range.block_ids:
+            if self.range_of.get(block_id) is download_range:
+                del self.range_of[block_id]
+                self.skipped.add(block_id)
+                self.stats_counters["abandoned"] += 1
+        logger.warning(f"放弃下载 {len(download_range.block_ids)} 个区块，已尝试 {download_range.attempts} 次")
+
+    def expects(self, block_id):
+        with self.lock:
+            return block_id in self.range_of
+
+    def deliver(self, block, sender_id):
+        """接收一个已安排下载的区块，返回False表示不是本调度器请求的区块（调用方照常处理）"""
+        with self.lock:
+            block_id = block.get("block_id")
+            download_range = self.range_of.pop(block_id, None)
+            if download_range is None:
+                return False
+            self.arrived[block_id] = (block, sender_id)
+            if all(self.range_of.get(b) is not download_range for b in download_range.block_ids):
+                self.in_flight.pop(id(download_range), None)
+                if download_range.peer_id is not None:
+                    self.peer_failures[download_range.peer_id] = 0
+                # 节点窗口空出，补充请求
+                self.tick()
+            else:
+                self._release()
+            return True
+
+    def _release(self):
+        # 按高度顺序把连续到达的区块交给handle_block
+        while self.order:
+            height, block_id = self.order[0]
+            if block_id in self.arrived:
+                heapq.heappop(self.order)
+                block, sender_id = self.arrived.pop(block_id)
+                try:
+                    handle_block(block, self.self_id, sender_id)
+                except Exception as e:
+                    logger.error(f"处理下载的区块 {block_id} 时出错: {e}")
+                self.stats_counters["delivered"] += 1
+            elif block_id in self.skipped or block_id in chain_store:
+                # 已放弃，或已通过其他途径（如INV）收到
+                heapq.heappop(self.order)
+                self.skipped.discard(block_id)
+                self.range_of.pop(block_id, None)
+            else:
+                break
+
+    def stats(self):
+        with self.lock:
+            per_peer = {}
+            for download_range in self.in_flight.values():
+                per_peer[download_range.peer_id] = per_peer.get(download_range.peer_id, 0) + 1
+            return dict(self.stats_counters,
+                        queued_ranges=len(self.queued),
+                        in_flight_ranges=len(self.in_flight),
+                        in_flight_by_peer=per_peer,
+                        waiting_blocks=len(self.range_of),
+                        buffered_blocks=len(self.arrived),
+                        peer_failures=dict(self.peer_failures))
+
+block_downloader = BlockDownloadScheduler()
+
+def start_block_download_loop(interval=DOWNLOAD_TICK_SECONDS):
+    """定期检查超时的下载段"""
+    def loop():
+        while True:
+            try:
+                block_downloader.tick()
+            except Exception as e:
+                logger.error(f"区块下载调度出错: {e}")
+            time.sleep(interval)
+    threading.Thread(target=loop, daemon=True).start()
+
+def get_download_stats():
+    return block_downloader.stats()
@@ -1,41 +1,64 @@
+import os
 import time
 import hashlib
 import json
 import threading
 import random
 import logging
+import itertools
+from collections import deque
 from transaction import get_recent_transactions, clear_pool
 from peer_discovery import known_peers, peer_config, peer_flags
 from utils import generate_message_id
 
 from outbox import enqueue_message, gossip_message
 from peer_manager import record_offense
+from chain_store import ChainStore
+from orphan_pool import OrphanPool
+from block_log import BlockLog, BLOCK_LOG_DIR
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-received_blocks = [] # The local blockchain. The blocks are added linearly at the end of the set.
-header_store = [] # The header of blocks in the local blockchain. Used by lightweight peers.
-orphan_blocks = {} # The block whose previous block is not in the local blockchain. Waiting for the previous block.
+chain_store = ChainStore() # 本地区块链和区块头的索引，加入区块必须通过chain_store
+received_blocks = chain_store.blocks # The local blockchain. The blocks are added linearly at the end of the set.
+header_store = chain_store.headers # The header of blocks in the local blockchain. Used by lightweight peers.
+orphan_pool = OrphanPool() # 孤块池，按前置区块索引
+orphan_blocks = orphan_pool.blocks # The block whose previous block is not in the local blockchain. Waiting for the previous block.
+block_log = None # 磁盘上的区块日志，由load_block_log打开
+RESYNC_OVERLAP = 10 # 从磁盘恢复后，从链顶往回这么多个高度开始同步，覆盖重启前最后几个区块可能发生的分叉
+
+def load_block_log(self_id, data_dir=BLOCK_LOG_DIR):
+    """从data_dir/<self_id>重放区块日志恢复chain_store，之后加入的区块都会追加写入该日志"""
+    global block_log
+    start = time.perf_counter()
+    block_log = BlockLog(os.path.join(data_dir, str(self_id)))
+    restored = block_log.replay(chain_store.add_block, chain_store.add_header)
+    chain_store.attach_log(block_log)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"[{self_id}] 从区块日志恢复{restored}条记录: {len(received_blocks)}个区块, "
+                f"{len(header_store)}个区块头, 链顶高度{chain_store.tip_height()}, 耗时{elapsed_ms:.1f}ms")
+    return restored
 
 #sync change(new peer join in)
 def request_block_sync(self_id, is_new_node=False):
     """请求区块同步，新节点有特殊处理"""
     # 创建消息
     if is_new_node:
-        # 新节点的初始同步 - 分批请求区块
-        current_height = get_latest_block_height()
-        
+        # 新节点的初始同步 - 流水线请求区块头，校验通过的部分立即开始下载区块
+        from header_sync import start_header_sync
+        start_header_sync(self_id)
+        return
+    if len(header_store) > 0:
+        # 已从区块日志恢复，只同步已知最高区块头附近及之后的部分（轻量级节点只有区块头）
+        start_height = max(0, chain_store.header_heights.heights[-1] - RESYNC_OVERLAP)
         msg = {
             "type": "GET_BLOCK_HEADERS",
             "sender_id": self_id,
-            "start_height": 0,
-            "end_height": 99,  # 每次请求100个区块头
-            "is_new_node": True,
+            "start_height": start_height,
             "message_id": generate_message_id()
         }
-        
-        logger.info(f"新节点 {self_id} 开始初始区块同步，请求高度范围[0-99]")
+        logger.info(f"节点 {self_id} 从高度 {start_height} 开始增量同步")
     else:
         # 常规同步
         msg = {
@@ -49,7 +72,7 @@ def request_block_sync(self_id, is_new_node=False):
         if peer_id != self_id:
             enqueue_message(peer_id, ip, port, msg)
 
-def block_generation(self_id, MALICIOUS_MODE, interval=20):
+def block_generation(self_id, MALICIOUS_MODE, interval=20, initial_sync=None):
     from inv_message import create_inv
     import threading
     
@@ -61,6 +84,10 @@ def block_generation(self_id, MALICIOUS_MODE, interval=20):
     def mine():
         nonlocal waiting_for_sync
         
+        # 新的完整节点先等快照同步结束：成功时已有区块，回退到逐段同步时从这里开始计算超时
+        if initial_sync is not None:
+            initial_sync.wait()
+        
         # 等待区块同步完成或超时
         sync_start_time = time.time()
         
@@ -127,8 +154,9 @@ def create_dummy_block(peer_id, MALICIOUS_MODE):
     # `previous block` is the last block in the blockchain, to which the new block will be linked. 
     # If the block generator is malicious, it can generate random block ID.
     """创建一个新区块"""
-    # 获取最新区块高度
-    latest_height = get_latest_block_height()
+    # 以主链链顶为前置区块
+    latest_block = get_latest_block()
+    latest_height = latest_block.get("height", 0) if latest_block else 0
     
     # 创建区块
     block = {
@@ -136,7 +164,7 @@ def create_dummy_block(peer_id, MALICIOUS_MODE):
         "peer_id": peer_id,
         "timestamp": time.time(),
         "block_id": "",  
-        "previous_block_id": received_blocks[-1]["block_id"] if received_blocks else None,
+        "previous_block_id": latest_block["block_id"] if latest_block else None,
         "height": latest_height + 1,  # 设置区块高度
         "transactions": [],
         "message_id": generate_message_id()  # 添加message_id字段
@@ -152,14 +180,8 @@ def create_dummy_block(peer_id, MALICIOUS_MODE):
         block["block_id"] = compute_block_hash(block)
     # TODO: Clear the local transaction pool and add the new block into the local blockchain (`receive_block`).
     clear_pool()
-    received_blocks.append(block)
-    
-    # 添加区块头到header_store
-    header_store.append({
-        "block_id": block["block_id"],
-        "previous_block_id": block["previous_block_id"],
-        "height": block["height"]
-    })
+    # 同时添加区块头到header_store
+    chain_store.add_block(block)
     return block
 
 def compute_block_hash(block):
@@ -170,7 +192,16 @@ def compute_block_hash(block):
     return hashlib.sha256(block_data_str).hexdigest()
 
 
-def handle_block(msg, self_id):
+def has_valid_height(block, parent_height):
+    """非创世区块的高度必须是前置区块高度+1；高度参与分叉选择，虚报高度的区块会直接成为链顶"""
+    if block.get("height") == parent_height + 1:
+        return True
+    logger.warning(f"丢弃高度错误的区块 {block.get('block_id')}: 声明高度 {block.get('height')}，"
+                   f"前置区块高度 {parent_height}")
+    return False
+
+def handle_block(msg, self_id, sender_id=None):
+    """sender_id为转发该区块的节点，区块成为孤块时向它请求缺失的前置区块"""
     # 注意：区块哈希验证已经在message_handler.py中完成，这里不再重复验证
     # computed_hash = compute_block_hash(msg)
     # if computed_hash != msg["block_id"]:
@@ -188,20 +219,16 @@ def handle_block(msg, self_id):
     # TODO: Check if the block exists in the local blockchain. If yes, drop the block.
     """处理接收到的区块"""
     # 检查区块是否已存在
-    block_exists = False
-    for block in received_blocks:
-        if block["block_id"] == msg["block_id"]:
-            logger.info(f"区块 {msg['block_id']} 已存在于本地区块链中，忽略")
-            return
+    if msg["block_id"] in chain_store:
+        logger.info(f"区块 {msg['block_id']} 已存在于本地区块链中，忽略")
+        return
     
     # 检查是否是创世区块（previous_block_id为None）
     previous_block_id = msg.get("previous_block_id")
-    if previous_block_id is None:
+    if previous_block_id is None and chain_store.genesis_id is not None:
         # 如果已经有创世区块了，忽略这个新的创世区块
-        for block in received_blocks:
-            if block.get("previous_block_id") is None:
-                logger.warning(f"忽略重复的创世区块: {msg['block_id']}，本地已有创世区块: {block['block_id']}")
-                return
+        logger.warning(f"忽略重复的创世区块: {msg['block_id']}，本地已有创世区块: {chain_store.genesis_id}")
+        return
     
     # 轻量级节点只存储区块头，不存储完整区块
     if is_lightweight:
@@ -216,20 +243,16 @@ def handle_block(msg, self_id):
         if "height" not in msg:
             if previous_block_id is None:
                 header["height"] = 0  # 创世区块高度为0
-            else:
-                for h in header_store:
-                    if h.get("block_id") == previous_block_id:
-                        header["height"] = h.get("height", 0) + 1
-                        break
+            elif chain_store.has_header(previous_block_id):
+                header["height"] = chain_store.height_of(previous_block_id) + 1
+        elif chain_store.has_header(previous_block_id) and \
+                not has_valid_height(msg, chain_store.height_of(previous_block_id)):
+            return
         
-        # 检查区块头是否已存在
-        for h in header_store:
-            if h.get("block_id") == msg["block_id"]:
-                logger.info("区块头已存在于本地存储中，忽略")
-                return
-                
-        # 添加到区块头存储
-        header_store.append(header)
+        # 检查区块头是否已存在，不存在时添加到区块头存储
+        if not chain_store.add_header(header):
+            logger.info("区块头已存在于本地存储中，忽略")
+            return
         logger.info(f"轻量级节点: 区块头 {msg['block_id']} 已添加到存储中，高度: {header['height']}")
         
         # 尝试调用更新同步状态函数
@@ -242,33 +265,16 @@ def handle_block(msg, self_id):
             
         return  # 轻量级节点处理完区块头后直接返回
             
-    # 检查区块的前置区块是否存在
-    is_previous_block_exist = False
-    
-    for block in received_blocks:
-        if block["block_id"] == previous_block_id:
-            is_previous_block_exist = True
-            break
-            
     # 如果前置区块存在或者是创世区块，则添加到区块链
-    if previous_block_id is None or is_previous_block_exist:
-        # 确保区块有高度信息
+    parent = chain_store.get(previous_block_id) if previous_block_id is not None else None
+    if previous_block_id is None or parent is not None:
+        # 确保区块有高度信息，如果区块没有高度，则根据前置区块计算高度
         if "height" not in msg:
-            # 如果区块没有高度，则根据前置区块计算高度
-            if previous_block_id is None:
-                msg["height"] = 0  # 创世区块高度为0
-            else:
-                for block in received_blocks:
-                    if block["block_id"] == previous_block_id:
-                        msg["height"] = block["height"] + 1
-                        break
-        
-        received_blocks.append(msg)
-        header_store.append({
-            "block_id": msg["block_id"],
-            "previous_block_id": msg["previous_block_id"],
-            "height": msg.get("height", 0)
-        })
+            msg["height"] = parent["height"] + 1 if parent is not None else 0  # 创世区块高度为0
+        elif parent is not None and not has_valid_height(msg, parent["height"]):
+            return
+
+        chain_store.add_block(msg)
         logger.info(f"区块 {msg['block_id']} 已添加到本地区块链中，高度: {msg.get('height')}")
         
         # 尝试调用更新同步状态函数
@@ -280,30 +286,44 @@ def handle_block(msg, self_id):
             logger.error(f"更新区块同步状态失败: {e}")
 
     else:
-        # 如果前置区块不存在，则添加到孤块列表
-        orphan_blocks[msg["block_id"]] = msg
+        # 如果前置区块不存在，则添加到孤块池
+        if not orphan_pool.add(msg):
+            logger.info(f"孤块 {msg['block_id']} 已在孤块池中，忽略")
+            return
         logger.info(f"区块 {msg['block_id']} 的前置区块 {previous_block_id} 不存在，暂存为孤块")
+        request_missing_parent(msg, self_id, sender_id)
         return
         
     # TODO: Check if the block is the previous block of blocks in `orphan_blocks`. If yes, add the orphaned blocks to the local blockchain.
-    orphaned_to_add = []
-    for orphan_id, orphan_block in orphan_blocks.items():
-        if orphan_block["previous_block_id"] == msg["block_id"]:
-            # 计算孤块高度
-            orphan_block["height"] = msg.get("height", 0) + 1
-            
-            received_blocks.append(orphan_block)
-            header_store.append({
-                "block_id": orphan_block["block_id"],
-                "previous_block_id": orphan_block["previous_block_id"],
-                "height": orphan_block["height"]
-            })
-            orphaned_to_add.append(orphan_id)
-            logger.info(f"孤块 {orphan_id} 现在可以添加到区块链中，高度: {orphan_block['height']}")
-            
-    # 从孤块列表中移除已添加的孤块
-    for orphan_id in orphaned_to_add:
-        del orphan_blocks[orphan_id]
+    connect_orphans(msg)
+
+def connect_orphans(parent):
+    """前置区块加入区块链后，按广度优先把以它为根的整棵孤块子树接入区块链"""
+    pending = deque([parent])
+    while pending:
+        parent = pending.popleft()
+        for orphan_block in orphan_pool.pop_children(parent["block_id"]):
+            # 计算孤块高度；高度参与区块哈希，声明了错误高度的孤块直接丢弃，不能改写
+            if "height" in orphan_block and not has_valid_height(orphan_block, parent.get("height", 0)):
+                continue
+            orphan_block["height"] = parent.get("height", 0) + 1
+            if chain_store.add_block(orphan_block):
+                logger.info(f"孤块 {orphan_block['block_id']} 现在可以添加到区块链中，高度: {orphan_block['height']}")
+                pending.append(orphan_block)
+
+def request_missing_parent(orphan, self_id, sender_id):
+    """向发送孤块的节点请求孤块链最前端缺失的区块"""
+    missing_id = orphan_pool.missing_ancestor(orphan)
+    if missing_id is None or missing_id in chain_store:
+        return
+    if sender_id is None or sender_id == self_id or sender_id not in known_peers:
+        logger.info(f"孤块 {orphan['block_id']} 的发送节点未知，无法请求缺失区块 {missing_id}")
+        return
+    if not orphan_pool.should_request(missing_id):
+        return
+    ip, port = known_peers[sender_id]
+    enqueue_message(sender_id, ip, port, create_getblock(self_id, [missing_id]))
+    logger.info(f"向节点 {sender_id} 请求孤块 {orphan['block_id']} 缺失的前置区块 {missing_id}")
 
 def create_getblock(sender_id, requested_ids):
     # TODO: Define the JSON format of a `GETBLOCK` message, which should include `{message type, sender's ID, requesting block IDs}`.
@@ -318,54 +338,24 @@ def create_getblock(sender_id, requested_ids):
 
 def get_block_by_id(block_id):
     # TODO: Return the block in the local blockchain based on the block ID.
-    for block in received_blocks:
-        if block["block_id"] == block_id:
-            return block
-    return None
+    return chain_store.get(block_id)
 
 def get_inventory():
     """获取本地区块链中的所有区块ID"""
-    block_ids = []
-    for block in received_blocks:
-        block_ids.append(block["block_id"])
-    return block_ids
+    return chain_store.inventory()
 
 def get_latest_block():
-    """获取最新区块"""
-    if not received_blocks:
-        return None
-        
-    # 按高度排序，获取最高的区块
-    sorted_blocks = sorted(received_blocks, key=lambda b: b.get("height", 0), reverse=True)
-    return sorted_blocks[0] if sorted_blocks else None
+    """获取最新区块（由chain_store增量维护的链顶）"""
+    return chain_store.tip()
 
 def get_latest_block_height():
     """获取最新区块高度"""
-    latest_block = get_latest_block()
-    return latest_block.get("height", 0) if latest_block else 0
+    return chain_store.tip_height()
 
 def get_blocks_since_height(height, limit=50):
-    """获取指定高度之后的区块，最多返回limit个"""
-    if not received_blocks:
-        return []
-        
-    # 找出高于指定高度的所有区块
-    higher_blocks = [b for b in received_blocks if b.get("height", 0) > height]
-    
-    # 按高度排序
-    sorted_blocks = sorted(higher_blocks, key=lambda b: b.get("height", 0))
-    
-    # 返回指定数量的区块
-    return sorted_blocks[:limit]
+    """获取主链上指定高度之后的区块，按高度排序，最多返回limit个"""
+    return list(itertools.islice(chain_store.iter_best_chain(height + 1), limit))
 
 def get_headers_by_height_range(start_height, end_height):
-    """获取指定高度范围内的区块头"""
-    filtered_headers = []
-    for header in header_store:
-        header_height = header.get("height", 0)
-        if start_height <= header_height <= end_height:
-            filtered_headers.append(header)
-    
-    # 按高度排序
-    filtered_headers.sort(key=lambda h: h.get("height", 0))
-    return filtered_headers
\ No newline at end of file
+    """获取主链上指定高度范围内的区块头，按高度排序"""
+    return list(chain_store.iter_best_headers(start_height, end_height))
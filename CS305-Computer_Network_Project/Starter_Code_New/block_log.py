@@ -0,0 +1,186 @@
+import os
+import mmap
+import json
+import zlib
+import struct
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# === Append-only Block Log ===
+# 区块（轻量级节点为区块头）按加入chain_store的顺序追加写入段文件，重启时按顺序重放即可恢复区块树和链顶。
+# 段文件记录格式: [1字节类型][4字节长度][4字节CRC32][JSON内容]，段文件超过SEGMENT_MAX_BYTES后写入下一个段。
+# 索引文件每条记录定长INDEX_ENTRY.size字节: (段号, 段内偏移, 记录长度)，启动时用mmap读取。
+# 进程中途退出时最后一条记录可能不完整：重放时遇到长度或CRC不符的记录即截断，之后的索引项一并丢弃。
+BLOCK_LOG_DIR = "block_data"
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+BLOCK_LOG_FSYNC = False  # 每条记录写入后是否fsync，关闭时只保证进程崩溃不丢数据
+
+RECORD_HEADER = struct.Struct(">cII")  # 类型, 内容长度, CRC32
+INDEX_ENTRY = struct.Struct(">IQI")    # 段号, 偏移, 记录总长度
+RECORD_BLOCK = b"B"
+RECORD_HEADER_ONLY = b"H"
+
+_decode_record = json.JSONDecoder().decode
+
+class BlockLog:
+    """单个节点的区块日志：若干段文件加一个偏移索引"""
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES, fsync=BLOCK_LOG_FSYNC):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.index_path = os.path.join(directory, "blocks.idx")
+        self.segment = 0
+        self.segment_file = None
+        self.index_file = None
+        self.records = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"blocks-{segment:06d}.log")
+
+    def _read_index(self):
+        """用mmap读取索引文件，返回[(段号, 偏移, 长度)]"""
+        if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < INDEX_ENTRY.size:
+            return []
+        with open(self.index_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index_map:
+                usable = len(index_map) - len(index_map) % INDEX_ENTRY.size
+                return list(INDEX_ENTRY.iter_unpack(index_map[:usable]))
+
+    def _scan_segment(self, segment, offset, segment_map):
+        """从offset开始扫描段文件中索引没有覆盖的完整记录（写入记录后、写入索引前退出的情况）"""
+        entries = []
+        while offset + RECORD_HEADER.size <= len(segment_map):
+            kind, length, crc = RECORD_HEADER.unpack_from(segment_map, offset)
+            end = offset + RECORD_HEADER.size + length
+            if kind not in (RECORD_BLOCK, RECORD_HEADER_ONLY) or end > len(segment_map) \
+                    or zlib.crc32(segment_map[offset + RECORD_HEADER.size:end]) != crc:
+                break
+            entries.append((segment, offset, end - offset))
+            offset = end
+        return entries
+
+    def replay(self, on_block, on_header):
+        """按写入顺序重放所有完整记录，然后截断不完整的尾部并打开日志用于追加，返回重放的记录数"""
+        with self.lock:
+            entries = self._read_index()
+            valid = []
+            segment_maps = {}
+            try:
+                segment = 0
+                while os.path.exists(self._segment_path(segment)):
+                    path = self._segment_path(segment)
+                    if os.path.getsize(path) > 0:
+                        with open(path, "rb") as f:
+                            segment_maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    segment += 1
+
+                # 校验索引项，遇到第一个无效项就停止
+                for seg, offset, length in entries:
+                    segment_map = segment_maps.get(seg)
+                    if segment_map is None or offset + length > len(segment_map):
+                        break
+                    kind, payload_length, crc = RECORD_HEADER.unpack_from(segment_map, offset)
+                    payload = segment_map[offset + RECORD_HEADER.size:offset + length]
+                    if payload_length + RECORD_HEADER.size != length or zlib.crc32(payload) != crc:
+                        break
+                    valid.append((seg, offset, length))
+                if len(valid) < len(entries):
+                    logger.warning(f"区块日志索引中有{len(entries) - len(valid)}条记录无效，从第{len(valid)}条起截断")
+
+                # 补上索引之后、段文件中仍完整的记录；一个段扫描到末尾都完整时继续扫描下一个段
+                # （写入记录后换段、或索引文件丢失时，索引之后的记录可能跨越多个段）
+                if valid:
+                    last_seg, last_offset, last_length = valid[-1]
+                    tail_seg, tail_offset = last_seg, last_offset + last_length
+                else:
+                    tail_seg, tail_offset = 0, 0
+                while tail_seg in segment_maps:
+                    scanned = self._scan_segment(tail_seg, tail_offset, segment_maps[tail_seg])
+                    valid.extend(scanned)
+                    if scanned:
+                        tail_offset = scanned[-1][1] + scanned[-1][2]
+                    if tail_offset != len(segment_maps[tail_seg]):
+                        break
+                    tail_seg, tail_offset = tail_seg + 1, 0
+
+                for seg, offset, length in valid:
+                    segment_map = segment_maps[seg]
+                    kind = segment_map[offset:offset + 1]
+                    record = _decode_record(segment_map[offset + RECORD_HEADER.size:offset + length].decode())
+                    if kind == RECORD_BLOCK:
+                        on_block(record)
+                    else:
+                        on_header(record)
+            finally:
+                for segment_map in segment_maps.values():
+                    segment_map.close()
+
+            self._open_for_append(valid)
+            return len(valid)
+
+    def _open_for_append(self, valid):
+        # 截断有效记录之后的内容，删除更靠后的段文件，重写索引
+        if valid:
+            seg, offset, length = valid[-1]
+            self.segment, end = seg, offset + length
+        else:
+            self.segment, end = 0, 0
+        segment = self.segment + 1
+        while os.path.exists(self._segment_path(segment)):
+            os.remove(self._segment_path(segment))
+            segment += 1
+        self.segment_file = open(self._segment_path(self.segment), "ab")
+        self.segment_file.truncate(end)
+        self.segment_file.seek(end)  # 追加模式下tell()仍停在截断前的文件末尾
+        with open(self.index_path, "wb") as f:
+            f.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in valid))
+        self.index_file = open(self.index_path, "ab")
+        self.records = len(valid)
+
+    def _append(self, kind, record):
+        payload = json.dumps(record, sort_keys=True).encode()
+        data = RECORD_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.segment_file is None:
+                return
+            offset = self.segment_file.tell()
+            if offset > 0 and offset + len(data) > self.segment_max_bytes:
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self._segment_path(self.segment), "ab")
+                offset = 0
+            # 先写记录再写索引，索引落后时重放会扫描段文件补齐
+            self.segment_file.write(data)
+            self.segment_file.flush()
+            self.index_file.write(INDEX_ENTRY.pack(self.segment, offset, len(data)))
+            self.index_file.flush()
+            if self.fsync:
+                os.fsync(self.segment_file.fileno())
+                os.fsync(self.index_file.fileno())
+            self.records += 1
+
+    def append_block(self, block):
+        self._append(RECORD_BLOCK, block)
+
+    def append_header(self, header):
+        self._append(RECORD_HEADER_ONLY, header)
+
+    def close(self):
+        with self.lock:
+            for f in (self.segment_file, self.index_file):
+                if f is not None:
+                    f.close()
+            self.segment_file = self.index_file = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "directory": self.directory,
+                "records": self.records,
+                "segment": self.segment,
+                "segment_bytes": self.segment_file.tell() if self.segment_file else 0
+            }
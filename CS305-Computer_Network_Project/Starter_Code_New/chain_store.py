@@ -0,0 +1,307 @@
+import time
+import bisect
+import threading
+from collections import defaultdict, deque
+
+# === Indexed Chain Store ===
+# 本地区块链及区块头存储的索引，供block_handler、inv_message和message_handler共用。
+# blocks/headers仍是按加入顺序排列的普通列表（block_handler.received_blocks/header_store指向同一对象，
+# 仪表盘等只读代码可以照常遍历），查找、去重、找父区块和按高度查询都走索引，开销与链长无关。
+# 所有收到的区块（包括分叉上的）组成一棵以创世区块为根的树。分叉选择规则：高度最高者优先，高度相同时先收到的优先。
+# 主链用{高度: block_id}表示，链顶切换到另一分支时只沿新旧两条分支回溯到分叉点，开销与切换的分支深度成正比。
+# 每次链顶变化记录一条事件（包括重组深度）供仪表盘展示。
+# 可以挂接一个BlockLog（block_log.py），新加入的区块和单独加入的区块头会追加写入磁盘，重启时重放恢复。
+# 区块定位器（block locator）：从链顶向创世区块按指数间隔取主链上的区块ID，长度O(log n)，
+# 对方按顺序找到第一个在自己主链上的ID即为分叉点。
+TIP_EVENT_LIMIT = 50  # 保留的最近链顶变化事件数
+LOCATOR_DENSE = 10    # 定位器开头逐个列出的最近区块数，之后间隔每次翻倍
+
+class HeightIndex:
+    """
+    按高度排序的索引：有序的高度数组（高度可以不连续）加上每个高度下的条目列表。
+    范围查询用bisect定位起点后按顺序迭代，开销为O(log n + k)。
+    """
+    def __init__(self):
+        self.heights = []   # 有序、不重复的高度
+        self.items = {}     # {height: [item]}，同一高度按加入顺序
+
+    def add(self, height, item):
+        entries = self.items.get(height)
+        if entries is None:
+            entries = self.items[height] = []
+            # 绝大多数区块按高度递增到达，直接追加到末尾
+            if not self.heights or height > self.heights[-1]:
+                self.heights.append(height)
+            else:
+                bisect.insort(self.heights, height)
+        entries.append(item)
+
+    def get(self, height):
+        return self.items.get(height, ())
+
+    def clear(self):
+        self.heights = []
+        self.items = {}
+
+    def iter_heights(self, start_height, end_height=None):
+        """按从低到高的顺序产出[start_height, end_height]内已有的高度"""
+        heights = self.heights
+        index = bisect.bisect_left(heights, start_height)
+        last = None
+        while True:
+            if index >= len(heights) or (last is not None and heights[index] <= last):
+                # 迭代期间插入了更低的高度导致位置偏移，重新定位
+                index = bisect.bisect_right(heights, last) if last is not None else index
+                if index >= len(heights):
+                    return
+            height = heights[index]
+            if end_height is not None and height > end_height:
+                return
+            yield height
+            last = height
+            index += 1
+
+    def iter_range(self, start_height, end_height=None):
+        """按高度从低到高逐个产出[start_height, end_height]内的条目，不复制整个范围"""
+        for height in self.iter_heights(start_height, end_height):
+            for item in list(self.items.get(height, ())):
+                yield item
+
+class ChainStore:
+    """区块树：哈希索引(block_id -> 区块)、父区块索引(previous_block_id -> 子区块ID)、按高度排序的索引和主链"""
+    def __init__(self):
+        self.blocks = []                    # 完整区块，按加入顺序
+        self.headers = []                   # 区块头，按加入顺序
+        self.by_id = {}                     # {block_id: block}
+        self.header_by_id = {}              # {block_id: header}
+        self.children = defaultdict(list)   # {previous_block_id: [block_id]}
+        self.block_heights = HeightIndex()  # 完整区块按高度排序
+        self.header_heights = HeightIndex() # 区块头按高度排序
+        self.genesis_id = None
+        self.tip_id = None
+        self.best = {}                      # 主链 {height: block_id}
+        self.reorgs = 0
+        self.max_reorg_depth = 0
+        self.tip_events = deque(maxlen=TIP_EVENT_LIMIT)
+        self.log = None                     # 可选的BlockLog，重放期间不挂接
+        self.lock = threading.RLock()
+
+    def __contains__(self, block_id):
+        return block_id in self.by_id
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, block_id):
+        return self.by_id.get(block_id)
+
+    def has_header(self, block_id):
+        return block_id in self.header_by_id
+
+    def get_header(self, block_id):
+        return self.header_by_id.get(block_id)
+
+    def attach_log(self, log):
+        """之后加入的区块和区块头追加写入log"""
+        with self.lock:
+            self.log = log
+
+    def add_block(self, block):
+        """加入完整区块并索引，同时记录其区块头；区块已存在时返回False"""
+        with self.lock:
+            block_id = block["block_id"]
+            if block_id in self.by_id:
+                return False
+            self.blocks.append(block)
+            self.by_id[block_id] = block
+            previous_block_id = block.get("previous_block_id")
+            if previous_block_id is None and self.genesis_id is None:
+                self.genesis_id = block_id
+            self.children[previous_block_id].append(block_id)
+            self.block_heights.add(block.get("height", 0), block)
+            self._update_tip(block)
+            self._index_header({
+                "block_id": block_id,
+                "previous_block_id": previous_block_id,
+                "height": block.get("height", 0)
+            })
+            if self.log is not None:
+                self.log.append_block(block)
+            return True
+
+    def _update_tip(self, block):
+        # 只有更高的区块才替换链顶，同高度保留先收到的区块
+        tip = self.by_id.get(self.tip_id)
+        if tip is not None and block.get("height", 0) <= tip.get("height", 0):
+            return
+        reorg_depth = self._switch_best_chain(block, tip)
+        if reorg_depth is None:
+            return
+        self.tip_id = block["block_id"]
+        self.tip_events.append({
+            "timestamp": time.time(),
+            "block_id": block["block_id"],
+            "height": block.get("height", 0),
+            "previous_tip": tip["block_id"] if tip else None,
+            "previous_height": tip.get("height", 0) if tip else None,
+            "reorg_depth": reorg_depth
+        })
+
+    def _switch_best_chain(self, new_tip, old_tip):
+        """
+        把主链切换到以new_tip结尾的分支，返回从主链上移除的区块数（重组深度）。
+        新分支缺少前置区块、连不到主链时不切换，返回None（不经handle_block直接加入的区块可能出现这种情况）
+        """
+        # 从新链顶回溯到第一个已在主链上的区块（分叉点）
+        branch = []
+        block = new_tip
+        while block is not None and self.best.get(block.get("height", 0)) != block["block_id"]:
+            branch.append(block)
+            block = self.by_id.get(block.get("previous_block_id"))
+        fork_point = block
+        if fork_point is None and old_tip is not None and branch[-1].get("previous_block_id") is not None:
+            return None
+
+        # 从旧链顶回溯到分叉点，移除旧分支
+        removed = 0
+        block = old_tip
+        while block is not None and block is not fork_point:
+            height = block.get("height", 0)
+            if self.best.get(height) == block["block_id"]:
+                del self.best[height]
+                removed += 1
+            block = self.by_id.get(block.get("previous_block_id"))
+
+        for block in branch:
+            self.best[block.get("height", 0)] = block["block_id"]
+        if removed:
+            self.reorgs += 1
+            self.max_reorg_depth = max(self.max_reorg_depth, removed)
+        return removed
+
+    def tip(self):
+        """当前链顶区块，没有区块时返回None"""
+        return self.by_id.get(self.tip_id)
+
+    def tip_height(self):
+        tip = self.by_id.get(self.tip_id)
+        return tip.get("height", 0) if tip else 0
+
+    def on_best_chain(self, block_id):
+        block = self.by_id.get(block_id)
+        return block is not None and self.best.get(block.get("height", 0)) == block_id
+
+    def iter_best_chain(self, start_height, end_height=None):
+        """按高度顺序流式产出主链上的区块"""
+        for height in self.block_heights.iter_heights(start_height, end_height):
+            block_id = self.best.get(height)
+            if block_id is not None:
+                yield self.by_id[block_id]
+
+    def iter_best_headers(self, start_height, end_height=None):
+        """主链上区块的区块头；只有区块头的轻量级节点没有主链，按高度返回所有区块头"""
+        if not self.best:
+            yield from self.header_heights.iter_range(start_height, end_height)
+            return
+        for block in self.iter_best_chain(start_height, end_height):
+            yield self.header_by_id[block["block_id"]]
+
+    def locator(self):
+        """主链的区块定位器：链顶附近的LOCATOR_DENSE个区块ID，之后间隔翻倍，最后一个总是创世区块"""
+        with self.lock:
+            if not self.best:
+                return []
+            # 在有序的实际高度数组上按下标后退，高度不连续（主链有空缺）时开销也只与区块数有关
+            heights = self.block_heights.heights
+            # 主链的起点（通常是创世区块，也就是最低的高度）
+            lowest = next(i for i, h in enumerate(heights) if h in self.best)
+            index = len(heights) - 1
+            step = 1
+            locator = []
+            while index > lowest:
+                block_id = self.best.get(heights[index])
+                if block_id is not None:
+                    locator.append(block_id)
+                if len(locator) >= LOCATOR_DENSE:
+                    step *= 2
+                index -= step
+            locator.append(self.best[heights[lowest]])
+            return locator
+
+    def find_fork(self, locator):
+        """定位器中第一个在本地主链上的区块的高度（分叉点），都不在主链上时返回None"""
+        with self.lock:
+            for block_id in locator:
+                if self.on_best_chain(block_id):
+                    return self.by_id[block_id].get("height", 0)
+            return None
+
+    def best_chain_stats(self):
+        with self.lock:
+            return {
+                "tip": self.tip_id,
+                "height": self.tip_height(),
+                "best_chain_length": len(self.best),
+                "blocks": len(self.blocks),
+                "fork_blocks": len(self.blocks) - len(self.best),
+                "reorgs": self.reorgs,
+                "max_reorg_depth": self.max_reorg_depth
+            }
+
+    def get_tip_events(self):
+        with self.lock:
+            return list(self.tip_events)
+
+    def add_header(self, header):
+        """只记录区块头（轻量级节点），已存在时返回False"""
+        with self.lock:
+            if not self._index_header(header):
+                return False
+            if self.log is not None:
+                self.log.append_header(header)
+            return True
+
+    def _index_header(self, header):
+        block_id = header.get("block_id", "")
+        if block_id in self.header_by_id:
+            return False
+        self.headers.append(header)
+        self.header_by_id[block_id] = header
+        self.header_heights.add(header.get("height", 0), header)
+        return True
+
+    def replace_headers(self, start_height, end_height, headers):
+        """删除高度范围内的旧区块头后加入新的区块头"""
+        with self.lock:
+            self.headers[:] = [h for h in self.headers
+                               if h.get("height", 0) < start_height or h.get("height", 0) > end_height]
+            self.header_by_id = {h.get("block_id", ""): h for h in self.headers}
+            self.header_heights.clear()
+            for header in self.headers:
+                self.header_heights.add(header.get("height", 0), header)
+            # 日志只追加，被替换掉的旧区块头在重放时仍会加入，之后的同步会再次替换
+            for header in headers:
+                self.add_header(header)
+
+    def height_of(self, block_id):
+        """已知区块或区块头的高度，未知时返回None"""
+        block = self.by_id.get(block_id) or self.header_by_id.get(block_id)
+        return block.get("height", 0) if block else None
+
+    def children_of(self, block_id):
+        return list(self.children.get(block_id, ()))
+
+    def at_height(self, height):
+        return list(self.block_heights.get(height))
+
+    def iter_blocks(self, start_height, end_height=None):
+        """按高度顺序流式产出区块，end_height为None时直到链顶"""
+        return self.block_heights.iter_range(start_height, end_height)
+
+    def iter_headers(self, start_height, end_height=None):
+        """按高度顺序流式产出区块头"""
+        return self.header_heights.iter_range(start_height, end_height)
+
+    def inventory(self):
+        """主链上所有区块的ID，按高度排序"""
+        return [block["block_id"] for block in self.iter_best_chain(0)]
@@ -0,0 +1,381 @@
+import json
+import struct
+import threading
+import zlib
+from framing import FLAG_BINARY, FLAG_ZLIB, MAX_FRAME_SIZE
+
+# === Wire Codecs ===
+# json:   默认格式，所有节点都支持
+# binary: 紧凑二进制格式。每种消息类型有固定的字段表，键名不上线，只传字段存在位图；
+#         64位十六进制哈希按32字节原始值编码，整数使用varint，浮点数使用8字节double。
+#         解码结果与原消息完全相同（区块哈希可以照常校验），无法无损表示的消息自动回退为json。
+SUPPORTED_CODECS = ["binary", "json"]  # 在HELLO的flags中声明
+
+# === Compression ===
+# 编码后的payload超过阈值时使用zlib压缩（帧flags置FLAG_ZLIB），只在对方声明支持且使用长度前缀帧时启用
+SUPPORTED_COMPRESSION = ["zlib"]  # 在HELLO的flags中声明
+COMPRESS_THRESHOLD = 2048  # 超过该字节数的payload才压缩
+COMPRESS_LEVEL = 6
+MAX_DECOMPRESSED_SIZE = 4 * MAX_FRAME_SIZE  # 解压后的最大长度，防止压缩炸弹
+
+compression_stats = {
+    "frames_compressed": 0,
+    "frames_skipped": 0,     # 超过阈值但压缩后没有变小
+    "bytes_before": 0,
+    "bytes_after": 0,
+    "frames_decompressed": 0
+}
+compression_lock = threading.Lock()
+
+class CodecError(ValueError):
+    """二进制消息格式错误"""
+    pass
+
+class _Unencodable(Exception):
+    """消息中存在字段表之外的内容，需要回退为json"""
+    pass
+
+# 字段类型
+ID = "id"            # None / 64位十六进制哈希 / 十进制数字串 / 任意字符串
+NUM = "num"          # None / float / int
+BOOL = "bool"
+ID_LIST = "id_list"
+RECORD = "record"    # 嵌套的任意一条消息
+RECORDS = "records"  # 嵌套的消息列表
+
+HEADER_CODE = 7
+
+# 字段表: 类型编号 -> (消息类型, [(字段名, 字段类型)])，编号一经使用不可修改
+# 消息类型为None的表用于没有type字段的嵌套记录（如区块头）
+MESSAGE_TABLES = {
+    1: ("PING", [("sender_id", ID), ("timestamp", NUM), ("message_id", ID)]),
+    2: ("PONG", [("sender_id", ID), ("timestamp", NUM), ("message_id", ID)]),
+    3: ("INV", [("sender_id", ID), ("block_ids", ID_LIST), ("message_id", ID)]),
+    4: ("TX", [("id", ID), ("from", ID), ("to", ID), ("amount", NUM), ("timestamp", NUM),
+               ("message_id", ID)]),
+    5: ("BLOCK", [("peer_id", ID), ("sender_id", ID), ("timestamp", NUM), ("block_id", ID),
+                  ("previous_block_id", ID), ("height", NUM), ("transactions", RECORDS),
+                  ("message_id", ID)]),
+    6: ("GETBLOCK", [("sender_id", ID), ("requested_ids", ID_LIST), ("message_id", ID)]),
+    HEADER_CODE: (None, [("block_id", ID), ("previous_block_id", ID), ("prev_block_id", ID), ("height", NUM)]),
+    8: ("BLOCK_HEADERS", [("sender_id", ID), ("headers", RECORDS), ("is_full_chain", BOOL),
+                          ("start_height", NUM), ("end_height", NUM), ("message_id", ID)]),
+    9: ("GET_BLOCK_HEADERS", [("sender_id", ID), ("start_height", NUM), ("end_height", NUM),
+                              ("is_new_node", BOOL), ("message_id", ID)]),
+    10: ("BLOCK_BATCH", [("sender_id", ID), ("blocks", RECORDS), ("has_more", BOOL),
+                         ("next_height", NUM), ("message_id", ID)]),
+    11: ("GET_LATEST_BLOCK", [("sender_id", ID), ("current_height", NUM), ("is_new_node", BOOL),
+                              ("message_id", ID)]),
+    12: ("RELAY", [("sender_id", ID), ("target_id", ID), ("payload", RECORD), ("message_id", ID)]),
+    13: ("GET_MEMPOOL", [("sender_id", ID), ("message_id", ID)]),
+    14: ("MEMPOOL_DATA", [("sender_id", ID), ("transactions", RECORDS), ("message_id", ID)]),
+    15: ("GET_SNAPSHOT_MANIFEST", [("sender_id", ID), ("message_id", ID)]),
+    16: ("SNAPSHOT_MANIFEST", [("sender_id", ID), ("height", NUM), ("block_id", ID), ("snapshot_hash", ID),
+                               ("chunk_hashes", ID_LIST), ("message_id", ID)]),
+    17: ("GET_SNAPSHOT_CHUNK", [("sender_id", ID), ("snapshot_hash", ID), ("index", NUM), ("message_id", ID)]),
+    18: ("SNAPSHOT_CHUNK", [("sender_id", ID), ("snapshot_hash", ID), ("index", NUM), ("blocks", RECORDS),
+                            ("message_id", ID)]),
+    19: ("GET_BLOCKS", [("sender_id", ID), ("locator", ID_LIST), ("tip_height", NUM), ("message_id", ID)]),
+}
+
+_CODE_BY_TYPE = {msg_type: code for code, (msg_type, _) in MESSAGE_TABLES.items() if msg_type}
+_HEADER_FIELDS = {name for name, _ in MESSAGE_TABLES[HEADER_CODE][1]}
+_DOUBLE = struct.Struct(">d")
+
+# === varint ===
+
+def _write_uvarint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_uvarint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise CodecError("varint被截断")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+def _write_str(out, value):
+    raw = value.encode()
+    _write_uvarint(out, len(raw))
+    out += raw
+
+def _read_str(data, pos):
+    length, pos = _read_uvarint(data, pos)
+    if pos + length > len(data):
+        raise CodecError("字符串被截断")
+    return str(data[pos:pos + length], "utf-8"), pos + length
+
+# === field encoders ===
+
+def _write_id(out, value):
+    if value is None:
+        out.append(0)
+    elif type(value) is not str:
+        raise _Unencodable()
+    elif len(value) == 64:
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            raw = b""
+        if raw.hex() == value:
+            out.append(1)
+            out += raw
+        else:
+            out.append(3)
+            _write_str(out, value)
+    elif value.isdigit() and value.isascii() and str(int(value)) == value:
+        out.append(2)
+        _write_uvarint(out, int(value))
+    else:
+        out.append(3)
+        _write_str(out, value)
+
+def _read_id(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 0:
+        return None, pos
+    if tag == 1:
+        if pos + 32 > len(data):
+            raise CodecError("哈希被截断")
+        return data[pos:pos + 32].hex(), pos + 32
+    if tag == 2:
+        value, pos = _read_uvarint(data, pos)
+        return str(value), pos
+    if tag == 3:
+        return _read_str(data, pos)
+    raise CodecError(f"未知的ID标记 {tag}")
+
+def _write_num(out, value):
+    if value is None:
+        out.append(0)
+    elif type(value) is float:
+        out.append(1)
+        out += _DOUBLE.pack(value)
+    elif type(value) is int:
+        if not -2 ** 63 <= value < 2 ** 63:
+            raise _Unencodable()
+        out.append(2)
+        _write_uvarint(out, (value << 1) ^ (value >> 63))  # zigzag
+    else:
+        raise _Unencodable()
+
+def _read_num(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == 0:
+        return None, pos
+    if tag == 1:
+        if pos + 8 > len(data):
+            raise CodecError("浮点数被截断")
+        return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+    if tag == 2:
+        value, pos = _read_uvarint(data, pos)
+        return (value >> 1) ^ -(value & 1), pos
+    raise CodecError(f"未知的数值标记 {tag}")
+
+def _write_field(out, kind, value):
+    if kind == ID:
+        _write_id(out, value)
+    elif kind == NUM:
+        _write_num(out, value)
+    elif kind == BOOL:
+        if type(value) is not bool:
+            raise _Unencodable()
+        out.append(1 if value else 0)
+    elif kind == ID_LIST:
+        if type(value) is not list:
+            raise _Unencodable()
+        _write_uvarint(out, len(value))
+        for item in value:
+            _write_id(out, item)
+    elif kind == RECORD:
+        _write_record(out, value)
+    elif kind == RECORDS:
+        if type(value) is not list:
+            raise _Unencodable()
+        _write_uvarint(out, len(value))
+        for item in value:
+            _write_record(out, item)
+
+def _read_field(data, pos, kind):
+    if kind == ID:
+        return _read_id(data, pos)
+    if kind == NUM:
+        return _read_num(data, pos)
+    if kind == BOOL:
+        return data[pos] == 1, pos + 1
+    if kind == ID_LIST:
+        count, pos = _read_uvarint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _read_id(data, pos)
+            items.append(item)
+        return items, pos
+    if kind == RECORD:
+        return _read_record(data, pos)
+    if kind == RECORDS:
+        count, pos = _read_uvarint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _read_record(data, pos)
+            items.append(item)
+        return items, pos
+    raise CodecError(f"未知的字段类型 {kind}")
+
+def _write_record(out, record):
+    if type(record) is not dict:
+        raise _Unencodable()
+    msg_type = record.get("type")
+    if msg_type is None:
+        if not record.keys() <= _HEADER_FIELDS:
+            raise _Unencodable()
+        code = HEADER_CODE
+    else:
+        code = _CODE_BY_TYPE.get(msg_type)
+        if code is None:
+            raise _Unencodable()
+    fields = MESSAGE_TABLES[code][1]
+    expected = len(record) - (msg_type is not None)
+
+    # 存在位图: 第i位表示字段表中第i个字段出现在消息中
+    present = 0
+    for i, (name, _) in enumerate(fields):
+        if name in record:
+            present |= 1 << i
+            expected -= 1
+    if expected != 0:
+        raise _Unencodable()  # 有字段表之外的键
+
+    out.append(code)
+    _write_uvarint(out, present)
+    for i, (name, kind) in enumerate(fields):
+        if present >> i & 1:
+            _write_field(out, kind, record[name])
+
+def _read_record(data, pos):
+    if pos >= len(data):
+        raise CodecError("消息被截断")
+    code = data[pos]
+    table = MESSAGE_TABLES.get(code)
+    if table is None:
+        raise CodecError(f"未知的消息类型编号 {code}")
+    msg_type, fields = table
+    present, pos = _read_uvarint(data, pos + 1)
+    record = {} if msg_type is None else {"type": msg_type}
+    for i, (name, kind) in enumerate(fields):
+        if present >> i & 1:
+            record[name], pos = _read_field(data, pos, kind)
+    return record, pos
+
+# === codecs ===
+
+class JsonCodec:
+    name = "json"
+    flags = 0
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, payload):
+        return json.loads(str(payload, "utf-8"))
+
+class BinaryCodec:
+    name = "binary"
+    flags = FLAG_BINARY
+
+    def encode(self, message):
+        """返回二进制编码，消息无法无损表示时返回None"""
+        out = bytearray()
+        try:
+            _write_record(out, message)
+        except _Unencodable:
+            return None
+        return bytes(out)
+
+    def decode(self, payload):
+        try:
+            record, pos = _read_record(payload, 0)
+        except (IndexError, UnicodeDecodeError, struct.error) as e:
+            raise CodecError(f"二进制消息损坏: {e}")
+        if pos != len(payload):
+            raise CodecError("二进制消息末尾有多余数据")
+        return record
+
+CODECS = {
+    "json": JsonCodec(),
+    "binary": BinaryCodec(),
+}
+
+def choose_codec(flags):
+    """根据对方在HELLO中声明的能力选择编码，二进制编码只能用于长度前缀帧"""
+    if flags.get("framing") == "length" and "binary" in flags.get("codecs", []):
+        return CODECS["binary"]
+    return CODECS["json"]
+
+def supports_compression(flags):
+    """对方是否能接收zlib压缩的帧"""
+    return flags.get("framing") == "length" and "zlib" in flags.get("compress", [])
+
+def encode_payload(message, codec, compress=False):
+    """编码消息，返回 (帧flags, payload)；二进制编码不适用时回退为json，compress为True时压缩大payload"""
+    frame_flags, payload = 0, None
+    if codec.name != "json":
+        payload = codec.encode(message)
+        if payload is not None:
+            frame_flags = codec.flags
+    if payload is None:
+        payload = CODECS["json"].encode(message)
+
+    if compress and len(payload) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(payload, COMPRESS_LEVEL)
+        smaller = len(compressed) < len(payload)
+        with compression_lock:
+            if smaller:
+                compression_stats["frames_compressed"] += 1
+                compression_stats["bytes_before"] += len(payload)
+                compression_stats["bytes_after"] += len(compressed)
+            else:
+                compression_stats["frames_skipped"] += 1
+        if smaller:
+            return frame_flags | FLAG_ZLIB, compressed
+    return frame_flags, payload
+
+def decode_payload(flags, payload):
+    """按帧flags解码payload（bytes或memoryview）"""
+    if flags & FLAG_ZLIB:
+        payload = _decompress(payload)
+    if flags & FLAG_BINARY:
+        return CODECS["binary"].decode(payload)
+    return CODECS["json"].decode(payload)
+
+def _decompress(payload):
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, MAX_DECOMPRESSED_SIZE)
+    except zlib.error as e:
+        raise CodecError(f"zlib解压失败: {e}")
+    if decompressor.unconsumed_tail:
+        raise CodecError(f"解压后长度超过上限 {MAX_DECOMPRESSED_SIZE}")
+    if not decompressor.eof:
+        raise CodecError("zlib数据被截断")
+    with compression_lock:
+        compression_stats["frames_decompressed"] += 1
+    return data
+
+def get_compression_stats():
+    """压缩统计，bytes_saved为压缩节省的发送字节数"""
+    with compression_lock:
+        stats = dict(compression_stats)
+    stats["bytes_saved"] = stats["bytes_before"] - stats["bytes_after"]
+    stats["ratio"] = stats["bytes_after"] / stats["bytes_before"] if stats["bytes_before"] else 1.0
+    return stats
@@ -216,6 +216,8 @@ def get_network_stats():
     # 局部导入
     from outbox import get_outbox_status, get_drop_stats
     from message_handler import get_redundancy_stats
+    from rate_limits import get_rate_limit_stats
+    from socket_server import get_dispatch_stats
     # 获取网络统计信息
     redundancy = get_redundancy_stats()
     outbox_status = get_outbox_status()
@@ -224,22 +226,50 @@ def get_network_stats():
     return jsonify({
         'message_redundancy': redundancy,
         'outbox_status': outbox_status,
-        'drop_stats': drop_stats
+        'drop_stats': drop_stats,
+        'rate_limits': get_rate_limit_stats(),
+        'dispatch': get_dispatch_stats()
     })
 
+@app.route('/api/rate_limits')
+def get_rate_limits():
+    from rate_limits import get_rate_limit_stats
+    # 出站/入站限流器的配置和当前窗口内的计数
+    return jsonify(get_rate_limit_stats())
+
+@app.route('/api/handlers/stats')
+def get_handlers_stats():
+    from message_handler import get_handler_stats
+    # 各消息类型处理函数的调用次数、异常次数和耗时直方图
+    return jsonify(get_handler_stats())
+
 @app.route('/api/blockchain/status')
 def get_blockchain_status():
     # 局部导入
-    from block_handler import received_blocks
+    from block_handler import received_blocks, get_latest_block, orphan_pool, chain_store
+    from snapshot import get_snapshot_stats
+    from block_download import get_download_stats
+    from header_sync import get_header_sync_stats
     # 获取区块链状态
     chain_length = len(received_blocks)
-    latest_block = received_blocks[-1] if received_blocks else {}
+    latest_block = get_latest_block() or {}
     
     return jsonify({
         'chain_length': chain_length,
-        'latest_block': latest_block
+        'latest_block': latest_block,
+        'orphans': orphan_pool.stats(),
+        'best_chain': chain_store.best_chain_stats(),
+        'snapshot': get_snapshot_stats(),
+        'download': get_download_stats(),
+        'header_sync': get_header_sync_stats()
     })
 
+@app.route('/api/blockchain/tip_events')
+def get_tip_events():
+    from block_handler import chain_store
+    # 最近的链顶变化，按时间从旧到新
+    return jsonify(chain_store.get_tip_events())
+
 @app.route('/api/blockchain/blocks')
 def get_blockchain_blocks():
     # 局部导入
@@ -618,5 +648,5 @@ def list_transactions_api():
 
 @app.route('/redundancy_total')
 def redundancy_total():
-    from message_handler import total_redundant_message
-    return jsonify({"total_redundant_messages": total_redundant_message})
\ No newline at end of file
+    from message_handler import get_dedup_stats
+    return jsonify(get_dedup_stats())
\ No newline at end of file
@@ -0,0 +1,127 @@
+import sys
+import time
+import threading
+from collections import deque
+
+# === Expiring Dedup Cache ===
+# 已见消息ID按到达时间分桶（每桶BUCKET_SECONDS秒），超过有效期的桶整体丢弃，不需要逐条清理。
+# 可选的Bloom过滤器作为每个桶的前置层：大多数新消息在前置层即可判定为未见过。
+# 精确记录的消息ID总数超过max_entries时，最旧桶的精确集合被释放，只保留其Bloom过滤器直到过期，
+# 此时这些消息的去重变为概率性的（误判率约为BLOOM_FALSE_POSITIVE_RATE）。最新的桶同样会被释放
+# （突发流量时单个桶就可能超过上限），之后同一时间段的消息提前换到一个新桶，因此上限是硬上限。
+DEDUP_BUCKET_SECONDS = 60
+DEDUP_MAX_ENTRIES = 200000
+BLOOM_BITS_PER_ENTRY = 10  # 约1%误判率
+BLOOM_HASHES = 7
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+class BloomFilter:
+    """定长位数组的Bloom过滤器，使用双重哈希生成BLOOM_HASHES个位置"""
+    __slots__ = ("bits", "size")
+
+    def __init__(self, capacity):
+        self.size = max(64, capacity * BLOOM_BITS_PER_ENTRY)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        h = hash(key)
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        for i in range(BLOOM_HASHES):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class DedupBucket:
+    __slots__ = ("index", "ids", "bloom")
+
+    def __init__(self, index, bloom_capacity):
+        self.index = index
+        self.ids = set()
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity else None
+
+class DedupCache:
+    """按时间分桶、有内存上限的消息去重缓存"""
+    def __init__(self, expiry, bucket_seconds=DEDUP_BUCKET_SECONDS, max_entries=DEDUP_MAX_ENTRIES,
+                 use_bloom=False):
+        self.expiry = expiry
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        # 每个桶的Bloom过滤器按平均每桶的消息数分配空间
+        buckets_per_window = max(1, int(expiry // bucket_seconds) + 1)
+        self.bloom_capacity = max(1024, max_entries // buckets_per_window) if use_bloom else 0
+        self.buckets = deque()  # 按时间从旧到新排列的DedupBucket
+        self.entries = 0        # 精确集合中的消息ID总数
+        self.expired_buckets = 0
+        self.demoted_buckets = 0
+        self.lock = threading.Lock()
+
+    def seen(self, msg_id, now=None):
+        """检查消息ID是否已在有效期内出现过；未出现过时记录下来并返回False"""
+        if now is None:
+            now = time.time()
+        index = int(now // self.bucket_seconds)
+        with self.lock:
+            self._expire(index)
+            for bucket in self.buckets:
+                if bucket.bloom is not None and msg_id not in bucket.bloom:
+                    continue
+                if bucket.ids is None or msg_id in bucket.ids:
+                    # 精确集合已被释放时按Bloom过滤器的结果判定
+                    return True
+
+            if not self.buckets or self.buckets[-1].index != index or self.buckets[-1].ids is None:
+                self.buckets.append(DedupBucket(index, self.bloom_capacity))
+            bucket = self.buckets[-1]
+            bucket.ids.add(msg_id)
+            if bucket.bloom is not None:
+                bucket.bloom.add(msg_id)
+            self.entries += 1
+            self._enforce_cap()
+            return False
+
+    def _expire(self, index):
+        # 整个桶都超过有效期时直接丢弃
+        oldest_valid = index - int(self.expiry // self.bucket_seconds)
+        while self.buckets and self.buckets[0].index < oldest_valid:
+            bucket = self.buckets.popleft()
+            if bucket.ids is not None:
+                self.entries -= len(bucket.ids)
+            self.expired_buckets += 1
+
+    def _enforce_cap(self):
+        # 超过上限时从最旧的桶开始释放精确集合（有Bloom过滤器时保留过滤器，否则整桶丢弃）
+        while self.entries > self.max_entries:
+            position, bucket = next((position, bucket) for position, bucket in enumerate(self.buckets)
+                                    if bucket.ids is not None)
+            self.entries -= len(bucket.ids)
+            self.demoted_buckets += 1
+            if bucket.bloom is not None:
+                bucket.ids = None
+            else:
+                del self.buckets[position]
+
+    def __len__(self):
+        return self.entries
+
+    def stats(self):
+        with self.lock:
+            memory = sum(sys.getsizeof(bucket.ids) for bucket in self.buckets if bucket.ids is not None)
+            memory += sum(len(bucket.bloom.bits) for bucket in self.buckets if bucket.bloom is not None)
+            return {
+                "entries": self.entries,
+                "max_entries": self.max_entries,
+                "buckets": len(self.buckets),
+                "bloom_only_buckets": sum(1 for bucket in self.buckets if bucket.ids is None),
+                "expired_buckets": self.expired_buckets,
+                "demoted_buckets": self.demoted_buckets,
+                "approx_bytes": memory
+            }
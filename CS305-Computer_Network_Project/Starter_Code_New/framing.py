@@ -0,0 +1,116 @@
+import struct
+
+# === Wire Framing ===
+# 两种帧格式可以在同一连接上混用:
+#   换行分隔: <JSON>\n
+#   长度前缀: <magic:1><flags:1><length:4, big-endian><payload>
+# magic字节0xB1不可能出现在UTF-8文本的开头，因此接收方可以逐帧区分两种格式。
+FRAME_MAGIC = 0xB1
+FRAME_HEADER = struct.Struct(">BBI")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# 帧flags
+FLAG_BINARY = 0x01  # payload使用二进制编码（见codec.py），否则为JSON
+FLAG_ZLIB = 0x02    # payload经过zlib压缩，需先解压再解码
+
+LENGTH_FRAMING_ENABLED = True  # 是否在HELLO中声明支持长度前缀帧
+RECV_BUFFER_SIZE = 64 * 1024  # 接收缓冲区初始大小
+MAX_FRAME_SIZE = 8 * 1024 * 1024  # 单帧最大长度（字节）
+
+class FrameError(Exception):
+    """帧格式错误或帧长度超过限制"""
+    pass
+
+def encode_frame(payload, flags=0):
+    """生成长度前缀帧"""
+    return FRAME_HEADER.pack(FRAME_MAGIC, flags, len(payload)) + payload
+
+def encode_line(payload):
+    """生成换行分隔帧"""
+    return payload + b"\n"
+
+def get_framing_flag():
+    """HELLO消息flags中声明的帧格式"""
+    return "length" if LENGTH_FRAMING_ENABLED else "newline"
+
+class FrameBuffer:
+    """
+    可复用的接收缓冲区。
+    socket通过recv_into直接写入预分配的bytearray，frames()以memoryview切片的形式返回完整帧，
+    只有未处理的尾部数据会在缓冲区写满时被移动到开头，避免 buffer += chunk 带来的重复拷贝。
+    frames()返回的切片只在下一次调用writable()之前有效。
+    """
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.initial_size = size
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0    # 未处理数据的起点
+        self.end = 0      # 已写入数据的终点
+        self.scan = 0     # 下一次查找换行符的位置，避免重复扫描
+        self.pending = 0  # 正在接收的长度前缀帧的总长度
+
+    def writable(self):
+        """返回可供recv_into写入的空闲区域，必要时整理、扩容或（大帧处理完后）缩回缓冲区"""
+        if self.end == len(self.buf) or self.start + self.pending > len(self.buf) \
+                or (self.end == 0 and len(self.buf) > self.initial_size):
+            self._make_room()
+        return self.view[self.end:]
+
+    def commit(self, nbytes):
+        """记录recv_into实际写入的字节数"""
+        self.end += nbytes
+
+    def frames(self):
+        """依次生成缓冲区中的完整帧 (flags, payload)，换行分隔帧的flags为0"""
+        buf = self.buf
+        while self.start < self.end:
+            if buf[self.start] == FRAME_MAGIC:
+                if self.end - self.start < FRAME_HEADER_SIZE:
+                    break
+                _, flags, length = FRAME_HEADER.unpack_from(buf, self.start)
+                if length > MAX_FRAME_SIZE:
+                    raise FrameError(f"帧长度 {length} 超过上限 {MAX_FRAME_SIZE}")
+                total = FRAME_HEADER_SIZE + length
+                if self.end - self.start < total:
+                    self.pending = total
+                    break
+                payload = self.view[self.start + FRAME_HEADER_SIZE:self.start + total]
+                self.start += total
+                self.scan = self.start
+                self.pending = 0
+                yield flags, payload
+            else:
+                pos = buf.find(b"\n", max(self.scan, self.start), self.end)
+                if pos < 0:
+                    self.scan = self.end
+                    if self.end - self.start > MAX_FRAME_SIZE:
+                        raise FrameError(f"消息长度超过上限 {MAX_FRAME_SIZE}")
+                    break
+                payload = self.view[self.start:pos]
+                self.start = pos + 1
+                self.scan = self.start
+                yield 0, payload
+
+        if self.start == self.end:
+            # 数据已全部处理，下次从缓冲区开头写入
+            self.start = self.end = self.scan = 0
+
+    def _make_room(self):
+        unread = self.end - self.start
+        needed = max(self.pending, unread + 1)
+        if needed > len(self.buf):
+            # 当前帧放不下，扩容并只拷贝未处理的数据
+            new_buf = bytearray(max(needed, len(self.buf) * 2))
+            new_buf[:unread] = self.view[self.start:self.end]
+            self.buf = new_buf
+            self.view = memoryview(new_buf)
+        elif unread == 0 and len(self.buf) > self.initial_size:
+            # 大帧处理完毕后恢复初始大小，避免长期占用内存
+            self.buf = bytearray(self.initial_size)
+            self.view = memoryview(self.buf)
+        else:
+            # 切片会先复制出未处理的数据，源和目标区域重叠时也是安全的
+            self.buf[:unread] = self.buf[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = unread
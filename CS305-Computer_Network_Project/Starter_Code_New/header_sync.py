@@ -0,0 +1,280 @@
+import time
+import threading
+import logging
+from peer_discovery import known_peers, peer_flags
+from peer_manager import blacklist
+from outbox import enqueue_message, outbound_limiter
+from utils import generate_message_id
+from block_handler import chain_store
+from block_download import block_downloader
+
+logger = logging.getLogger(__name__)
+
+# === Pipelined Headers-first Sync ===
+# 新节点按HEADER_SYNC_RANGE个高度一段请求区块头，同时保持HEADER_SYNC_PIPELINE段在途：
+# 收到一段后先补发后面的请求，再校验这一段。各段可以乱序到达，校验按高度顺序增量进行
+# （每个区块头必须链接到前一个已校验的区块头），校验通过的区块头立即交给下载调度器开始下载区块
+# （轻量级节点直接保存区块头）。某一段的最后一个区块头低于段末高度时说明已到达对方链顶。
+# 第一段请求发给所有已知节点，最先回复完整一段的节点作为同步节点；都不满时等所有节点回复后选链最长的
+# （有节点一直不回复时才等到超时）；
+# 请求超时后轮换到其他回复过完整一段的节点（链比一段短的节点不会被轮换到，以免把它的链顶当作终点）。
+HEADER_SYNC_RANGE = 100         # 每段请求的高度数
+HEADER_SYNC_PIPELINE = 4        # 同时在途的区块头请求数
+HEADER_SYNC_TIMEOUT = 5         # 单段请求的超时（秒）
+HEADER_SYNC_MAX_ATTEMPTS = 4    # 每段最多请求的次数，超过后放弃流水线同步
+HEADER_SYNC_TICK_SECONDS = 0.5
+HEADER_SYNC_RATE_LIMIT = 50     # 区块头请求/响应单独的速率限制（每个限流窗口内的消息数）
+
+for _msg_type in ("GET_BLOCK_HEADERS", "BLOCK_HEADERS"):
+    outbound_limiter.set_type_limit(_msg_type, HEADER_SYNC_RATE_LIMIT)
+
+class HeaderSync:
+    """一次流水线区块头同步的状态"""
+    def __init__(self, range_size=HEADER_SYNC_RANGE, pipeline=HEADER_SYNC_PIPELINE, timeout=HEADER_SYNC_TIMEOUT,
+                 max_attempts=HEADER_SYNC_MAX_ATTEMPTS):
+        self.range_size = range_size
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.self_id = None
+        self.started = False
+        self.finished = False
+        self.failed = None
+        self.start_height = 0
+        self.sync_peer = None
+        self.responders = []      # 回复过完整一段区块头的节点，按首次回复顺序
+        self.outstanding = {}     # {段起始高度: {"peer_id", "requested_at", "attempts", "pages"}}
+        self.pending = {}         # {段起始高度: [header]}，已收齐但前面的段还没校验
+        self.next_request = 0     # 下一段要请求的起始高度
+        self.next_validate = 0    # 下一段要校验的起始高度
+        self.end_height = None    # 对方链顶所在段的末尾高度，到达后不再请求更高的段
+        self.last_id = None       # 最后一个已校验区块头的ID
+        self.last_height = None
+        self.validated = 0
+        self.started_at = 0.0
+        self.send = self._send_request
+        self.on_validated = self._default_on_validated
+        self.lock = threading.RLock()
+
+    def _send_request(self, peer_id, start_height, end_height):
+        if peer_id not in known_peers:
+            return False
+        ip, port = known_peers[peer_id]
+        enqueue_message(peer_id, ip, port, {
+            "type": "GET_BLOCK_HEADERS",
+            "sender_id": self.self_id,
+            "start_height": start_height,
+            "end_height": end_height,
+            "is_new_node": True,
+            "message_id": generate_message_id()
+        })
+        return True
+
+    def _default_on_validated(self, headers, sender_id):
+        if peer_flags.get(self.self_id, {}).get("light", False):
+            for header in headers:
+                chain_store.add_header(header)
+        else:
+            # 校验通过的区块头立即开始下载区块
+            block_downloader.schedule(headers, self.self_id, sender_id)
+
+    def _range_start(self, height):
+        return self.start_height + (height - self.start_height) // self.range_size * self.range_size
+
+    def start(self, self_id, start_height=0, peers=None):
+        """向所有已知节点请求第一段区块头"""
+        with self.lock:
+            self.self_id = self_id
+            self.started = True
+            self.started_at = time.time()
+            self.start_height = self.next_request = self.next_validate = start_height
+            if peers is None:
+                peers = [peer_id for peer_id in known_peers if peer_id != self_id and peer_id not in blacklist]
+            end_height = start_height + self.range_size - 1
+            self.outstanding[start_height] = {"peer_id": None, "requested_at": time.time(), "attempts": 1, "pages": [],
+                                              "candidates": {}, "queried": set()}
+            self.next_request = start_height + self.range_size
+            for peer_id in peers:
+                if self.send(peer_id, start_height, end_height):
+                    self.outstanding[start_height]["queried"].add(peer_id)
+            logger.info(f"[{self_id}] 开始流水线区块头同步: 从高度 {start_height} 开始，每段 {self.range_size}，"
+                        f"同时在途 {self.pipeline} 段，向 {len(peers)} 个节点请求第一段")
+
+    def _fill_pipeline(self, now):
+        if self.sync_peer is None or self.failed or self.finished:
+            return
+        while len(self.outstanding) < self.pipeline and \
+                (self.end_height is None or self.next_request <= self.end_height):
+            start = self.next_request
+            self.outstanding[start] = {"peer_id": self.sync_peer, "requested_at": now, "attempts": 1, "pages": []}
+            self.next_request += self.range_size
+            self.send(self.sync_peer, start, start + self.range_size - 1)
+
+    def on_headers(self, msg, sender_id, now=None):
+        """处理完整链模式的BLOCK_HEADERS，同步从未启动时返回False（由调用方按原逻辑处理）"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.started:
+                return False
+            if self.finished or self.failed:
+                return True
+            headers = msg.get("headers", [])
+            range_start = self._range_start(msg.get("start_height", 0))
+            request = self.outstanding.get(range_start)
+            if request is None or (request["peer_id"] is not None and request["peer_id"] != sender_id):
+                # 重复或过期的响应
+                return True
+            range_end = range_start + self.range_size - 1
+            if request["peer_id"] is None:
+                # 第一段：链比一段短的节点先记为候选，等待其他节点的完整回复
+                if not headers or (headers[-1].get("height", 0) < range_end and not msg.get("has_more", False)):
+                    request["candidates"][sender_id] = headers
+                    if request["queried"] <= set(request["candidates"]):
+                        # 所有请求过的节点都已回复，链都比一段短，不必等到超时
+                        self._choose_from_candidates(range_start, request, now)
+                    return True
+                self._choose_sync_peer(request, sender_id)
+            request["pages"].extend(headers)
+            if msg.get("has_more", False):
+                return True
+            if headers and headers[-1].get("height", 0) >= range_end and sender_id not in self.responders:
+                self.responders.append(sender_id)
+            self._complete_range(range_start, request, sender_id, now)
+            return True
+
+    def _choose_from_candidates(self, range_start, request, now):
+        """第一段没有节点回复完整一段：选回复区块头最多的节点作为同步节点"""
+        peer_id = max(request["candidates"], key=lambda p: len(request["candidates"][p]))
+        self._choose_sync_peer(request, peer_id)
+        request["pages"] = request["candidates"][peer_id]
+        self._complete_range(range_start, request, peer_id, now)
+
+    def _choose_sync_peer(self, request, peer_id):
+        self.sync_peer = peer_id
+        request["peer_id"] = peer_id
+        logger.info(f"[{self.self_id}] 选择节点 {peer_id} 作为区块头同步节点")
+
+    def _complete_range(self, range_start, request, sender_id, now):
+        """一段区块头收齐：记录对方链顶位置，补发后续请求并校验"""
+        del self.outstanding[range_start]
+        range_headers = request["pages"]
+        range_end = range_start + self.range_size - 1
+        if not range_headers or range_headers[-1].get("height", 0) < range_end:
+            # 这一段不满，对方链顶就在这一段，不再请求更高的段
+            if self.end_height is None or range_end < self.end_height:
+                self.end_height = range_end
+                for start in [s for s in self.outstanding if s > range_end]:
+                    del self.outstanding[start]
+        self.pending[range_start] = range_headers
+
+        # 先补发后续请求，再校验
+        self._fill_pipeline(now)
+        self._validate(sender_id)
+        self._check_finished()
+
+    def _validate(self, sender_id):
+        while self.next_validate in self.pending:
+            headers = self.pending.pop(self.next_validate)
+            for header in headers:
+                previous_block_id = header.get("previous_block_id")
+                height = header.get("height", 0)
+                if self.last_id is None:
+                    linked = previous_block_id is None or previous_block_id in chain_store \
+                        or chain_store.has_header(previous_block_id)
+                else:
+                    linked = previous_block_id == self.last_id and height == self.last_height + 1
+                if not linked:
+                    self.failed = f"区块头 {header.get('block_id')} (高度 {height}) 没有链接到前一个区块头 {self.last_id}"
+                    logger.warning(f"[{self.self_id}] 流水线区块头同步失败: {self.failed}")
+                    self._fallback()
+                    return
+                self.last_id = header.get("block_id")
+                self.last_height = height
+            self.validated += len(headers)
+            self.next_validate += self.range_size
+            if headers:
+                self.on_validated(headers, sender_id)
+
+    def _check_finished(self):
+        if self.end_height is not None and self.next_validate > self.end_height and not self.failed:
+            self.finished = True
+            self.outstanding.clear()
+            logger.info(f"[{self.self_id}] 区块头同步完成: {self.validated} 个区块头，最高高度 {self.last_height}，"
+                        f"耗时 {time.time() - self.started_at:.2f}s")
+
+    def _fallback(self):
+        # 同步节点的链在同步过程中发生变化，或者节点发来了错误的区块头：改用常规同步从本地链顶附近继续
+        self.outstanding.clear()
+        self.pending.clear()
+        from block_handler import request_block_sync
+        threading.Thread(target=request_block_sync, args=(self.self_id,), daemon=True).start()
+
+    def tick(self, now=None):
+        """超时的请求换一个回复过的节点重发"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.started or self.finished or self.failed:
+                return
+            for start, request in list(self.outstanding.items()):
+                if now - request["requested_at"] <= self.timeout:
+                    continue
+                if request["attempts"] >= self.max_attempts:
+                    self.failed = f"高度 {start} 起的区块头请求 {request['attempts']} 次都没有响应"
+                    logger.warning(f"[{self.self_id}] 流水线区块头同步失败: {self.failed}")
+                    self._fallback()
+                    return
+                if request["peer_id"] is None and request["candidates"]:
+                    # 有节点一直没有回复，在已回复的节点中选择
+                    self._choose_from_candidates(start, request, now)
+                    continue
+                if request["peer_id"] is None:
+                    # 第一段还没有任何节点回复，重新向所有节点请求
+                    peers = [p for p in known_peers if p != self.self_id and p not in blacklist]
+                else:
+                    candidates = [p for p in self.responders if p != request["peer_id"] and p not in blacklist]
+                    peer_id = candidates[0] if candidates else request["peer_id"]
+                    if peer_id != request["peer_id"] and request["peer_id"] == self.sync_peer:
+                        self.sync_peer = peer_id
+                    request["peer_id"] = peer_id
+                    peers = [peer_id]
+                request["requested_at"] = now
+                request["attempts"] += 1
+                request["pages"] = []
+                for peer_id in peers:
+                    if self.send(peer_id, start, start + self.range_size - 1) and request["peer_id"] is None:
+                        request["queried"].add(peer_id)
+            self._fill_pipeline(now)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "finished": self.finished,
+                "failed": self.failed,
+                "sync_peer": self.sync_peer,
+                "validated_headers": self.validated,
+                "validated_height": self.last_height,
+                "outstanding_ranges": sorted(self.outstanding),
+                "pending_ranges": sorted(self.pending),
+                "end_height": self.end_height
+            }
+
+header_sync = HeaderSync()
+
+def start_header_sync(self_id, start_height=0):
+    """启动流水线区块头同步，并定期检查超时的请求直到同步结束"""
+    header_sync.start(self_id, start_height)
+
+    def loop():
+        while not (header_sync.finished or header_sync.failed):
+            time.sleep(HEADER_SYNC_TICK_SECONDS)
+            try:
+                header_sync.tick()
+            except Exception as e:
+                logger.error(f"区块头同步出错: {e}")
+    threading.Thread(target=loop, daemon=True).start()
+
+def get_header_sync_stats():
+    return header_sync.stats()
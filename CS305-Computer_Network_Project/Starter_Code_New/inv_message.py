@@ -1,64 +1,106 @@
 import time
 import json
+import threading
+import logging
 from utils import generate_message_id
 from outbox import gossip_message
-from block_handler import received_blocks
+from block_handler import chain_store
 from peer_discovery import known_peers, peer_flags
 
+logger = logging.getLogger(__name__)
+
+# === Block Locator Reconciliation ===
+# 定期和连接时的区块清单对账不再发送整条链的INV，而是发送GET_BLOCKS：
+# 其中的定位器是从链顶向创世区块按指数间隔取的主链区块ID（chain_store.locator()，长度O(log n)）。
+# 接收方找到第一个在自己主链上的ID（分叉点），只用INV通告分叉点之后的区块（每次最多LOCATOR_INV_LIMIT个，
+# 收到满额INV的节点从最后一个ID继续请求）。对方链顶更高时不通告，改用自己的定位器反向请求。
+LOCATOR_INV_LIMIT = 100    # 按定位器回复的INV最多包含的区块ID数
+INVENTORY_INTERVAL = 30    # 定期对账的间隔（秒）
+
 def create_inv(sender_id, block_ids):
     # TODO: * Define the JSON format of an `INV` message, which should include `{message type, sender's ID, sending blocks' IDs, message ID}`.
-    # Note that `INV` messages are sent before sending blocks. 
-    # `sending blocks' IDs` is the ID of blocks that the sender want to send. 
+    # Note that `INV` messages are sent before sending blocks.
+    # `sending blocks' IDs` is the ID of blocks that the sender want to send.
     # `message ID` can be a random number generated by `generate_message_id` in `util.py`.
     inv_msg={
         "type": "INV",
         "sender_id": sender_id,
         "block_ids": block_ids,
-        "message_id": generate_message_id(sender_id)
+        # 每条INV使用随机ID：按sender_id生成的ID对同一节点的所有INV都相同，后续的INV会被去重缓存丢弃
+        "message_id": generate_message_id()
     }
     return inv_msg
 
+def create_get_blocks(sender_id, continue_from=None):
+    """带区块定位器的GET_BLOCKS消息；continue_from为上一个满额INV的最后一个区块ID，放在定位器最前面"""
+    locator = chain_store.locator()
+    if continue_from is not None:
+        locator.insert(0, continue_from)
+    return {
+        "type": "GET_BLOCKS",
+        "sender_id": sender_id,
+        "locator": locator,
+        "tip_height": chain_store.tip_height(),
+        "message_id": generate_message_id()
+    }
+
 def get_inventory():
     # TODO: Return the block ID of all blocks in the local blockchain.
-    block_ids = [block["block_id"] for block in received_blocks]
+    return chain_store.inventory()
+
+def get_blocks_after(locator, limit=LOCATOR_INV_LIMIT):
+    """本地主链上位于定位器分叉点之后的区块ID（最多limit个），没有共同区块时从创世区块开始"""
+    fork_height = chain_store.find_fork(locator)
+    start_height = 0 if fork_height is None else fork_height + 1
+    block_ids = []
+    for block in chain_store.iter_best_chain(start_height):
+        block_ids.append(block["block_id"])
+        if len(block_ids) >= limit:
+            break
     return block_ids
 
+def send_locator(self_id, peer_id):
+    """向一个节点发送GET_BLOCKS（新连接的节点）"""
+    if peer_id not in known_peers or peer_flags.get(self_id, {}).get("light", False):
+        return False
+    from outbox import enqueue_message
+    ip, port = known_peers[peer_id]
+    enqueue_message(peer_id, ip, port, create_get_blocks(self_id))
+    return True
+
 def broadcast_inventory(self_id):
     # TODO: Create an `INV` message with all block IDs in the local blockchain.
     # 检查是否是轻量级节点，轻量级节点不应生成区块
-    from peer_discovery import peer_flags
-    
     if self_id in peer_flags and peer_flags[self_id].get("light", False):
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"[{self_id}] 轻量级节点不广播区块清单")
         return
-        
-    block_ids = get_inventory()
-    
-    if not block_ids:
-        import logging
-        logger = logging.getLogger(__name__)
+
+    if not chain_store.tip_id:
         logger.info(f"[{self_id}] broadcast_inventory: 本地区块链为空，暂不广播")
         return
-    
-    inv_msg = create_inv(self_id, block_ids)
-    
-    # 添加日志输出
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"[{self_id}] broadcast_inventory: 广播区块链清单，包含 {len(block_ids)} 个区块")
-    
+
+    # 只广播定位器，由对方回复分叉点之后的区块
+    get_blocks_msg = create_get_blocks(self_id)
+    logger.info(f"[{self_id}] broadcast_inventory: 广播区块定位器，包含 {len(get_blocks_msg['locator'])} 个区块ID，"
+                f"链顶高度 {get_blocks_msg['tip_height']}")
+
     # TODO: Broadcast the `INV` message to known peers using the function `gossip_message` in `outbox.py`.
-    from outbox import gossip_message
-    
     # 使用更高的fanout值确保消息能传播到更多节点
-    gossip_result = gossip_message(self_id, inv_msg, fanout=5)
-    
+    gossip_result = gossip_message(self_id, get_blocks_msg, fanout=5)
+
     # 检查广播结果
     if gossip_result:
-        logger.info(f"[{self_id}] broadcast_inventory: 成功广播区块清单")
+        logger.info(f"[{self_id}] broadcast_inventory: 成功广播区块定位器")
     else:
-        logger.warning(f"[{self_id}] broadcast_inventory: 区块清单广播失败")
-
+        logger.warning(f"[{self_id}] broadcast_inventory: 区块定位器广播失败")
 
+def start_inventory_reconciliation(self_id, interval=INVENTORY_INTERVAL):
+    """启动时广播一次区块定位器，之后每interval秒对账一次"""
+    def loop():
+        while True:
+            try:
+                broadcast_inventory(self_id)
+            except Exception as e:
+                logger.error(f"[{self_id}] 区块清单对账出错: {e}")
+            time.sleep(interval)
+    threading.Thread(target=loop, daemon=True).start()
@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import defaultdict, deque
+
+# === Message Log Sink ===
+# 收发消息记录和节点事件通知的统一入口。
+# 默认把记录交给dashboard，dashboard（以及Flask）在第一次记录时才导入；
+# 无界面(--headless)模式下改用内存中的计数和定长环形缓冲区，整个进程不会导入Flask。
+MEMORY_LOG_SIZE = 1000  # 内存sink保留的最近消息记录条数
+MEMORY_EVENT_SIZE = 100  # 内存sink保留的最近节点事件条数
+
+class MemorySink:
+    """只保存按方向和类型的计数以及最近的记录，不序列化消息内容"""
+    def __init__(self, size=MEMORY_LOG_SIZE, event_size=MEMORY_EVENT_SIZE):
+        self.recent = deque(maxlen=size)        # (timestamp, direction, sender, receiver, msg_type)
+        self.events = deque(maxlen=event_size)  # 节点加入/离开等事件
+        self.counts = defaultdict(int)          # {(direction, msg_type): count}
+        self.lock = threading.Lock()
+
+    def _record(self, direction, sender_id, receiver_id, msg_type):
+        with self.lock:
+            self.recent.append((time.time(), direction, str(sender_id), str(receiver_id), msg_type))
+            self.counts[(direction, msg_type)] += 1
+
+    def log_sent_message(self, sender_id, receiver_id, msg_type, content):
+        self._record("SENT", sender_id, receiver_id, msg_type)
+
+    def log_received_message(self, sender_id, receiver_id, msg_type, content):
+        self._record("RECEIVED", sender_id, receiver_id, msg_type)
+
+    def notify_node_left(self, node_id, reason):
+        with self.lock:
+            self.events.append({"type": "node_left", "node_id": node_id, "reason": reason,
+                                "timestamp": time.time()})
+
+    def notify_nodes_discovered(self, node_ids):
+        with self.lock:
+            self.events.append({"type": "nodes_discovered", "node_ids": node_ids, "timestamp": time.time()})
+
+    def stats(self):
+        with self.lock:
+            sent = {msg_type: count for (direction, msg_type), count in self.counts.items() if direction == "SENT"}
+            received = {msg_type: count for (direction, msg_type), count in self.counts.items()
+                        if direction == "RECEIVED"}
+            return {"sent": sent, "received": received, "recent": len(self.recent), "events": list(self.events)}
+
+memory_sink = MemorySink()
+sink = None  # 当前使用的sink：dashboard模块或memory_sink，None表示尚未解析
+
+def use_memory_sink():
+    """切换到内存sink，需要在节点开始收发消息之前调用"""
+    global sink
+    sink = memory_sink
+
+def get_sink():
+    global sink
+    if sink is None:
+        import dashboard
+        sink = dashboard
+    return sink
+
+def log_sent_message(sender_id, receiver_id, msg_type, content):
+    (sink or get_sink()).log_sent_message(sender_id, receiver_id, msg_type, content)
+
+def log_received_message(sender_id, receiver_id, msg_type, content):
+    (sink or get_sink()).log_received_message(sender_id, receiver_id, msg_type, content)
+
+def notify_node_left(node_id, reason):
+    (sink or get_sink()).notify_node_left(node_id, reason)
+
+def notify_nodes_discovered(node_ids):
+    (sink or get_sink()).notify_nodes_discovered(node_ids)
+
+def get_message_log_stats():
+    """内存sink的收发计数，使用dashboard时返回空字典"""
+    return memory_sink.stats() if sink is memory_sink else {}
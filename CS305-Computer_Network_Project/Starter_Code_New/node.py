@@ -1,24 +1,50 @@
 print("=== NODE.PY LOADED ===", flush=True)
 
+import time
+STARTUP_BEGIN = time.perf_counter()  # 用于启动耗时报告
+
 import json
 import threading
 import argparse
-import time
 import traceback
 import logging
 from peer_discovery import start_peer_discovery, known_peers, peer_flags, peer_config
-from block_handler import block_generation, request_block_sync
+from block_handler import block_generation, request_block_sync, load_block_log
 from socket_server import start_socket_server
-from dashboard import start_dashboard
-from peer_manager import start_peer_monitor, start_ping_loop
-from outbox import send_from_queue
+from peer_manager import start_peer_monitor, start_ping_loop, first_pong
+from outbox import send_from_queue, SEND_WORKERS
 from outbox import start_dynamic_capacity_adjustment
-from inv_message import broadcast_inventory
+from outbox import start_connection_reaper
+from outbox import configure_network_conditions
+from inv_message import start_inventory_reconciliation
 from transaction import transaction_generation
+from message_log import use_memory_sink
+from block_log import BLOCK_LOG_DIR
+from snapshot import start_snapshot_sync, start_snapshot_producer
+from block_download import start_block_download_loop
+from header_sync import header_sync, HEADER_SYNC_PIPELINE
+# dashboard（以及Flask）只在非headless模式下启动仪表盘时才导入
+
+IMPORT_SECONDS = time.perf_counter() - STARTUP_BEGIN
+STARTUP_REPORT_TIMEOUT = 60  # 等待第一个PONG的最长时间（秒）
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+def report_startup_time(self_id, mode, serving_seconds):
+    """打印导入耗时、开始监听的耗时，并在收到第一个PONG时打印启动到此的耗时"""
+    print(f"[{self_id}] Startup ({mode}): imports {IMPORT_SECONDS * 1000:.0f} ms, "
+          f"serving after {serving_seconds * 1000:.0f} ms", flush=True)
+
+    def wait_first_pong():
+        if first_pong.wait(STARTUP_REPORT_TIMEOUT):
+            elapsed = time.perf_counter() - STARTUP_BEGIN
+            print(f"[{self_id}] Startup ({mode}): first PONG after {elapsed * 1000:.0f} ms", flush=True)
+        else:
+            print(f"[{self_id}] Startup ({mode}): no PONG within {STARTUP_REPORT_TIMEOUT} s", flush=True)
+
+    threading.Thread(target=wait_first_pong, daemon=True).start()
+
 def main():
     
     # Import the peer's configuration from command line
@@ -30,7 +56,21 @@ def main():
     parser.add_argument("--nat", action="store_true", help="Mark node as behind NAT")
     parser.add_argument("--light", action="store_true", help="Run as lightweight node")
     parser.add_argument("--dynamic", action="store_true", help="Enable dynamic node features")
+    parser.add_argument("--threaded-server", action="store_true", help="Use the legacy thread-per-connection socket server")
+    parser.add_argument("--send-workers", type=int, default=SEND_WORKERS, help="Number of outbound send worker threads")
+    parser.add_argument("--drop-prob", type=float, help="Override the emulated message drop probability")
+    parser.add_argument("--latency-ms", type=float, nargs=2, metavar=("MIN", "MAX"), help="Override the emulated latency range")
+    parser.add_argument("--headless", action="store_true", help="Run without the dashboard; message logs are kept in memory")
+    parser.add_argument("--data-dir", default=BLOCK_LOG_DIR, help="Directory for the on-disk block log (one subdirectory per node)")
+    parser.add_argument("--no-block-log", action="store_true", help="Keep the chain in memory only; do not load or write the block log")
+    parser.add_argument("--header-pipeline", type=int, default=HEADER_SYNC_PIPELINE, help="Number of outstanding header ranges during initial sync")
     args = parser.parse_args()
+
+    header_sync.pipeline = max(1, args.header_pipeline)
+
+    if args.headless:
+        # 必须在收发任何消息之前切换，否则第一次记录消息时会导入dashboard
+        use_memory_sink()
     
     MALICIOUS_MODE = args.mode == 'malicious'
     DYNAMIC_MODE = args.dynamic or True  # 默认启用动态节点功能
@@ -106,9 +146,14 @@ def main():
     ip = self_info["ip"]
     port = self_info["port"]
 
+    # 在开始收发消息之前从磁盘恢复本地区块链
+    if not args.no_block_log:
+        load_block_log(self_id, args.data_dir)
+
     # Start socket and listen for incoming messages
-    print(f"[{self_id}] Starting socket server on {ip}:{port}", flush=True)
-    start_socket_server(self_id, ip, port)
+    print(f"[{self_id}] Starting {'threaded' if args.threaded_server else 'asyncio'} socket server on {ip}:{port}", flush=True)
+    start_socket_server(self_id, ip, port, use_asyncio=not args.threaded_server)
+    report_startup_time(self_id, "headless" if args.headless else "dashboard", time.perf_counter() - STARTUP_BEGIN)
 
     # Peer Discovery
     print(f"[{self_id}] Starting peer discovery", flush=True)
@@ -123,8 +168,13 @@ def main():
     # Block and Transaction Generation and Verification
     print(f"[{self_id}] Starting block sync thread", flush=True)
     # 如果是新节点，启动特殊的区块同步
+    initial_sync = None  # 新的完整节点在快照同步结束（完成或回退）前不生成区块
     if IS_NEW_NODE:
-        threading.Thread(target=request_block_sync, args=(self_id, True), daemon=True).start()
+        if light_flag:
+            threading.Thread(target=request_block_sync, args=(self_id, True), daemon=True).start()
+        else:
+            # 完整节点先下载其他节点的链快照，再同步检查点之后的区块
+            initial_sync = start_snapshot_sync(self_id)
         
         # 新节点也需要同步交易池
         from peer_discovery import request_mempool_sync
@@ -135,14 +185,18 @@ def main():
     if not self_info.get('light', False):
         print(f"[{self_id}] Starting transaction and block generation", flush=True)
         transaction_generation(self_id)
-        block_generation(self_id, MALICIOUS_MODE)
+        block_generation(self_id, MALICIOUS_MODE, initial_sync=initial_sync)
+        start_snapshot_producer()
+        start_block_download_loop()
 
-    print(f"[{self_id}] Starting broadcast inventory thread", flush=True)
-    threading.Thread(target=broadcast_inventory, args=(self_id,), daemon=True).start()
+    print(f"[{self_id}] Starting inventory reconciliation thread", flush=True)
+    start_inventory_reconciliation(self_id)
 
     # Sending Message Processing
     print(f"[{self_id}] Starting outbound queue", flush=True)
-    send_from_queue(self_id)
+    configure_network_conditions(args.drop_prob, args.latency_ms)
+    send_from_queue(self_id, args.send_workers)
+    start_connection_reaper()
 
     print(f"[{self_id}] Starting dynamic capacity adjustment", flush=True)
     start_dynamic_capacity_adjustment()
@@ -164,11 +218,15 @@ def main():
             print(f"[{self_id}] Config manager not available", flush=True)
 
     # Start dashboard
-    time.sleep(2)
-    print(f"[{self_id}] Known peers before dashboard start: {known_peers}", flush=True)
-    print(f"[{self_id}] Peer flags before dashboard start: {peer_flags}", flush=True)
-    print(f"[{self_id}] Starting dashboard on port {port + 2000}", flush=True)
-    start_dashboard(self_id, port + 2000)
+    if args.headless:
+        print(f"[{self_id}] Headless mode, dashboard disabled", flush=True)
+    else:
+        time.sleep(2)
+        from dashboard import start_dashboard
+        print(f"[{self_id}] Known peers before dashboard start: {known_peers}", flush=True)
+        print(f"[{self_id}] Peer flags before dashboard start: {peer_flags}", flush=True)
+        print(f"[{self_id}] Starting dashboard on port {port + 2000}", flush=True)
+        start_dashboard(self_id, port + 2000)
 
     print(f"[{self_id}] Node is now running at {ip}:{port}", flush=True)
     
@@ -0,0 +1,116 @@
+import time
+import threading
+from collections import defaultdict
+
+# === Orphan Block Pool ===
+# 前置区块尚未收到的区块按previous_block_id建立索引，前置区块到达时可以直接取出它的所有子孤块。
+# 孤块超过ORPHAN_MAX_AGE秒或总数超过ORPHAN_MAX_BLOCKS时从最早到达的开始淘汰。
+# 同一个缺失的前置区块在ORPHAN_REQUEST_INTERVAL秒内只请求一次。
+ORPHAN_MAX_BLOCKS = 500
+ORPHAN_MAX_AGE = 600  # seconds
+ORPHAN_REQUEST_INTERVAL = 10  # seconds
+
+class OrphanPool:
+    """按父区块索引、按时间和数量淘汰的孤块池"""
+    def __init__(self, max_blocks=ORPHAN_MAX_BLOCKS, max_age=ORPHAN_MAX_AGE,
+                 request_interval=ORPHAN_REQUEST_INTERVAL):
+        self.max_blocks = max_blocks
+        self.max_age = max_age
+        self.request_interval = request_interval
+        self.blocks = {}                   # {block_id: block}，按到达顺序排列
+        self.arrived = {}                  # {block_id: 到达时间}
+        self.by_parent = defaultdict(set)  # {previous_block_id: {block_id}}
+        self.requested = {}                # {缺失的block_id: 上次请求时间}
+        self.added = 0
+        self.connected = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, block_id):
+        return block_id in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def add(self, block, now=None):
+        """暂存孤块，已在池中时返回False"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            block_id = block["block_id"]
+            if block_id in self.blocks:
+                return False
+            self.blocks[block_id] = block
+            self.arrived[block_id] = now
+            self.by_parent[block.get("previous_block_id")].add(block_id)
+            self.added += 1
+            self._evict(now)
+            return True
+
+    def _remove(self, block_id):
+        block = self.blocks.pop(block_id)
+        del self.arrived[block_id]
+        parent_id = block.get("previous_block_id")
+        siblings = self.by_parent.get(parent_id)
+        if siblings is not None:
+            siblings.discard(block_id)
+            if not siblings:
+                del self.by_parent[parent_id]
+        return block
+
+    def _evict(self, now):
+        # blocks按到达顺序排列，最早到达的在最前面
+        while self.blocks:
+            oldest_id = next(iter(self.blocks))
+            if len(self.blocks) <= self.max_blocks and now - self.arrived[oldest_id] <= self.max_age:
+                break
+            self._remove(oldest_id)
+            self.evicted += 1
+
+    def pop_children(self, parent_id):
+        """取出并移除前置区块为parent_id的所有孤块"""
+        with self.lock:
+            children = [self._remove(block_id) for block_id in list(self.by_parent.get(parent_id, ()))]
+            self.connected += len(children)
+            return children
+
+    def missing_ancestor(self, block):
+        """沿池中的孤块向上找到真正缺失的区块ID（孤块链最前端的前置区块）"""
+        with self.lock:
+            parent_id = block.get("previous_block_id")
+            seen = set()
+            while parent_id in self.blocks and parent_id not in seen:
+                seen.add(parent_id)
+                parent_id = self.blocks[parent_id].get("previous_block_id")
+            return parent_id
+
+    def should_request(self, block_id, now=None):
+        """同一个缺失区块在request_interval内只返回一次True"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            last = self.requested.get(block_id)
+            if last is not None and now - last < self.request_interval:
+                return False
+            self.requested[block_id] = now
+            # 清理过期的请求记录，避免无限增长
+            if len(self.requested) > self.max_blocks:
+                for key in [k for k, t in self.requested.items() if now - t >= self.request_interval]:
+                    del self.requested[key]
+            return True
+
+    def expire(self, now=None):
+        with self.lock:
+            self._evict(time.time() if now is None else now)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "orphans": len(self.blocks),
+                "waiting_parents": len(self.by_parent),
+                "max_blocks": self.max_blocks,
+                "max_age": self.max_age,
+                "added": self.added,
+                "connected": self.connected,
+                "evicted": self.evicted
+            }
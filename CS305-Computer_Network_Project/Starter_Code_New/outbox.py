@@ -3,9 +3,17 @@ import threading
 import time
 import json
 import random
+import select
+import bisect
+import heapq
+import itertools
 from collections import defaultdict, deque
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 import logging
+from framing import encode_frame, encode_line
+from rate_limits import create_limiter
+from codec import choose_codec, encode_payload, supports_compression, get_compression_stats
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,12 +21,16 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 # === Per-peer Rate Limiting ===
 RATE_LIMIT = 10  # max messages
 TIME_WINDOW = 10  # per seconds
-peer_send_timestamps = defaultdict(list) # the timestamps of sending messages to each peer
+outbound_limiter = create_limiter("outbound", RATE_LIMIT, TIME_WINDOW) # the sending counts to each peer in the sliding window
 
-MAX_RETRIES = 3
-RETRY_INTERVAL = 5  # seconds
+MAX_RETRIES = 3  # 每条消息的最大重试次数
+RETRY_BASE_DELAY = 0.5  # 第一次重试前的退避时间（秒），之后每次翻倍
+RETRY_INTERVAL = 5  # seconds, 退避时间上限
 QUEUE_LIMIT = 50
 
+# Circuit breaker
+BREAKER_FAILURE_THRESHOLD = 5  # 连续发送失败多少次后断开
+
 # Priority levels
 PRIORITY_HIGH = {"PING", "PONG", "BLOCK", "INV", "GETDATA"}
 PRIORITY_MEDIUM = {"TX", "HELLO"}
@@ -45,11 +57,70 @@ priority_order = {
     "HELLO": 5
 }
 
+# === Send Scheduler ===
+SEND_WORKERS = 2  # 发送线程数
+PRIORITY_LEVELS = (1, 2, 3, 4)  # classify_priority的结果，重试的消息会降低一级
+QUEUE_WAIT_BUCKETS_MS = [1, 5, 20, 100, 500, 2000]  # 排队时间直方图的桶上界
+
+eviction_stats = defaultdict(int)    # 队列满时被更高优先级消息挤出的消息数（按类型）
+queue_full_stats = defaultdict(int)  # 队列满且优先级不够而被拒绝的消息数（按类型）
+
+class PeerQueue:
+    """
+    单个目标节点的有界优先级队列，维护消息总数，入队和容量检查都是O(1)。
+    队列已满时，新消息会挤掉优先级最低的最旧消息；新消息的优先级不高于队列中最低优先级时被拒绝。
+    """
+    def __init__(self, limit=None):
+        self.limit = QUEUE_LIMIT if limit is None else limit
+        self.levels = {priority: deque() for priority in PRIORITY_LEVELS}
+        self.size = 0
+
+    def push(self, priority, entry):
+        """加入消息，返回 (是否加入, 被挤出的消息或None)"""
+        evicted = None
+        if self.size >= self.limit:
+            lowest = self.lowest_priority()
+            if lowest is None or lowest <= priority:
+                return False, None
+            evicted = self.levels[lowest].popleft()
+            self.size -= 1
+        self.levels[priority].append(entry)
+        self.size += 1
+        return True, evicted
+
+    def pop_batch(self, max_messages):
+        """按优先级从高到低取出最多max_messages条消息"""
+        batch = []
+        for priority in PRIORITY_LEVELS:
+            queue = self.levels[priority]
+            while queue and len(batch) < max_messages:
+                batch.append(queue.popleft())
+            if len(batch) >= max_messages:
+                break
+        self.size -= len(batch)
+        return batch
+
+    def lowest_priority(self):
+        for priority in reversed(PRIORITY_LEVELS):
+            if self.levels[priority]:
+                return priority
+        return None
+
+    def counts(self):
+        return {priority: len(queue) for priority, queue in self.levels.items() if queue}
+
+    def __len__(self):
+        return self.size
+
 # Queues per peer and priority
-queues = defaultdict(lambda: defaultdict(deque))
-retries = defaultdict(int)
+queues = defaultdict(PeerQueue)
 lock = threading.Lock()
 
+# 有待发送消息的节点按到达顺序排队，enqueue_message通过条件变量唤醒发送线程
+ready_peers = deque()
+ready_set = set()
+queue_cond = threading.Condition(lock)
+
 # === Sending Rate Limiter ===
 class RateLimiter:
     def __init__(self, rate=SEND_RATE_LIMIT):
@@ -74,11 +145,349 @@ class RateLimiter:
 
 rate_limiter = RateLimiter()
 
+# === Connection Pool ===
+CONNECT_TIMEOUT = 5  # seconds
+POOL_IDLE_TIMEOUT = 60  # 空闲超过该时间的连接会被回收
+POOL_MAX_IDLE_PER_PEER = 2  # 每个目标节点最多保留的空闲连接数
+
+class ConnectionPool:
+    """按 (ip, port) 复用到目标节点的长连接"""
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, max_idle_per_peer=POOL_MAX_IDLE_PER_PEER):
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self.idle = defaultdict(list)  # {(ip, port): [(socket, last_used)]}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def acquire(self, ip, port):
+        # 优先复用空闲连接，没有可用连接时才新建（惰性重连）
+        key = (ip, int(port))
+        while True:
+            with self.lock:
+                entry = self.idle[key].pop() if self.idle[key] else None
+                if entry is None:
+                    self.misses += 1
+                    break
+            sock, _ = entry
+            if self._is_alive(sock):
+                with self.lock:
+                    self.hits += 1
+                return sock, True
+            # 对端已关闭连接，丢弃后继续尝试下一个
+            self._close(sock)
+            with self.lock:
+                self.evictions += 1
+
+        sock = socket.create_connection(key, timeout=CONNECT_TIMEOUT)
+        return sock, False
+
+    def release(self, ip, port, sock):
+        # 发送成功后把连接放回池中
+        key = (ip, int(port))
+        with self.lock:
+            self.idle[key].append((sock, time.time()))
+            if len(self.idle[key]) <= self.max_idle_per_peer:
+                return
+            stale, _ = self.idle[key].pop(0)
+            self.evictions += 1
+        self._close(stale)
+
+    def sendall(self, ip, port, data):
+        """通过池中的连接发送数据，复用的连接失效时重新建立一次连接"""
+        sock, reused = self.acquire(ip, port)
+        try:
+            sock.sendall(data)
+        except OSError:
+            self._close(sock)
+            if not reused:
+                raise
+            logger.debug(f"复用连接 {ip}:{port} 已失效，重新连接")
+            sock = socket.create_connection((ip, int(port)), timeout=CONNECT_TIMEOUT)
+            try:
+                sock.sendall(data)
+            except OSError:
+                self._close(sock)
+                raise
+        self.release(ip, port, sock)
+
+    def evict_idle(self):
+        """关闭空闲时间超过 idle_timeout 的连接"""
+        now = time.time()
+        expired = []
+        with self.lock:
+            for key in list(self.idle.keys()):
+                alive = []
+                for sock, last_used in self.idle[key]:
+                    if now - last_used > self.idle_timeout:
+                        expired.append(sock)
+                    else:
+                        alive.append((sock, last_used))
+                if alive:
+                    self.idle[key] = alive
+                else:
+                    del self.idle[key]
+            self.evictions += len(expired)
+        for sock in expired:
+            self._close(sock)
+        return len(expired)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle_connections": sum(len(entries) for entries in self.idle.values())
+            }
+
+    @staticmethod
+    def _is_alive(sock):
+        # 对端不会主动发送数据，可读即意味着连接已被关闭或重置。
+        # 用poll而不是select：select不能处理编号>=1024的fd，而连接很多的节点正好会用到这些fd
+        try:
+            if hasattr(select, "poll"):
+                poller = select.poll()
+                poller.register(sock, select.POLLIN | select.POLLPRI)
+                return not poller.poll(0)
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+connection_pool = ConnectionPool()
+
+# === Send Batching ===
+BATCH_MAX_MESSAGES = 16  # 每次从同一节点的队列中最多取出的消息数
+BATCH_MAX_BYTES = 64 * 1024  # 每次写入连接的最大字节数
+BATCH_MESSAGE_BUCKETS = [1, 2, 4, 8, 16]  # 每批消息数直方图的桶上界
+BATCH_BYTE_BUCKETS = [256, 1024, 4096, 16384, 65536]  # 每批字节数直方图的桶上界
+
+class BatchStats:
+    """统计每次写入连接的消息数和字节数分布"""
+    def __init__(self):
+        self.batches = 0
+        self.messages = 0
+        self.bytes = 0
+        self.message_histogram = [0] * (len(BATCH_MESSAGE_BUCKETS) + 1)
+        self.byte_histogram = [0] * (len(BATCH_BYTE_BUCKETS) + 1)
+        self.lock = Lock()
+
+    def record(self, message_count, nbytes):
+        with self.lock:
+            self.batches += 1
+            self.messages += message_count
+            self.bytes += nbytes
+            self.message_histogram[bisect.bisect_left(BATCH_MESSAGE_BUCKETS, message_count)] += 1
+            self.byte_histogram[bisect.bisect_left(BATCH_BYTE_BUCKETS, nbytes)] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "messages": self.messages,
+                "bytes": self.bytes,
+                "avg_messages_per_batch": self.messages / self.batches if self.batches else 0,
+                "message_histogram": self._label(BATCH_MESSAGE_BUCKETS, self.message_histogram),
+                "byte_histogram": self._label(BATCH_BYTE_BUCKETS, self.byte_histogram)
+            }
+
+    @staticmethod
+    def _label(buckets, counts):
+        labels = [f"<={bound}" for bound in buckets] + [f">{buckets[-1]}"]
+        return dict(zip(labels, counts))
+
+batch_stats = BatchStats()
+
+class SchedulerStats:
+    """统计发送线程取出的消息在队列中的等待时间"""
+    def __init__(self):
+        self.workers = 0
+        self.batches = 0
+        self.messages = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_histogram = [0] * (len(QUEUE_WAIT_BUCKETS_MS) + 1)
+        self.lock = Lock()
+
+    def record(self, batch):
+        now = time.time()
+        with self.lock:
+            self.batches += 1
+            for entry in batch:
+                wait_ms = (now - entry[3]) * 1000
+                self.messages += 1
+                self.wait_total += wait_ms
+                self.wait_max = max(self.wait_max, wait_ms)
+                self.wait_histogram[bisect.bisect_left(QUEUE_WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "ready_peers": len(ready_peers),
+                "batches": self.batches,
+                "avg_wait_ms": self.wait_total / self.messages if self.messages else 0,
+                "max_wait_ms": self.wait_max,
+                "wait_histogram_ms": BatchStats._label(QUEUE_WAIT_BUCKETS_MS, self.wait_histogram)
+            }
+
+scheduler_stats = SchedulerStats()
+
+class RetryStats:
+    """重试计数：已安排、已重新入队、超过最大次数放弃"""
+    def __init__(self):
+        self.scheduled = 0
+        self.requeued = 0
+        self.gave_up = 0
+        self.lock = Lock()
+
+    def record_scheduled(self):
+        with self.lock:
+            self.scheduled += 1
+
+    def record_requeued(self):
+        with self.lock:
+            self.requeued += 1
+
+    def record_gave_up(self):
+        with self.lock:
+            self.gave_up += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "scheduled": self.scheduled,
+                "requeued": self.requeued,
+                "waiting": self.scheduled - self.requeued,
+                "gave_up": self.gave_up
+            }
+
+retry_stats = RetryStats()
+
+class CircuitBreakers:
+    """
+    按节点的断路器。连续BREAKER_FAILURE_THRESHOLD次发送失败后断开，断开期间gossip跳过该节点；
+    收到该节点的PONG后重新闭合。PING仍会正常发送，用来探测节点是否恢复。
+    """
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD):
+        self.threshold = threshold
+        self.failures = defaultdict(int)  # {peer_id: 连续失败次数}
+        self.opened = {}                  # {peer_id: 断开时间}
+        self.trips = 0
+        self.lock = Lock()
+
+    def record_failure(self, peer_id):
+        with self.lock:
+            self.failures[peer_id] += 1
+            if self.failures[peer_id] >= self.threshold and peer_id not in self.opened:
+                self.opened[peer_id] = time.time()
+                self.trips += 1
+                logger.warning(f"节点 {peer_id} 连续 {self.failures[peer_id]} 次发送失败，断路器断开")
+
+    def record_success(self, peer_id):
+        with self.lock:
+            self.failures.pop(peer_id, None)
+
+    def close(self, peer_id):
+        with self.lock:
+            self.failures.pop(peer_id, None)
+            if self.opened.pop(peer_id, None) is not None:
+                logger.info(f"收到节点 {peer_id} 的PONG，断路器闭合")
+
+    def is_open(self, peer_id):
+        return peer_id in self.opened
+
+    def stats(self):
+        with self.lock:
+            return {
+                "trips": self.trips,
+                "open": {peer_id: {"since": opened_at, "failures": self.failures.get(peer_id, 0)}
+                         for peer_id, opened_at in self.opened.items()}
+            }
+
+circuit_breakers = CircuitBreakers()
+
+# === Delayed Release ===
+RELEASE_WORKERS = 8  # 执行到期发送的线程数
+
+class TimerQueue:
+    """
+    按到期时间排序的最小堆，由一个调度线程在到期时释放任务，到期任务交给线程池执行。
+    用于模拟网络延迟：大量消息可以同时处于"传输中"，而不占用发送线程。
+    """
+    def __init__(self, workers=RELEASE_WORKERS):
+        self.workers = workers
+        self.heap = []  # [(due, seq, func, args)]
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.executor = None
+        self.scheduled = 0
+        self.fired = 0
+        self.running = 0
+
+    def schedule(self, delay, func, *args):
+        """delay秒后执行func(*args)"""
+        due = time.monotonic() + delay
+        with self.cond:
+            if self.executor is None:
+                # 第一次调度时才启动调度线程
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="release")
+                threading.Thread(target=self._run, daemon=True).start()
+            heapq.heappush(self.heap, (due, next(self.seq), func, args))
+            self.scheduled += 1
+            if self.heap[0][0] == due:
+                # 新任务最早到期，唤醒调度线程重新计算等待时间
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                due_tasks = []
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, func, args = heapq.heappop(self.heap)
+                    due_tasks.append((func, args))
+                self.fired += len(due_tasks)
+                self.running += len(due_tasks)
+            for func, args in due_tasks:
+                self.executor.submit(self._fire, func, args)
+
+    def _fire(self, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"执行延迟任务时出错: {e}")
+        finally:
+            with self.cond:
+                self.running -= 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                "scheduled": self.scheduled,
+                "fired": self.fired,
+                "waiting": len(self.heap),
+                "running": self.running
+            }
+
+timer_queue = TimerQueue()
+
 def enqueue_message(target_id, ip, port, message):
     from peer_manager import blacklist, rtt_tracker 
     # 检查速率限制
     #Check if the peer sends message to the receiver too frequently using the function `is_rate_limited`. If yes, drop the message.
-    if is_rate_limited(target_id):
+    if is_rate_limited(target_id, message.get("type")):
         logger.debug(f"节点发送到 {target_id} 的消息被限制")
         return False
     
@@ -92,48 +501,40 @@ def enqueue_message(target_id, ip, port, message):
     #Classify the priority of the sending messages based on the message type using the function `classify_priority`.
     priority = classify_priority(message)
     
-    # 初始化目标节点的队列(如果不存在)
-    if target_id not in queues:
-        queues[target_id] = defaultdict(deque)
-    
-    #Add the message to the queue (`queues`) if the length of the queue is within the limit `QUEUE_LIMIT`, or otherwise, drop the message.
-    # 检查队列长度限制
-    if sum(len(q) for q in queues[target_id].values()) >= QUEUE_LIMIT:
+    #Add the message to the queue (`queues`) if the length of the queue is within the limit `QUEUE_LIMIT`.
+    # 队列已满时挤掉优先级最低的最旧消息，新消息优先级不够时丢弃新消息
+    with lock:
+        accepted = push_message_locked(target_id, priority, (message, ip, port, time.time(), 0))
+    if not accepted:
         logger.warning(f"发往节点 {target_id} 的队列已满")
         return False
-    
-    # 将消息加入队列
-    with lock:
-        queues[target_id][priority].append((message, ip, port, time.time()))
-        logger.debug(f"消息 {message.get('type')} 已加入发送队列，目标: {target_id}, 优先级: {priority}")
+    logger.debug(f"消息 {message.get('type')} 已加入发送队列，目标: {target_id}, 优先级: {priority}")
     return True
 
+def push_message_locked(target_id, priority, entry):
+    """将消息加入队列并唤醒一个发送线程，返回是否加入成功，调用方需持有lock"""
+    accepted, evicted = queues[target_id].push(priority, entry)
+    if evicted is not None:
+        evicted_type = evicted[0].get("type", "OTHER")
+        eviction_stats[evicted_type] += 1
+        logger.info(f"发往节点 {target_id} 的队列已满，挤出一条 {evicted_type} 消息")
+    if not accepted:
+        queue_full_stats[entry[0].get("type", "OTHER")] += 1
+        return False
+    if target_id not in ready_set:
+        ready_set.add(target_id)
+        ready_peers.append(target_id)
+        queue_cond.notify()
+    return True
 
-def is_rate_limited(peer_id):
-    # TODO:Check how many messages were sent from the peer to a target peer during the `TIME_WINDOW` that ends now.
-  
-    # TODO: If the sending frequency exceeds the sending rate limit `RATE_LIMIT`, return `TRUE`; otherwise, record the current sending time into `peer_send_timestamps`.
-    """检查消息发送频率是否超过限制"""
-    # 确保使用字符串类型的键
-    str_peer_id = str(peer_id)
-    
-    current_time = time.time()
-    # 初始化时间戳列表(如果不存在)
-    if str_peer_id not in peer_send_timestamps:
-        peer_send_timestamps[str_peer_id] = []
-    
-    # 移除过期的时间戳
-    timestamps = peer_send_timestamps[str_peer_id]
-    while timestamps and TIME_WINDOW < current_time - timestamps[0]:
-        timestamps.pop(0)
-    
-    # 检查发送频率
-    if len(timestamps) >= RATE_LIMIT:
-        logger.debug(f"节点 {str_peer_id} 的消息发送频率已达上限，当前窗口内消息数: {len(timestamps)}")
+
+def is_rate_limited(peer_id, msg_type=None):
+    # Check how many messages were sent from the peer to a target peer during the `TIME_WINDOW` that ends now.
+    # If the sending frequency exceeds the sending rate limit `RATE_LIMIT`, return `TRUE`; otherwise, record the current sending.
+    """检查消息发送频率是否超过限制，可以通过outbound_limiter为节点或消息类型单独设置限制"""
+    if outbound_limiter.is_limited(peer_id, msg_type):
+        logger.debug(f"节点 {peer_id} 的消息发送频率已达上限")
         return True
-    
-    # 记录当前发送时间
-    timestamps.append(current_time)
     return False
 
 def classify_priority(message):
@@ -148,81 +549,128 @@ def classify_priority(message):
     return 3  # 低优先级
     
 
-def send_from_queue(self_id):
+def send_from_queue(self_id, workers=SEND_WORKERS):
 
     """从队列中发送消息"""
     def worker():
-        from peer_discovery import known_peers
-        # Read the message in the queue. 
-        # Each time, read one message with the highest priority of a target peer. 
-        # After sending the message, read the message of the next target peer. 
+        # Read the messages in the queue. 
+        # Each time, drain up to `BATCH_MAX_MESSAGES` messages of a target peer in priority order
+        # and write them as one batch. After sending the batch, read the messages of the next target peer. 
         # This ensures the fairness of sending messages to different target peers.
-        # 记录上次处理的节点索引，确保公平处理
-        last_peer_index = 0
-        
         while True:
             try:
-                # 获取当前已知节点列表
-                peers = list(queues.keys())
-                if not peers:
-                    time.sleep(0.1)
-                    continue
-                
-                # 轮询处理每个节点的消息
-                if last_peer_index >= len(peers):
-                    last_peer_index = 0
-                
-                target_id = peers[last_peer_index]
-                last_peer_index = (last_peer_index + 1) % len(peers)
-                
-                # 获取当前节点队列中优先级最高的消息
-                message = None
-                with lock:
-                    for priority in sorted(queues[target_id].keys()):
-                        if queues[target_id][priority]:
-                            message, ip, port, enqueue_time = queues[target_id][priority].popleft()
-                            break
+                # 等待有待发送消息的节点，空闲时不占用CPU
+                with queue_cond:
+                    while not ready_peers:
+                        queue_cond.wait()
+                    target_id = ready_peers.popleft()
+                    
+                    # 按优先级从高到低取出当前节点队列中的多条消息
+                    batch = queues[target_id].pop_batch(BATCH_MAX_MESSAGES)
+                    
+                    # 还有剩余消息的节点排到队尾，保证各节点轮流发送
+                    if len(queues[target_id]):
+                        ready_peers.append(target_id)
+                    else:
+                        ready_set.discard(target_id)
                 
-                if not message:
+                if not batch:
                     continue
+                scheduler_stats.record(batch)
                 
                 # 检查消息是否超时
-                if time.time() - enqueue_time > 30:  # 30秒超时
-                    logger.warning(f"消息发送超时，丢弃: {message.get('type')} 到 {target_id}")
-                    continue
-                # Send the message using the function `relay_or_direct_send`, which will decide whether to send the message to target peer directly or through a relaying peer.
-                # 发送消息
-                success = relay_or_direct_send(self_id,target_id,message)
+                entries = []
+                now = time.time()
+                for entry in batch:
+                    if now - entry[3] > 30:  # 30秒超时
+                        logger.warning(f"消息发送超时，丢弃: {entry[0].get('type')} 到 {target_id}")
+                        continue
+                    entries.append(entry)
                 
-                #Retry a message if it is sent unsuccessfully and drop the message if the retry times exceed the limit `MAX_RETRIES`
-                if not success:
-                    # 记录重试次数
-                    retries[target_id] = retries.get(target_id, 0) + 1
-                    
-                    if retries[target_id] <= MAX_RETRIES:
-                        # 重新入队，但降低优先级
-                        priority = classify_priority(message) + 1 #数字越小优先级越小
-                        with lock:
-                            queues[target_id][priority].append((message, ip, port, time.time()))
-                        logger.debug(f"重试发送消息到 {target_id}，尝试次数: {retries[target_id]}")
-                    else:
-                        logger.warning(f"发送到 {target_id} 的消息已达最大重试次数，放弃发送")
-                        retries[target_id] = 0
-                else:
-                    retries[target_id] = 0
+                if not entries:
+                    continue
+                # Send the messages using the function `relay_or_direct_send_batch`, which will decide whether to send the messages to target peer directly or through a relaying peer.
+                # 合并发送消息：立即返回被丢弃的消息，其余消息在模拟延迟到期后发送，结果通过回调返回
+                messages = [entry[0] for entry in entries]
+                on_complete = lambda failed, link_peer, target_id=target_id, entries=entries: \
+                    handle_send_result(target_id, failed, entries, link_peer=link_peer)
+                dropped = relay_or_direct_send_batch(self_id, target_id, messages, on_complete)
+                if dropped:
+                    handle_send_result(target_id, dropped, entries)
             
             except Exception as e:
                 logger.error(f"发送消息时出错: {e}")
-            
-            finally:
-                time.sleep(0.01)  # 避免CPU过载
     
-    threading.Thread(target=worker, daemon=True).start()
-    threading.Thread(target=worker, daemon=True).start()
+    scheduler_stats.workers += workers
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+def handle_send_result(target_id, failed, entries, link_peer=None):
+    """
+    处理一批消息的发送结果。entries为这一批的队列条目 (message, ip, port, enqueue_time, attempt)，
+    failed为其中未能发送的消息，重试次数随队列条目传递。
+    link_peer为实际建立连接的节点（直接发送时是目标节点，经中继发送时是中继节点），
+    结果来自实际的连接发送（而不是模拟丢包）时给出，计入该节点的断路器。
+    """
+    if link_peer is not None:
+        if failed:
+            circuit_breakers.record_failure(link_peer)
+        else:
+            circuit_breakers.record_success(link_peer)
+
+    #Retry the messages sent unsuccessfully and drop them if the retry times exceed the limit `MAX_RETRIES`
+    for message, ip, port, _, attempt in failed_entries(entries, failed):
+        attempt += 1
+        if attempt > MAX_RETRIES:
+            logger.warning(f"发送到 {target_id} 的 {message.get('type')} 消息已达最大重试次数，放弃发送")
+            retry_stats.record_gave_up()
+            continue
+        # 按指数退避延迟后重新入队，并降低优先级
+        delay = get_retry_delay(attempt)
+        priority = min(classify_priority(message) + 1, PRIORITY_LEVELS[-1])  # 数字越小优先级越高，重试的消息降低一级
+        retry_stats.record_scheduled()
+        timer_queue.schedule(delay, requeue_message, target_id, priority, (message, ip, port, None, attempt))
+        logger.debug(f"{delay:.2f}秒后重试发送 {message.get('type')} 到 {target_id}，尝试次数: {attempt}")
+
+def failed_entries(entries, failed):
+    """
+    找出failed中的消息对应的队列条目。发送路径（模拟丢包、分批写入、中继解包）都保持消息顺序，
+    failed是entries中消息的子序列，按对象身份顺序匹配一遍即可
+    """
+    result = []
+    index = 0
+    for entry in entries:
+        if index < len(failed) and entry[0] is failed[index]:
+            result.append(entry)
+            index += 1
+    return result
 
-def relay_or_direct_send(self_id, dst_id, message):
+def get_retry_delay(attempt):
+    """带抖动的指数退避：在 [d/2, d] 之间随机取值，d = RETRY_BASE_DELAY * 2^(attempt-1)，不超过RETRY_INTERVAL"""
+    delay = min(RETRY_INTERVAL, RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def requeue_message(target_id, priority, entry):
+    """退避结束后把消息重新放回发送队列"""
+    message, ip, port, _, attempt = entry
+    retry_stats.record_requeued()
+    with lock:
+        push_message_locked(target_id, priority, (message, ip, port, time.time(), attempt))
+
+def relay_or_direct_send(self_id, dst_id, message, on_complete=None):
+    """
+    发送单条消息（README中要求的接口，发送线程已改用relay_or_direct_send_batch，不再调用本函数）。
+    返回True只表示消息已进入模拟延迟队列，并不表示已经发出；实际发送结果通过on_complete(成功与否)返回。
+    """
+    callback = (lambda failed, link_peer: on_complete(not failed)) if on_complete else None
+    return not relay_or_direct_send_batch(self_id, dst_id, [message], callback)
+
+def relay_or_direct_send_batch(self_id, dst_id, messages, on_complete=None):
     from peer_discovery import known_peers, peer_flags, peer_config
-    """检查目标节点是否为NAT节点,决定是直接发送消息还是通过中继节点"""
+    """
+    检查目标节点是否为NAT节点,决定是直接发送消息还是通过中继节点。
+    立即返回被丢弃的消息列表，其余消息延迟发送后调用on_complete(未能发送的消息列表, 实际连接的节点ID)
+    """
     # Check if the target peer is NATed. 
     is_nated = False
     if dst_id in peer_flags and peer_flags[dst_id].get("nat",False):
@@ -234,7 +682,7 @@ def relay_or_direct_send(self_id, dst_id, message):
     # If the target peer is NATed, use the function `get_relay_peer` to find the best relaying peer. 
     # Define the JSON format of a `RELAY` message, which should include `{message type, sender's ID, target peer's ID, `payload`}`. 
     # `payload` is the sending message. 
-    # Send the `RELAY` message to the best relaying peer using the function `send_message`.
+    # Send the `RELAY` messages to the best relaying peer using the function `send_messages`.
     if is_nated:
         # 找到最佳中继节点
         logger.info(f"为NAT节点 {dst_id} 寻找中继节点...")
@@ -242,30 +690,33 @@ def relay_or_direct_send(self_id, dst_id, message):
         
         if relay_peer:
             # 创建中继消息
-            relay_message = {
+            relay_messages = [{
                 "type": "RELAY",
                 "sender_id": self_id,
                 "target_id": dst_id,
                 "payload": message,
-            }
+            } for message in messages]
             
             # 发送中继消息
-            logger.info(f"通过中继节点 {relay_peer[0]} ({relay_peer[1]}:{relay_peer[2]}) 发送消息到NAT节点 {dst_id}")
-            return send_message(relay_peer[1], relay_peer[2], relay_message)
+            logger.info(f"通过中继节点 {relay_peer[0]} ({relay_peer[1]}:{relay_peer[2]}) 发送 {len(messages)} 条消息到NAT节点 {dst_id}")
+            unwrap = lambda failed: [relay_message["payload"] for relay_message in failed]
+            callback = (lambda failed: on_complete(unwrap(failed), relay_peer[0])) if on_complete else None
+            return unwrap(send_messages(relay_peer[1], relay_peer[2], relay_messages, callback))
         else:
             logger.warning(f"找不到节点 {dst_id} 的中继节点，无法发送消息")
-            return False
+            return list(messages)
     
-    # If the target peer is non-NATed, send the message to the target peer using the function `send_message`.
+    # If the target peer is non-NATed, send the messages to the target peer using the function `send_messages`.
     else:
         # 直接发送消息
         if dst_id in known_peers:
             peer_ip, peer_port = known_peers[dst_id]
-            logger.info(f"直接发送消息到节点 {dst_id} ({peer_ip}:{peer_port})")
-            return send_message(peer_ip, peer_port, message)
+            logger.info(f"直接发送 {len(messages)} 条消息到节点 {dst_id} ({peer_ip}:{peer_port})")
+            callback = (lambda failed: on_complete(failed, dst_id)) if on_complete else None
+            return send_messages(peer_ip, peer_port, messages, callback)
         else:
             logger.warning(f"未知节点 {dst_id}，无法发送消息")
-            return False
+            return list(messages)
 
 def get_relay_peer(self_id, dst_id):
     from peer_discovery import known_peers,peer_flags
@@ -316,76 +767,64 @@ def get_relay_peer(self_id, dst_id):
         logger.warning(f"[{self_id}] get_relay_peer: 节点 {dst_id}：尽管有候选，但未能选择一个有效的中继节点。")
         return None
 
+def prepare_message(ip, port, message):
+    """记录待发送的消息并编码为字节流，返回 (消息类型, 字节流)"""
+    from peer_discovery import known_peers, peer_config
+    # 从消息中获取发送者ID（如果是字典类型）
+    sender_id = "UNKNOWN"
+    if isinstance(message, dict) and "sender_id" in message:
+        sender_id = message["sender_id"]
+    elif isinstance(message, dict) and "peer_id" in message:
+        sender_id = message["peer_id"]
+    else:
+        # 尝试从配置中获取当前节点ID
+        sender_id = peer_config.get("self_id", "UNKNOWN")
+    
+    # 记录发送的消息
+    from message_log import log_sent_message
+    
+    # 尝试找出接收者ID
+    receiver_id = "UNKNOWN"
+    for peer_id, (peer_ip, peer_port) in known_peers.items():
+        if peer_ip == ip and peer_port == port:
+            receiver_id = peer_id
+            break
+    
+    # 获取消息类型
+    if isinstance(message, dict):
+        msg_type = message.get('type', 'UNKNOWN')
+    elif isinstance(message, str):
+        try:
+            msg_data = json.loads(message.strip())
+            msg_type = msg_data.get('type', 'UNKNOWN')
+        except:
+            msg_type = 'UNKNOWN'
+    else:
+        msg_type = 'UNKNOWN'
+        
+    log_sent_message(sender_id, receiver_id, msg_type, message)
+    
+    # 按目标节点支持的帧格式编码
+    return msg_type, encode_message(message, receiver_id)
+
 def send_message(ip, port, message):
     
     # Wrap the function `send_message` with the dynamic network condition 
     # in the function `apply_network_condition` of `link_simulator.py`.
-    """发送消息到目标节点"""
-    from peer_discovery import known_peers, peer_config
+    """
+    发送单条消息到目标节点（README中要求的接口，发送线程已改用send_messages，不再调用本函数）。
+    经apply_network_conditions包装后，返回True只表示消息已进入模拟延迟队列，实际发送结果通过on_complete返回。
+    """
     # Send the message to the target peer. 
     try:
-        # 从消息中获取发送者ID（如果是字典类型）
-        sender_id = "UNKNOWN"
-        if isinstance(message, dict) and "sender_id" in message:
-            sender_id = message["sender_id"]
-        elif isinstance(message, dict) and "peer_id" in message:
-            sender_id = message["peer_id"]
-        else:
-            # 尝试从配置中获取当前节点ID
-            sender_id = peer_config.get("self_id", "UNKNOWN")
-        
-        # 记录发送的消息
-        from dashboard import log_sent_message
-        
-        # 尝试找出接收者ID
-        receiver_id = "UNKNOWN"
-        for peer_id, (peer_ip, peer_port) in known_peers.items():
-            if peer_ip == ip and peer_port == port:
-                receiver_id = peer_id
-                break
-        
-        # 获取消息类型
-        if isinstance(message, dict):
-            msg_type = message.get('type', 'UNKNOWN')
-        elif isinstance(message, str):
-            try:
-                import json
-                msg_data = json.loads(message.strip())
-                msg_type = msg_data.get('type', 'UNKNOWN')
-            except:
-                msg_type = 'UNKNOWN'
-        else:
-            msg_type = 'UNKNOWN'
-            
-        log_sent_message(sender_id, receiver_id, msg_type, message)
-            
+        msg_type, message_bytes = prepare_message(ip, port, message)
         logger.info(f"准备发送消息: 类型={msg_type}, 目标={ip}:{port}")   
             
-        
-        # 创建并配置套接字
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.settimeout(5)
-        
-        # 连接目标节点
-        logger.info(f"尝试连接到: {ip}:{port}")
-        client_socket.connect((ip, int(port)))
-        
-        # 确保发送的是字节流
-        if isinstance(message, dict):
-            import json
-            message_bytes = (json.dumps(message) + "\n").encode()
-        elif isinstance(message, str):
-            message_bytes = message.encode() if not message.endswith('\n') else message.encode()
-        else:
-            message_bytes = str(message).encode()
-            
-        # 发送数据
-        client_socket.sendall(message_bytes)
+        # 通过连接池发送数据，复用到目标节点的长连接
+        connection_pool.sendall(ip, port, message_bytes)
+        batch_stats.record(1, len(message_bytes))
         
         logger.info(f"消息发送成功: 类型={msg_type}, 目标={ip}:{port}, 大小={len(message_bytes)}字节")
-        
-        # 关闭连接
-        client_socket.close()
         return True
         
     except ConnectionRefusedError:
@@ -398,41 +837,124 @@ def send_message(ip, port, message):
         logger.error(f"发送消息到 {ip}:{port} 失败: {str(e)}")
         return False
 
+def send_messages(ip, port, messages):
+    """将发往同一节点的多条消息合并写入同一连接，每次写入不超过BATCH_MAX_BYTES，返回未能发送的消息列表"""
+    sent = 0
+    try:
+        encoded = [prepare_message(ip, port, message)[1] for message in messages]
+        logger.info(f"准备合并发送 {len(messages)} 条消息, 目标={ip}:{port}")
+        
+        while sent < len(encoded):
+            # 凑满一批再写，单条超过上限的消息单独写出
+            end = sent + 1
+            nbytes = len(encoded[sent])
+            while end < len(encoded) and nbytes + len(encoded[end]) <= BATCH_MAX_BYTES:
+                nbytes += len(encoded[end])
+                end += 1
+            connection_pool.sendall(ip, port, b"".join(encoded[sent:end]))
+            batch_stats.record(end - sent, nbytes)
+            sent = end
+        
+        logger.info(f"批量发送成功: {len(messages)} 条消息, 目标={ip}:{port}")
+        
+    except ConnectionRefusedError:
+        logger.error(f"连接被拒绝: {ip}:{port} - 目标节点可能未启动或端口未开放")
+    except socket.timeout:
+        logger.error(f"连接超时: {ip}:{port}")
+    except Exception as e:
+        logger.error(f"批量发送消息到 {ip}:{port} 失败: {str(e)}")
+    return list(messages[sent:])
+
+
+def encode_message(message, receiver_id):
+    """将消息编码为字节流，按目标节点在HELLO中声明的帧格式、编码和压缩能力选择长度前缀帧/二进制编码/zlib压缩"""
+    from peer_discovery import peer_flags
+    flags = peer_flags.get(receiver_id, {})
+    if isinstance(message, str):
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return encode_line(message.rstrip("\n").encode())
+    elif not isinstance(message, dict):
+        return encode_line(str(message).encode())
+
+    if flags.get("framing") == "length":
+        frame_flags, payload = encode_payload(message, choose_codec(flags), supports_compression(flags))
+        return encode_frame(payload, frame_flags)
+    return encode_line(json.dumps(message).encode())
+
+
+def passes_network_conditions(ip, port, message):
+    """模拟发送容量限制和随机丢包，消息被丢弃时返回False"""
+    msg_type = message.get("type", "OTHER") if isinstance(message, dict) else "STRING"
+    # 检查发送容量限制
+    # Use the function `rate_limiter.allow` to check if the peer's sending rate is out of limit. 
+    # If yes, drop the message and update the drop states (`drop_stats`).
+    if not rate_limiter.allow():
+        drop_stats[msg_type] = drop_stats.get(msg_type, 0) + 1
+        logger.info(f"消息因容量限制而丢弃: 类型={msg_type}, 目标={ip}:{port}")
+        return False
+    
+    # 模拟随机丢包
+    # Generate a random number. If it is smaller than `DROP_PROB`, 
+    # drop the message to simulate the random message drop in the channel. 
+    # Update the drop states (`drop_stats`).
+    if random.random() < DROP_PROB:
+        drop_stats[msg_type] = drop_stats.get(msg_type, 0) + 1
+        logger.info(f"消息因随机丢包而丢弃: 类型={msg_type}, 目标={ip}:{port}")
+        return False
+    return True
 
 def apply_network_conditions(send_func):
-    def wrapper(ip, port, message):
-        # 检查发送容量限制
-        # Use the function `rate_limiter.allow` to check if the peer's sending rate is out of limit. 
-        # If yes, drop the message and update the drop states (`drop_stats`).
-        if not rate_limiter.allow():
-            msg_type = message.get("type", "OTHER") if isinstance(message, dict) else "STRING"
-            drop_stats[msg_type] = drop_stats.get(msg_type, 0) + 1
-            logger.info(f"消息因容量限制而丢弃: 类型={msg_type}, 目标={ip}:{port}")
-            return False
-        
-        # 模拟随机丢包
-        # Generate a random number. If it is smaller than `DROP_PROB`, 
-        # drop the message to simulate the random message drop in the channel. 
-        # Update the drop states (`drop_stats`).
-        if random.random() < DROP_PROB:
-            msg_type = message.get("type", "OTHER")
-            drop_stats[msg_type] = drop_stats.get(msg_type, 0) + 1
-            logger.info(f"消息因随机丢包而丢弃: 类型={msg_type}, 目标={ip}:{port}")
+    """单条发送的网络条件包装：被丢弃时返回False，否则进入模拟延迟队列并返回True（尚未发送）"""
+    def wrapper(ip, port, message, on_complete=None):
+        if not passes_network_conditions(ip, port, message):
             return False
             
         # 模拟网络延迟
         # Add a random latency before sending the message to simulate message transmission delay.
+        # 消息在延迟到期后由timer_queue释放发送，发送线程不会被阻塞
         latency = random.uniform(LATENCY_MS[0], LATENCY_MS[1]) / 1000.0
-        time.sleep(latency)
-        
-        # 执行实际发送
-        # Send the message using the function `send_func`.
-        return send_func(ip, port, message)
+        timer_queue.schedule(latency, release_delayed_send, send_func, (ip, port, message), on_complete)
+        return True
     
     return wrapper
 
+def apply_batch_network_conditions(send_func):
+    def wrapper(ip, port, messages, on_complete=None):
+        # 每条消息单独计入发送容量和丢包，整批共享一次网络延迟
+        dropped = []
+        passed = []
+        for message in messages:
+            if passes_network_conditions(ip, port, message):
+                passed.append(message)
+            else:
+                dropped.append(message)
+        if passed:
+            latency = random.uniform(LATENCY_MS[0], LATENCY_MS[1]) / 1000.0
+            timer_queue.schedule(latency, release_delayed_send, send_func, (ip, port, passed), on_complete)
+        return dropped
+    
+    return wrapper
+
+def release_delayed_send(send_func, args, on_complete):
+    """模拟延迟到期后执行实际发送，并把结果交给on_complete"""
+    result = send_func(*args)
+    if on_complete:
+        on_complete(result)
+
+def configure_network_conditions(drop_prob=None, latency_ms=None):
+    """调整模拟丢包率和延迟范围（毫秒）"""
+    global DROP_PROB, LATENCY_MS
+    if drop_prob is not None:
+        DROP_PROB = drop_prob
+    if latency_ms is not None:
+        LATENCY_MS = tuple(latency_ms)
+    logger.info(f"网络模拟参数: 丢包率={DROP_PROB}, 延迟={LATENCY_MS[0]}-{LATENCY_MS[1]}ms")
+
 # 应用网络条件
 send_message = apply_network_conditions(send_message)
+send_messages = apply_batch_network_conditions(send_messages)
 
 def start_dynamic_capacity_adjustment():
     def adjust_loop():
@@ -455,6 +977,20 @@ def start_dynamic_capacity_adjustment():
                 
     threading.Thread(target=adjust_loop, daemon=True).start()
 
+def start_connection_reaper():
+    def reap_loop():
+        # Periodically close the pooled connections that have been idle for too long.
+        while True:
+            try:
+                time.sleep(connection_pool.idle_timeout / 2)
+                closed = connection_pool.evict_idle()
+                if closed:
+                    logger.info(f"回收了 {closed} 个空闲连接")
+            except Exception as e:
+                logger.error(f"回收空闲连接时出错: {e}")
+
+    threading.Thread(target=reap_loop, daemon=True).start()
+
 
 def gossip_message(self_id, message, fanout=3):
     """将消息传播给多个目标节点"""
@@ -475,6 +1011,10 @@ def gossip_message(self_id, message, fanout=3):
         # 如果节点状态是UNREACHABLE，则跳过该节点
         if status == "UNREACHABLE":
             continue
+        
+        # 断路器断开（连续发送失败）的节点也跳过
+        if circuit_breakers.is_open(peer_id):
+            continue
             
         # 如果是交易消息，排除轻量级节点
         if message.get("type") == "TX":
@@ -508,22 +1048,33 @@ def gossip_message(self_id, message, fanout=3):
 
 def get_outbox_status():
     # Return the message in the outbox queue.
-    """获取outbox队列状态"""
+    """获取outbox队列状态、连接池命中情况、批量发送、压缩、传输中消息、排队时间、重试及断路器统计"""
     status = {}
     # 遍历每个节点
-    for peer, priority_queues in queues.items():
-        peer_status = {
-            "total_messages": sum(len(q) for q in priority_queues.values()),
-            "priority_breakdown": {
-                priority: len(queue) for priority, queue in priority_queues.items()
+    with lock:
+        for peer, peer_queue in queues.items():
+            peer_status = {
+                "total_messages": len(peer_queue),
+                "priority_breakdown": peer_queue.counts()
             }
-        }
-        status[peer] = peer_status
+            status[peer] = peer_status
     
-    return status
+    return {
+        "queues": status,
+        "connection_pool": connection_pool.stats(),
+        "batches": batch_stats.stats(),
+        "compression": get_compression_stats(),
+        "in_flight": timer_queue.stats(),
+        "scheduler": scheduler_stats.stats(),
+        "retries": retry_stats.stats(),
+        "circuit_breakers": circuit_breakers.stats()
+    }
 
 
 def get_drop_stats():
     # Return the drop states (`drop_stats`).
-    """获取丢弃的消息统计"""
-    return drop_stats
\ No newline at end of file
+    """获取丢弃的消息统计，evicted/queue_full为发送队列满时被挤出/拒绝的消息数（按类型）"""
+    stats = dict(drop_stats)
+    stats["evicted"] = dict(eviction_stats)
+    stats["queue_full"] = dict(queue_full_stats)
+    return stats
\ No newline at end of file
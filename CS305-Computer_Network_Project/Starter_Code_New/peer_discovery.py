@@ -1,5 +1,7 @@
 import json, time, threading
 from utils import generate_message_id
+from framing import get_framing_flag
+from codec import SUPPORTED_CODECS, SUPPORTED_COMPRESSION
 
 
 known_peers = {}        # { peer_id: (ip, port) }
@@ -38,6 +40,9 @@ def start_peer_discovery(self_id, self_info):
             "flags": {
                 "nat": self_info.get("nat", False),
                 "light": self_info.get("light", False),
+                "framing": get_framing_flag(),  # 声明支持的帧格式，对方据此选择编码
+                "codecs": SUPPORTED_CODECS,  # 声明支持的消息编码，二进制编码只用于长度前缀帧
+                "compress": SUPPORTED_COMPRESSION,  # 声明支持的压缩算法，大消息会被压缩
                 "new_node": True  # 标记为新节点，第一次发送时使用
             },
             "message_id": generate_message_id()
@@ -98,7 +103,10 @@ def handle_hello_message(msg, self_id):
     # 无论节点是否已知，都更新flags信息
     peer_flags[sender_id] = {
         "nat": sender_flags.get("nat", False),
-        "light": sender_flags.get("light", False)
+        "light": sender_flags.get("light", False),
+        "framing": sender_flags.get("framing", "newline"),  # 旧版本节点只支持换行分隔
+        "codecs": sender_flags.get("codecs", ["json"]),
+        "compress": sender_flags.get("compress", [])
     }
 
     # 可达性更新
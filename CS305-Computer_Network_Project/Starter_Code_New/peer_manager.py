@@ -11,6 +11,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 peer_status = {}  # {peer_id: 'ALIVE', 'UNREACHABLE' or 'UNKNOWN'}
 last_ping_time = {}  # {peer_id: timestamp}
 rtt_tracker = {}  # {peer_id: transmission latency}
+first_pong = threading.Event()  # 收到第一个PONG时置位，用于统计启动耗时
 
 PING_INTERVAL = 5  # 每隔 5 秒 ping 一次
 PING_TIMEOUT = 10  # 超过 10 秒无响应就标记 UNREACHABLE
@@ -69,6 +70,11 @@ def handle_pong(msg):
 
     rtt_tracker[sender_id] = rtt
     update_peer_heartbeat(sender_id)
+    first_pong.set()
+
+    # 节点已恢复响应，闭合发送断路器
+    from outbox import circuit_breakers
+    circuit_breakers.close(sender_id)
 
 
 def start_heartbeat_checker():
@@ -205,7 +211,7 @@ def start_dead_node_cleaner():
                     
                     # 通知仪表盘
                     try:
-                        from dashboard import notify_node_left
+                        from message_log import notify_node_left
                         notify_node_left(peer_id, "timeout_removed")
                     except ImportError:
                         pass
@@ -0,0 +1,144 @@
+import time
+import threading
+
+# === Sliding-window Rate Limits ===
+# 出站(outbox)和入站(message_handler)共用的按节点限流组件。
+# 每个限流计数器把时间窗口分成固定数量的时间片，使用环形数组记录每片的消息数并维护窗口内总数，
+# 每次检查最多清理RATE_LIMIT_SLICES个过期时间片，开销与窗口内的消息数无关。
+RATE_LIMIT_SLICES = 10  # 每个时间窗口划分的时间片数，越大越接近精确的滑动窗口
+
+class SlidingWindowCounter:
+    """单个节点（或节点+消息类型）的滑动窗口计数器"""
+    __slots__ = ("limit", "window", "slice_len", "counts", "head", "total")
+
+    def __init__(self, limit, window, slices=RATE_LIMIT_SLICES):
+        self.limit = limit
+        self.window = window
+        self.slice_len = window / slices
+        self.counts = [0] * slices
+        self.head = 0    # 最新时间片的编号
+        self.total = 0   # 窗口内的消息总数
+
+    def _advance(self, now):
+        slot = int(now / self.slice_len)
+        steps = slot - self.head
+        if steps <= 0:
+            return
+        size = len(self.counts)
+        if steps >= size:
+            # 整个窗口都已过期
+            self.counts = [0] * size
+            self.total = 0
+        else:
+            for i in range(1, steps + 1):
+                index = (self.head + i) % size
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        self.head = slot
+
+    def hit(self, now, count_rejected=False):
+        """记录一条消息，未超过限制时返回True；count_rejected为True时被限制的消息也计入窗口"""
+        self._advance(now)
+        allowed = self.total < self.limit
+        if allowed or count_rejected:
+            self.counts[self.head % len(self.counts)] += 1
+            self.total += 1
+        return allowed
+
+    def count(self, now):
+        self._advance(now)
+        return self.total
+
+class RateLimiterGroup:
+    """
+    按节点限流，可以为单个节点或单个消息类型设置不同的限制。
+    设置了类型限制的消息单独计数，其余消息共用节点的默认计数器。
+    """
+    def __init__(self, name, limit, window, count_rejected=False):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.count_rejected = count_rejected
+        self.peer_limits = {}  # {peer_id: (limit, window)}
+        self.type_limits = {}  # {msg_type: (limit, window)}
+        self.counters = {}     # {(peer_id, msg_type或None): SlidingWindowCounter}
+        self.checks = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def configure(self, limit=None, window=None):
+        """修改默认限制，已有的计数器会被重置"""
+        with self.lock:
+            if limit is not None:
+                self.limit = limit
+            if window is not None:
+                self.window = window
+            self.counters.clear()
+
+    def set_peer_limit(self, peer_id, limit, window=None):
+        with self.lock:
+            self.peer_limits[str(peer_id)] = (limit, window or self.window)
+            self._reset(lambda key: key[0] == str(peer_id))
+
+    def set_type_limit(self, msg_type, limit, window=None):
+        with self.lock:
+            self.type_limits[msg_type] = (limit, window or self.window)
+            self._reset(lambda key: key[1] == msg_type)
+
+    def _reset(self, match):
+        for key in [key for key in self.counters if match(key)]:
+            del self.counters[key]
+
+    def is_limited(self, peer_id, msg_type=None):
+        """记录一条来自/发往peer_id的消息，超过限制时返回True"""
+        str_peer_id = str(peer_id)
+        if msg_type not in self.type_limits:
+            msg_type = None
+        key = (str_peer_id, msg_type)
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                if msg_type is not None:
+                    limit, window = self.type_limits[msg_type]
+                else:
+                    limit, window = self.peer_limits.get(str_peer_id, (self.limit, self.window))
+                counter = self.counters[key] = SlidingWindowCounter(limit, window)
+            self.checks += 1
+            allowed = counter.hit(now, self.count_rejected)
+            if not allowed:
+                self.rejected += 1
+        return not allowed
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            peers = {}
+            for (peer_id, msg_type), counter in self.counters.items():
+                count = counter.count(now)
+                if count:
+                    peers[f"{peer_id}:{msg_type}" if msg_type else peer_id] = {
+                        "count": count,
+                        "limit": counter.limit,
+                        "window": counter.window
+                    }
+            return {
+                "limit": self.limit,
+                "window": self.window,
+                "peer_limits": dict(self.peer_limits),
+                "type_limits": dict(self.type_limits),
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "active": peers
+            }
+
+limiters = {}  # {name: RateLimiterGroup}
+
+def create_limiter(name, limit, window, count_rejected=False):
+    """创建并登记一个限流器，仪表盘通过get_rate_limit_stats展示所有限流器的状态"""
+    limiter = RateLimiterGroup(name, limit, window, count_rejected)
+    limiters[name] = limiter
+    return limiter
+
+def get_rate_limit_stats():
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,384 @@
+import time
+import json
+import hashlib
+import threading
+import logging
+from peer_discovery import known_peers, peer_flags
+from outbox import enqueue_message, outbound_limiter
+from utils import generate_message_id
+from block_handler import chain_store, compute_block_hash, request_block_sync
+
+logger = logging.getLogger(__name__)
+
+# === Chain Snapshots ===
+# 完整节点在检查点高度（SNAPSHOT_INTERVAL的整数倍，且至少落后链顶SNAPSHOT_CONFIRMATIONS个高度）生成主链快照：
+# 从创世区块到检查点的区块按SNAPSHOT_CHUNK_BLOCKS个一组分块，每块计算SHA-256，
+# 快照哈希 = SHA-256(检查点高度, 检查点区块ID, 所有分块哈希)。
+# 新节点向所有节点请求快照清单，选择被最多节点报告的快照哈希（相同时选高度更高的），
+# 从报告该快照的节点并行下载分块，逐块校验分块哈希、区块哈希和前后链接后按顺序加入chain_store，
+# 最后确认链顶就是清单中的检查点区块，再只同步检查点之后的部分。
+SNAPSHOT_INTERVAL = 100         # 检查点间隔（高度）
+SNAPSHOT_CONFIRMATIONS = 6      # 检查点至少落后链顶的高度数，避免快照中的区块被重组掉
+SNAPSHOT_CHUNK_BLOCKS = 1000    # 每个分块的区块数
+SNAPSHOT_REFRESH_SECONDS = 10   # 完整节点检查是否需要生成新快照的间隔
+SNAPSHOT_MANIFEST_WAIT = 2      # 新节点收集快照清单的时间（秒）
+SNAPSHOT_WINDOW = 4             # 每个节点同时在途的分块请求数
+SNAPSHOT_CHUNK_TIMEOUT = 5      # 分块请求超时后换一个节点重新请求（秒）
+SNAPSHOT_SYNC_TIMEOUT = 300     # 快照同步的总超时，超时或校验失败时回退到逐段同步
+SNAPSHOT_RETAIN_SECONDS = 30    # 被替换的旧快照在最后一次被请求后继续保留的时间，让进行中的下载能够完成
+SNAPSHOT_RATE_LIMIT = 100       # 快照消息单独的速率限制（每个限流窗口内的消息数）
+
+# 分块消息体积大、数量少，不占用节点默认的消息配额
+for _msg_type in ("GET_SNAPSHOT_CHUNK", "SNAPSHOT_CHUNK"):
+    outbound_limiter.set_type_limit(_msg_type, SNAPSHOT_RATE_LIMIT)
+
+class SnapshotError(Exception):
+    """快照内容与清单不符"""
+    pass
+
+def compute_chunk_hash(blocks):
+    return hashlib.sha256(json.dumps(blocks, sort_keys=True).encode()).hexdigest()
+
+def compute_snapshot_hash(height, block_id, chunk_hashes):
+    return hashlib.sha256(json.dumps([height, block_id, chunk_hashes]).encode()).hexdigest()
+
+def get_checkpoint_height(tip_height, interval=SNAPSHOT_INTERVAL, confirmations=SNAPSHOT_CONFIRMATIONS):
+    """链顶高度为tip_height时的检查点高度，链太短时返回None"""
+    height = (tip_height - confirmations) // interval * interval
+    return height if height > 0 else None
+
+class ChainSnapshot:
+    """主链在检查点高度的快照"""
+    def __init__(self, height, block_id, chunks, chunk_hashes):
+        self.height = height
+        self.block_id = block_id
+        self.chunks = chunks              # [[block]]
+        self.chunk_hashes = chunk_hashes
+        self.snapshot_hash = compute_snapshot_hash(height, block_id, chunk_hashes)
+        self.created = time.time()
+
+    def manifest(self):
+        return {
+            "height": self.height,
+            "block_id": self.block_id,
+            "snapshot_hash": self.snapshot_hash,
+            "chunk_hashes": self.chunk_hashes
+        }
+
+def build_snapshot(store, height, chunk_blocks=SNAPSHOT_CHUNK_BLOCKS, previous=None):
+    """
+    生成主链在height处的快照。previous中最后一个区块仍在主链上的完整分块直接复用，
+    所以检查点前进时只需处理新增的区块。主链在height处没有区块时返回None。
+    """
+    chunks, chunk_hashes = [], []
+    with store.lock:
+        if previous is not None:
+            for chunk, chunk_hash in zip(previous.chunks, previous.chunk_hashes):
+                if len(chunk) < chunk_blocks or chunk[-1].get("height", 0) > height \
+                        or not store.on_best_chain(chunk[-1]["block_id"]):
+                    break
+                chunks.append(chunk)
+                chunk_hashes.append(chunk_hash)
+        start_height = chunks[-1][-1].get("height", 0) + 1 if chunks else 0
+        blocks = list(store.iter_best_chain(start_height, height))
+    if not blocks and not chunks:
+        return None
+    last_block = blocks[-1] if blocks else chunks[-1][-1]
+    if last_block.get("height", 0) != height:
+        return None
+    for i in range(0, len(blocks), chunk_blocks):
+        chunk = blocks[i:i + chunk_blocks]
+        chunks.append(chunk)
+        chunk_hashes.append(compute_chunk_hash(chunk))
+    return ChainSnapshot(height, last_block["block_id"], chunks, chunk_hashes)
+
+class SnapshotProducer:
+    """
+    完整节点当前提供的快照，检查点前进（或主链在检查点处发生变化）时重新生成。
+    被替换的旧快照继续提供分块，直到SNAPSHOT_RETAIN_SECONDS内没有再被请求（下载已完成或已放弃）；
+    新旧快照共用未变化的分块，保留旧快照的额外内存只有变化的部分。
+    """
+    def __init__(self, store, chunk_blocks=SNAPSHOT_CHUNK_BLOCKS, retain_seconds=SNAPSHOT_RETAIN_SECONDS):
+        self.store = store
+        self.chunk_blocks = chunk_blocks
+        self.retain_seconds = retain_seconds
+        self.current = None
+        self.retired = {}   # {snapshot_hash: [snapshot, 最后一次被请求的时间]}
+        self.builds = 0
+        self.last_build_ms = 0.0
+        self.chunks_served = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        height = get_checkpoint_height(self.store.tip_height())
+        with self.lock:
+            self._prune_retired(time.time())
+            current = self.current
+            if height is None or (current is not None and current.height == height
+                                  and self.store.on_best_chain(current.block_id)):
+                return current
+            start = time.perf_counter()
+            snapshot = build_snapshot(self.store, height, self.chunk_blocks, current)
+            if snapshot is not None:
+                if current is not None and current.snapshot_hash != snapshot.snapshot_hash:
+                    self.retired[current.snapshot_hash] = [current, time.time()]
+                self.retired.pop(snapshot.snapshot_hash, None)
+                self.current = snapshot
+                self.builds += 1
+                self.last_build_ms = (time.perf_counter() - start) * 1000
+                logger.info(f"生成快照: 检查点高度 {height}, {len(snapshot.chunks)} 个分块, "
+                            f"耗时 {self.last_build_ms:.1f}ms")
+            return self.current
+
+    def _prune_retired(self, now):
+        for snapshot_hash in [h for h, entry in self.retired.items() if now - entry[1] > self.retain_seconds]:
+            del self.retired[snapshot_hash]
+
+    def get_chunk(self, snapshot_hash, index, now=None):
+        """当前快照或仍保留的旧快照的第index个分块，快照已丢弃或index越界时返回None"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._prune_retired(now)
+            snapshot = self.current
+            if snapshot is None or snapshot.snapshot_hash != snapshot_hash:
+                entry = self.retired.get(snapshot_hash)
+                if entry is None:
+                    return None
+                snapshot = entry[0]
+                entry[1] = now
+            if not 0 <= index < len(snapshot.chunks):
+                return None
+            self.chunks_served += 1
+            return snapshot.chunks[index]
+
+    def stats(self):
+        with self.lock:
+            snapshot = self.current
+            return {
+                "height": snapshot.height if snapshot else None,
+                "snapshot_hash": snapshot.snapshot_hash if snapshot else None,
+                "chunks": len(snapshot.chunks) if snapshot else 0,
+                "retired": len(self.retired),
+                "builds": self.builds,
+                "last_build_ms": self.last_build_ms,
+                "chunks_served": self.chunks_served
+            }
+
+class SnapshotDownload:
+    """新节点下载一个快照的状态：收集清单、分配分块请求、校验并按顺序应用分块"""
+    def __init__(self, window=SNAPSHOT_WINDOW, chunk_timeout=SNAPSHOT_CHUNK_TIMEOUT):
+        self.window = window
+        self.chunk_timeout = chunk_timeout
+        self.manifests = {}       # {peer_id: manifest}
+        self.manifest = None      # 选定的清单
+        self.peers = []           # 报告了选定快照的节点
+        self.requested = {}       # {index: (peer_id, 请求时间)}
+        self.received = {}        # {index: blocks}，已校验分块哈希、等待按顺序应用
+        self.next_index = 0       # 下一个要应用的分块
+        self.last_block_id = None
+        self.last_height = None
+        self.applied_blocks = 0
+        self.retries = 0
+        self.cond = threading.Condition()
+
+    def add_manifest(self, peer_id, manifest):
+        """记录节点报告的清单，快照哈希与内容不符时返回False"""
+        try:
+            expected = compute_snapshot_hash(manifest["height"], manifest["block_id"], manifest["chunk_hashes"])
+        except (KeyError, TypeError):
+            return False
+        if expected != manifest.get("snapshot_hash"):
+            return False
+        with self.cond:
+            self.manifests[peer_id] = manifest
+            self.cond.notify_all()
+        return True
+
+    def choose(self):
+        """选择被最多节点报告的快照（相同时选高度更高的），没有清单时返回None"""
+        with self.cond:
+            groups = {}
+            for peer_id, manifest in self.manifests.items():
+                groups.setdefault(manifest["snapshot_hash"], []).append(peer_id)
+            if not groups:
+                return None
+            snapshot_hash = max(groups, key=lambda h: (len(groups[h]), self.manifests[groups[h][0]]["height"]))
+            self.peers = sorted(groups[snapshot_hash])
+            self.manifest = self.manifests[self.peers[0]]
+            return self.manifest
+
+    @property
+    def done(self):
+        return self.manifest is not None and self.next_index >= len(self.manifest["chunk_hashes"])
+
+    def next_requests(self, now=None):
+        """返回需要发送的(peer_id, index)：超时的分块换一个节点重发，每个节点的在途请求不超过window"""
+        if now is None:
+            now = time.time()
+        with self.cond:
+            in_flight = {peer_id: 0 for peer_id in self.peers}
+            for peer_id, requested_at in self.requested.values():
+                if now - requested_at <= self.chunk_timeout and peer_id in in_flight:
+                    in_flight[peer_id] += 1
+            requests = []
+            for index in range(self.next_index, len(self.manifest["chunk_hashes"])):
+                if min(in_flight.values()) >= self.window:
+                    break
+                previous = self.requested.get(index)
+                if index in self.received or (previous is not None and now - previous[1] <= self.chunk_timeout):
+                    continue
+                # 超时的分块优先交给其他节点
+                choices = [p for p in self.peers if previous is None or p != previous[0]] or self.peers
+                peer_id = min(choices, key=in_flight.get)
+                if in_flight[peer_id] >= self.window:
+                    continue
+                if previous is not None:
+                    self.retries += 1
+                self.requested[index] = (peer_id, now)
+                in_flight[peer_id] += 1
+                requests.append((peer_id, index))
+            return requests
+
+    def add_chunk(self, snapshot_hash, index, blocks):
+        """记录收到的分块，分块与清单不符时返回False"""
+        with self.cond:
+            if self.manifest is None or snapshot_hash != self.manifest["snapshot_hash"]:
+                return False
+            if not 0 <= index < len(self.manifest["chunk_hashes"]) \
+                    or compute_chunk_hash(blocks) != self.manifest["chunk_hashes"][index]:
+                return False
+            self.requested.pop(index, None)
+            if index >= self.next_index:
+                self.received[index] = blocks
+            self.cond.notify_all()
+            return True
+
+    def apply_ready(self, store):
+        """按顺序把已收到的连续分块加入store，校验区块哈希和前后链接，返回加入的区块数"""
+        applied = 0
+        while True:
+            with self.cond:
+                blocks = self.received.pop(self.next_index, None)
+            if blocks is None:
+                break
+            for block in blocks:
+                if block.get("previous_block_id") != self.last_block_id:
+                    raise SnapshotError(f"快照分块 {self.next_index} 中区块 {block.get('block_id')} 没有链接到前一个区块")
+                if self.last_height is not None and block.get("height") != self.last_height + 1:
+                    raise SnapshotError(f"快照分块 {self.next_index} 中区块 {block.get('block_id')} 的高度不正确")
+                if compute_block_hash(block) != block.get("block_id"):
+                    raise SnapshotError(f"快照分块 {self.next_index} 中区块 {block.get('block_id')} 哈希不正确")
+                store.add_block(block)
+                self.last_block_id = block["block_id"]
+                self.last_height = block.get("height", 0)
+            applied += len(blocks)
+            with self.cond:
+                self.next_index += 1
+        self.applied_blocks += applied
+        if self.done and self.last_block_id != self.manifest["block_id"]:
+            raise SnapshotError(f"快照最后一个区块 {self.last_block_id} 不是检查点区块 {self.manifest['block_id']}")
+        return applied
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait(timeout)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "manifests": len(self.manifests),
+                "height": self.manifest["height"] if self.manifest else None,
+                "peers": list(self.peers),
+                "chunks": len(self.manifest["chunk_hashes"]) if self.manifest else 0,
+                "applied_chunks": self.next_index,
+                "applied_blocks": self.applied_blocks,
+                "in_flight": len(self.requested),
+                "retries": self.retries
+            }
+
+snapshot_producer = SnapshotProducer(chain_store)
+snapshot_download = None  # 正在进行或最近一次的快照下载
+initial_sync_done = threading.Event()  # 快照同步完成或回退到逐段同步后设置，新的完整节点在此之前不生成创世区块
+
+def start_snapshot_producer(interval=SNAPSHOT_REFRESH_SECONDS):
+    """完整节点定期检查检查点是否前进并生成新快照"""
+    def loop():
+        while True:
+            try:
+                snapshot_producer.refresh()
+            except Exception as e:
+                logger.error(f"生成快照失败: {e}")
+            time.sleep(interval)
+    threading.Thread(target=loop, daemon=True).start()
+
+def send_to_peer(peer_id, message):
+    if peer_id not in known_peers:
+        return False
+    ip, port = known_peers[peer_id]
+    enqueue_message(peer_id, ip, port, message)
+    return True
+
+def snapshot_sync(self_id, manifest_wait=SNAPSHOT_MANIFEST_WAIT, timeout=SNAPSHOT_SYNC_TIMEOUT):
+    """
+    新的完整节点的初始同步：下载快照后只同步检查点之后的区块。
+    没有节点提供快照、下载超时或校验失败时回退到request_block_sync的逐段同步。
+    """
+    global snapshot_download
+    start = time.time()
+    download = snapshot_download = SnapshotDownload()
+    request = {"type": "GET_SNAPSHOT_MANIFEST", "sender_id": self_id}
+    for peer_id in list(known_peers):
+        if peer_id != self_id and not peer_flags.get(peer_id, {}).get("light", False):
+            send_to_peer(peer_id, dict(request, message_id=generate_message_id()))
+    time.sleep(manifest_wait)
+
+    manifest = download.choose()
+    if manifest is None:
+        logger.info(f"[{self_id}] 没有节点提供快照，使用逐段同步")
+        request_block_sync(self_id, True)
+        return False
+    logger.info(f"[{self_id}] 选择快照: 检查点高度 {manifest['height']}, {len(manifest['chunk_hashes'])} 个分块, "
+                f"来自节点 {download.peers}")
+
+    try:
+        while not download.done:
+            if time.time() - start > timeout:
+                raise SnapshotError(f"快照同步超过 {timeout} 秒")
+            for peer_id, index in download.next_requests():
+                send_to_peer(peer_id, {
+                    "type": "GET_SNAPSHOT_CHUNK",
+                    "sender_id": self_id,
+                    "snapshot_hash": manifest["snapshot_hash"],
+                    "index": index,
+                    "message_id": generate_message_id()
+                })
+            download.wait(0.5)
+            download.apply_ready(chain_store)
+    except SnapshotError as e:
+        logger.warning(f"[{self_id}] 快照同步失败，回退到逐段同步: {e}")
+        request_block_sync(self_id, True)
+        return False
+
+    logger.info(f"[{self_id}] 快照同步完成: {download.applied_blocks} 个区块, 链顶高度 {chain_store.tip_height()}, "
+                f"耗时 {time.time() - start:.2f}s，开始同步检查点之后的区块")
+    request_block_sync(self_id)
+    return True
+
+def start_snapshot_sync(self_id):
+    """在后台线程中运行snapshot_sync，结束（成功或回退到逐段同步）后设置initial_sync_done"""
+    def run():
+        try:
+            snapshot_sync(self_id)
+        except Exception as e:
+            logger.error(f"[{self_id}] 快照同步出错: {e}")
+        finally:
+            initial_sync_done.set()
+    threading.Thread(target=run, daemon=True).start()
+    return initial_sync_done
+
+def get_snapshot_stats():
+    return {
+        "producer": snapshot_producer.stats(),
+        "download": snapshot_download.stats() if snapshot_download else None
+    }
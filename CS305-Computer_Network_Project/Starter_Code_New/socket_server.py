@@ -1,28 +1,157 @@
 import socket
 import threading
+import asyncio
 import json
 import logging
-from message_handler import dispatch_message
+import queue
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from framing import FrameBuffer, FrameError
+from codec import decode_payload, CodecError
 
 # 初始化日志器
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def start_socket_server(self_id, self_ip, port):
+DISPATCH_WORKERS = 8  # asyncio模式下解码消息的线程数
+
+# === Dispatch Lanes ===
+# 解码后的消息按类型放入不同的有界队列（lane），每个lane有固定数量的处理线程，
+# 心跳消息不会排在区块处理后面，耗时的同步请求也不会阻塞区块和交易的处理。
+# lane名 -> (处理线程数, 队列容量)
+DISPATCH_LANES = {
+    "control": (2, 1000),  # 心跳和节点发现
+    "block": (1, 500),     # 区块和区块头，单线程按到达顺序更新链
+    "sync": (2, 200),      # 区块/交易池同步请求，可能需要较长时间
+    "default": (2, 1000),  # 交易、中继及其他消息
+}
+TYPE_LANES = {
+    "PING": "control", "PONG": "control", "HELLO": "control", "NEW_PEER": "control", "GOODBYE": "control",
+    "BLOCK": "block", "BLOCK_BATCH": "block", "BLOCK_HEADERS": "block", "INV": "block",
+    "GETBLOCK": "sync", "GET_BLOCK_HEADERS": "sync", "GET_LATEST_BLOCK": "sync", "GET_MEMPOOL": "sync",
+    "GET_BLOCKS": "sync",
+}
+
+class DispatchPool:
+    """按消息类型分lane的接收端处理线程池，队列满时submit阻塞，从而暂停读取该连接"""
+    def __init__(self, handler, self_id, lanes=None):
+        self.handler = handler
+        self.lanes = {}
+        self.type_stats = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "wait_ms": 0.0})
+        self.max_depth = defaultdict(int)
+        self.lock = threading.Lock()
+        for lane, (workers, maxsize) in (lanes or DISPATCH_LANES).items():
+            self.lanes[lane] = queue.Queue(maxsize=maxsize)
+            for i in range(workers):
+                threading.Thread(target=self._worker, args=(lane,), name=f"dispatch-{self_id}-{lane}-{i}",
+                                 daemon=True).start()
+
+    def submit(self, msg, self_id, self_ip):
+        lane = TYPE_LANES.get(msg.get("type"), "default")
+        lane_queue = self.lanes.get(lane) or self.lanes["default"]
+        lane_queue.put((msg, self_id, self_ip, time.time()))
+        depth = lane_queue.qsize()
+        if depth > self.max_depth[lane]:
+            self.max_depth[lane] = depth
+
+    def _worker(self, lane):
+        lane_queue = self.lanes[lane]
+        while True:
+            msg, self_id, self_ip, queued_at = lane_queue.get()
+            start = time.time()
+            try:
+                self.handler(msg, self_id, self_ip)
+            except Exception as e:
+                logger.error(f"处理消息时出错: {str(e)}")
+            finally:
+                elapsed_ms = (time.time() - start) * 1000
+                with self.lock:
+                    stats = self.type_stats[msg.get("type", "UNKNOWN")]
+                    stats["count"] += 1
+                    stats["total_ms"] += elapsed_ms
+                    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+                    stats["wait_ms"] += (start - queued_at) * 1000
+
+    def stats(self):
+        with self.lock:
+            types = {
+                msg_type: {
+                    "count": stats["count"],
+                    "avg_ms": stats["total_ms"] / stats["count"],
+                    "max_ms": stats["max_ms"],
+                    "avg_wait_ms": stats["wait_ms"] / stats["count"]
+                } for msg_type, stats in self.type_stats.items() if stats["count"]
+            }
+        return {
+            "lanes": {
+                lane: {
+                    "depth": lane_queue.qsize(),
+                    "max_depth": self.max_depth[lane],
+                    "capacity": lane_queue.maxsize
+                } for lane, lane_queue in self.lanes.items()
+            },
+            "types": types
+        }
+
+dispatch_pool = None  # 当前节点的DispatchPool
+
+def get_dispatch_stats():
+    """接收端各lane的队列深度及各类型消息的处理耗时"""
+    return dispatch_pool.stats() if dispatch_pool else {}
+
+def get_bind_ip(self_ip):
+    # 确保绑定正确的网络接口
+    if self_ip == "127.0.0.1" or self_ip == "localhost":
+        # 本地测试用
+        return self_ip
+    # 使用0.0.0.0接收所有网络接口的连接
+    return "0.0.0.0"
+
+def process_frame(flags, payload, self_id, self_ip, handler):
+    """解码一帧消息（换行分隔或长度前缀，payload为memoryview）并交给handler（通常是DispatchPool.submit）"""
+    if not payload:  # 确保不是空消息
+        return
+    try:
+        json_data = decode_payload(flags, payload)
+        sender_id = json_data.get('sender_id')
+        if not sender_id:
+            sender_id = json_data.get('peer_id')
+        logger.info(f"接收到消息: 类型={json_data.get('type', 'UNKNOWN')}, 发送者={sender_id}")
+        handler(json_data, self_id, self_ip)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        logger.warning(f"节点 {self_id} 收到非法JSON：{bytes(payload[:100])}")
+    except CodecError as e:
+        logger.warning(f"节点 {self_id} 收到无法解码的二进制消息: {e}")
+    except Exception as e:
+        logger.error(f"处理消息时出错: {str(e)}")
+
+def start_socket_server(self_id, self_ip, port, use_asyncio=True, handler=None):
+    """
+    启动入站消息服务器，默认使用asyncio事件循环，use_asyncio=False时使用旧的每连接一线程模式。
+    接收线程只负责读取和解码，消息交给DispatchPool的处理线程执行handler。
+    """
+    global dispatch_pool
+    if handler is None:
+        from message_handler import dispatch_message
+        handler = dispatch_message
+    dispatch_pool = DispatchPool(handler, self_id)
+    handler = dispatch_pool.submit
+
+    if use_asyncio:
+        start_async_socket_server(self_id, self_ip, port, handler)
+    else:
+        start_threaded_socket_server(self_id, self_ip, port, handler)
+
+def start_threaded_socket_server(self_id, self_ip, port, handler):
 
     def listen_loop():
         try:
             server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # 确保绑定正确的网络接口
-            if self_ip == "127.0.0.1" or self_ip == "localhost":
-                # 本地测试用
-                bind_ip = self_ip
-            else:
-                # 使用0.0.0.0接收所有网络接口的连接
-                bind_ip = "0.0.0.0"
-                
+
+            bind_ip = get_bind_ip(self_ip)
+
             logger.info(f"节点 {self_id} 尝试在 {bind_ip}:{port} 上监听连接 (实际IP: {self_ip})")
             server_socket.bind((bind_ip, port))
             server_socket.listen(10)  # 增加队列大小
@@ -37,41 +166,29 @@ def start_socket_server(self_id, self_ip, port):
                 client_socket, addr = server_socket.accept()
                 logger.info(f"节点 {self_id} 接收到来自 {addr} 的连接")
 
-                def handle_client(sock):
+                def handle_client(sock, addr):
                     try:
                         # 设置超时时间，防止连接被无限阻塞
                         sock.settimeout(30)
-                        buffer = b""
-                        
+                        frame_buffer = FrameBuffer()
+
                         # 持续接收数据直到连接关闭
                         while True:
                             try:
-                                chunk = sock.recv(4096)
-                                if not chunk:  # 连接已关闭
+                                nbytes = sock.recv_into(frame_buffer.writable())
+                                if not nbytes:  # 连接已关闭
                                     break
-                                
-                                buffer += chunk
-                                logger.debug(f"接收到数据块: {len(chunk)} 字节，当前缓冲区大小: {len(buffer)} 字节")
-                                
+
+                                frame_buffer.commit(nbytes)
+                                logger.debug(f"接收到数据块: {nbytes} 字节")
+
                                 # 处理缓冲区中所有完整的消息
-                                while b"\n" in buffer:
-                                    # 分割第一个完整消息和剩余部分
-                                    msg_bytes, buffer = buffer.split(b"\n", 1)
-                                    
-                                    if msg_bytes:  # 确保不是空消息
-                                        try:
-                                            msg_str = msg_bytes.decode()
-                                            json_data = json.loads(msg_str)
-                                            sender_id = json_data.get('sender_id')
-                                            if not sender_id:
-                                                sender_id = json_data.get('peer_id')
-                                            logger.info(f"接收到消息: 类型={json_data.get('type', 'UNKNOWN')}, 发送者={sender_id}")
-                                            dispatch_message(json_data, self_id, self_ip)
-                                        except json.JSONDecodeError:
-                                            logger.warning(f"节点 {self_id} 收到非法JSON：{msg_bytes[:100]}")
-                                        except Exception as e:
-                                            logger.error(f"处理消息时出错: {str(e)}")
-                            
+                                for flags, payload in frame_buffer.frames():
+                                    process_frame(flags, payload, self_id, self_ip, handler)
+
+                            except FrameError as e:
+                                logger.warning(f"来自 {addr} 的数据帧无效: {e}，断开连接")
+                                break
                             except socket.timeout:
                                 # 超时但连接可能仍然有效，继续尝试接收
                                 continue
@@ -89,9 +206,77 @@ def start_socket_server(self_id, self_ip, port):
                         sock.close()
                         logger.debug(f"关闭与客户端 {addr} 的连接")
 
-                threading.Thread(target=handle_client, args=(client_socket,), daemon=True).start()
+                threading.Thread(target=handle_client, args=(client_socket, addr), daemon=True).start()
 
             except Exception as e:
                 logger.error(f"接收连接出错：{str(e)}")
 
     threading.Thread(target=listen_loop, daemon=True).start()
+
+def start_async_socket_server(self_id, self_ip, port, handler):
+    # 所有入站连接都由同一个事件循环处理，消息按连接顺序交给有限的线程池解码后放入处理队列
+    executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS, thread_name_prefix=f"dispatch-{self_id}")
+
+    def process_frames(frames):
+        for flags, payload in frames:
+            process_frame(flags, payload, self_id, self_ip, handler)
+
+    class FrameProtocol(asyncio.BufferedProtocol):
+        """事件循环直接把数据读入连接的FrameBuffer"""
+        def __init__(self):
+            self.frame_buffer = FrameBuffer()
+            self.transport = None
+            self.addr = None
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.addr = transport.get_extra_info("peername")
+            logger.info(f"节点 {self_id} 接收到来自 {self.addr} 的连接")
+
+        def get_buffer(self, sizehint):
+            return self.frame_buffer.writable()
+
+        def buffer_updated(self, nbytes):
+            self.frame_buffer.commit(nbytes)
+            try:
+                frames = list(self.frame_buffer.frames())
+            except FrameError as e:
+                logger.warning(f"来自 {self.addr} 的数据帧无效: {e}，断开连接")
+                self.transport.close()
+                return
+            if not frames:
+                return
+            # 帧引用的是接收缓冲区，处理完之前暂停读取，同时保持同一连接内的消息顺序
+            self.transport.pause_reading()
+            future = asyncio.get_running_loop().run_in_executor(executor, process_frames, frames)
+            future.add_done_callback(self.frames_processed)
+
+        def frames_processed(self, future):
+            if future.exception():
+                logger.error(f"处理消息时出错: {future.exception()}")
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+
+        def connection_lost(self, exc):
+            if isinstance(exc, ConnectionResetError):
+                # 连接被对方重置
+                logger.warning(f"连接被重置: {self.addr}")
+            logger.debug(f"关闭与客户端 {self.addr} 的连接")
+
+    async def serve():
+        bind_ip = get_bind_ip(self_ip)
+        logger.info(f"节点 {self_id} 尝试在 {bind_ip}:{port} 上监听连接 (实际IP: {self_ip}, asyncio模式)")
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(FrameProtocol, bind_ip, port,
+                                          reuse_address=True, backlog=128)
+        logger.info(f"节点 {self_id} 成功在 {bind_ip}:{port} 上开始监听连接")
+        async with server:
+            await server.serve_forever()
+
+    def run_loop():
+        try:
+            asyncio.run(serve())
+        except Exception as e:
+            logger.error(f"节点 {self_id} 启动失败：{str(e)}")
+
+    threading.Thread(target=run_loop, daemon=True).start()
@@ -401,6 +401,7 @@ function refreshAllData() {
         fetchPeers(),
         fetchBlocks(),
         fetchOrphanBlocks(),
+        fetchTipEvents(),
         fetchTransactions(),
         fetchCapacity(),
         fetchRedundancy(),
@@ -613,6 +614,38 @@ function fetchOrphanBlocks() {
         .catch(error => console.error('获取孤立区块信息失败:', error));
 }
 
+// 获取链顶变化事件
+function fetchTipEvents() {
+    return fetch('/api/blockchain/tip_events')
+        .then(response => response.json())
+        .then(data => {
+            const tableBody = document.getElementById('tip-events-table');
+            tableBody.innerHTML = '';
+            
+            if (data.length === 0) {
+                tableBody.innerHTML = '<tr><td colspan="5" class="empty-state">没有链顶变化</td></tr>';
+                return;
+            }
+            
+            // 最新的事件显示在最前面
+            data.slice().reverse().forEach(event => {
+                const row = document.createElement('tr');
+                const previous = event.previous_tip
+                    ? `<span class="blockchain-id" title="${event.previous_tip}">${truncateId(event.previous_tip)}</span> (${event.previous_height})`
+                    : '无';
+                row.innerHTML = `
+                    <td>${formatTimestamp(event.timestamp)}</td>
+                    <td><span class="blockchain-id" title="${event.block_id}">${truncateId(event.block_id)}</span></td>
+                    <td>${event.height}</td>
+                    <td>${previous}</td>
+                    <td>${event.reorg_depth || 0}</td>
+                `;
+                tableBody.appendChild(row);
+            });
+        })
+        .catch(error => console.error('获取链顶变化失败:', error));
+}
+
 // 获取交易信息
 function fetchTransactions() {
     return fetch('/transactions')
@@ -900,7 +933,10 @@ function fetchNetworkStats() {
             const container = document.getElementById('network-stats-content');
             const section = document.getElementById('network-stats-section');
             
-            if (!data || (Object.keys(data.outbox_status || {}).length === 0 && Object.keys(data.drop_stats || {}).length === 0)) {
+            const outbox = data ? (data.outbox_status || {}) : {};
+            const queues = outbox.queues || {};
+            
+            if (!data || (Object.keys(queues).length === 0 && Object.keys(data.drop_stats || {}).length === 0)) {
                 section.classList.add('empty');
                 container.innerHTML = '<div class="empty-state">没有网络统计数据</div>';
                 return;
@@ -912,24 +948,98 @@ function fetchNetworkStats() {
             
             // 显示发送队列状态
             html += '<dt>发送队列状态</dt>';
-            if (Object.keys(data.outbox_status || {}).length === 0) {
+            if (Object.keys(queues).length === 0) {
                 html += '<dd>无发送队列数据</dd>';
             } else {
                 html += '<dd><ul>';
-                for (const [peerId, queueInfo] of Object.entries(data.outbox_status)) {
+                for (const [peerId, queueInfo] of Object.entries(queues)) {
                     html += `<li>节点 ${peerId}: ${queueInfo.total_messages} 条消息等待发送</li>`;
                 }
                 html += '</ul></dd>';
             }
             
+            // 显示连接池状态
+            if (outbox.connection_pool) {
+                const pool = outbox.connection_pool;
+                html += '<dt>连接池</dt>';
+                html += `<dd>命中 ${pool.hits} 次，未命中 ${pool.misses} 次，回收 ${pool.evictions} 个，空闲连接 ${pool.idle_connections} 个</dd>`;
+            }
+
+            // 显示批量发送统计
+            if (outbox.batches) {
+                const batches = outbox.batches;
+                const formatHistogram = histogram => Object.entries(histogram)
+                    .map(([bucket, count]) => `${bucket}: ${count}`).join('，');
+                html += '<dt>批量发送</dt>';
+                html += `<dd>共 ${batches.batches} 批 ${batches.messages} 条消息，平均每批 ${batches.avg_messages_per_batch.toFixed(1)} 条</dd>`;
+                html += `<dd>每批消息数 ${formatHistogram(batches.message_histogram)}</dd>`;
+                html += `<dd>每批字节数 ${formatHistogram(batches.byte_histogram)}</dd>`;
+            }
+
+            // 显示压缩节省的带宽
+            if (outbox.compression) {
+                const compression = outbox.compression;
+                html += '<dt>压缩</dt>';
+                html += `<dd>压缩 ${compression.frames_compressed} 帧，节省 ${(compression.bytes_saved / 1024).toFixed(1)} KB（压缩率 ${(compression.ratio * 100).toFixed(1)}%），解压 ${compression.frames_decompressed} 帧</dd>`;
+            }
+
+            // 显示重试和断路器状态
+            if (outbox.retries) {
+                html += '<dt>重试</dt>';
+                html += `<dd>已安排 ${outbox.retries.scheduled} 次，退避中 ${outbox.retries.waiting} 条，放弃 ${outbox.retries.gave_up} 条</dd>`;
+            }
+            if (outbox.circuit_breakers) {
+                const openPeers = Object.keys(outbox.circuit_breakers.open || {});
+                html += '<dt>断路器</dt>';
+                html += `<dd>累计断开 ${outbox.circuit_breakers.trips} 次，当前断开: ${openPeers.length > 0 ? openPeers.join(', ') : '无'}</dd>`;
+            }
+
+            // 显示接收端处理队列
+            if (data.dispatch && data.dispatch.lanes) {
+                html += '<dt>接收处理队列</dt>';
+                const lanes = Object.entries(data.dispatch.lanes)
+                    .map(([lane, info]) => `${lane}: ${info.depth}/${info.capacity}（峰值 ${info.max_depth}）`);
+                html += `<dd>${lanes.join('，')}</dd>`;
+                const types = Object.entries(data.dispatch.types || {});
+                if (types.length > 0) {
+                    html += '<dd><ul>';
+                    for (const [msgType, info] of types) {
+                        html += `<li>${msgType}: ${info.count} 条，平均处理 ${info.avg_ms.toFixed(2)} ms，最长 ${info.max_ms.toFixed(2)} ms，平均排队 ${info.avg_wait_ms.toFixed(2)} ms</li>`;
+                    }
+                    html += '</ul></dd>';
+                }
+            }
+
+            // 显示出站/入站限流状态
+            for (const [name, limiter] of Object.entries(data.rate_limits || {})) {
+                html += `<dt>限流 (${name === 'outbound' ? '出站' : name === 'inbound' ? '入站' : name})</dt>`;
+                html += `<dd>每 ${limiter.window} 秒 ${limiter.limit} 条，已检查 ${limiter.checks} 次，限制 ${limiter.rejected} 次</dd>`;
+                const active = Object.entries(limiter.active || {});
+                if (active.length > 0) {
+                    html += '<dd><ul>';
+                    for (const [key, counter] of active) {
+                        html += `<li>${key}: ${counter.count}/${counter.limit}</li>`;
+                    }
+                    html += '</ul></dd>';
+                }
+            }
+
             // 显示消息丢弃统计
             html += '<dt>消息丢弃统计</dt>';
             if (Object.keys(data.drop_stats || {}).length === 0) {
                 html += '<dd>无消息丢弃数据</dd>';
             } else {
                 html += '<dd><ul>';
+                const queueDropLabels = { evicted: '队列满被挤出', queue_full: '队列满被拒绝' };
                 for (const [msgType, count] of Object.entries(data.drop_stats)) {
-                    html += `<li>${msgType}: 丢弃 ${count} 次</li>`;
+                    if (typeof count === 'object') {
+                        // 发送队列满时按消息类型统计的挤出/拒绝次数
+                        for (const [queuedType, queuedCount] of Object.entries(count)) {
+                            html += `<li>${queuedType}: ${queueDropLabels[msgType] || msgType} ${queuedCount} 次</li>`;
+                        }
+                    } else {
+                        html += `<li>${msgType}: 丢弃 ${count} 次</li>`;
+                    }
                 }
                 html += '</ul></dd>';
             }
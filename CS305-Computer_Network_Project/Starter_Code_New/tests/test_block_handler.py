@@ -0,0 +1,60 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import block_handler
+from block_handler import compute_block_hash, handle_block
+from chain_store import ChainStore
+from orphan_pool import OrphanPool
+
+
+def make_block(previous, height, miner="5001"):
+    block = {"type": "BLOCK", "peer_id": miner, "timestamp": float(height), "block_id": "",
+             "previous_block_id": previous["block_id"] if previous else None, "height": height,
+             "transactions": [], "message_id": f"{miner}-{height}"}
+    block["block_id"] = compute_block_hash(block)
+    return block
+
+
+class HandleBlockHeightTest(unittest.TestCase):
+    def setUp(self):
+        self.store = ChainStore()
+        patches = [mock.patch.object(block_handler, "chain_store", self.store),
+                   mock.patch.object(block_handler, "orphan_pool", OrphanPool())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.chain = [make_block(None, 1)]
+        for height in range(2, 11):
+            self.chain.append(make_block(self.chain[-1], height))
+        for block in self.chain:
+            handle_block(dict(block), "5002")
+
+    def test_inflated_height_does_not_become_tip(self):
+        tip_id = self.store.tip_id
+        handle_block(make_block(self.chain[0], 10 ** 9, miner="6666"), "5002")
+        self.assertEqual(self.store.tip_id, tip_id)
+        self.assertEqual(self.store.tip_height(), 10)
+        self.assertEqual(len(self.store.best), 10)
+
+    def test_inflated_height_orphan_is_dropped(self):
+        parent = make_block(self.chain[-1], 11, miner="6666")
+        orphan = make_block(parent, 10 ** 9, miner="6666")
+        handle_block(orphan, "5002")
+        handle_block(parent, "5002")
+        self.assertEqual(self.store.tip_id, parent["block_id"])
+        self.assertNotIn(orphan["block_id"], self.store)
+
+    def test_next_height_extends_chain(self):
+        block = make_block(self.chain[-1], 11)
+        handle_block(block, "5002")
+        self.assertEqual(self.store.tip_id, block["block_id"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import sys
+import os
+import tempfile
+import unittest
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from block_log import BlockLog, INDEX_ENTRY
+
+
+def make_block(height):
+    return {"block_id": f"b{height}", "previous_block_id": f"b{height - 1}" if height > 1 else None,
+            "height": height, "transactions": []}
+
+
+class BlockLogTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def open_log(self, **kwargs):
+        log = BlockLog(self.directory, **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+    def replay(self, **kwargs):
+        """重新打开日志并重放，返回(日志, 区块列表, 区块头列表)"""
+        log = self.open_log(**kwargs)
+        blocks, headers = [], []
+        log.replay(blocks.append, headers.append)
+        return log, blocks, headers
+
+    def write(self, count, **kwargs):
+        log, _, _ = self.replay(**kwargs)
+        for height in range(1, count + 1):
+            log.append_block(make_block(height))
+        log.close()
+
+    def segment_path(self, segment=0):
+        return os.path.join(self.directory, f"blocks-{segment:06d}.log")
+
+    def test_round_trip_keeps_order(self):
+        log, _, _ = self.replay()
+        log.append_block(make_block(1))
+        log.append_header({"block_id": "h2", "previous_block_id": "b1", "height": 2})
+        log.append_block(make_block(2))
+        log.close()
+        _, blocks, headers = self.replay()
+        self.assertEqual(blocks, [make_block(1), make_block(2)])
+        self.assertEqual([h["block_id"] for h in headers], ["h2"])
+
+    def test_torn_tail_is_truncated(self):
+        self.write(5)
+        # 最后一条记录只写了一部分
+        with open(self.segment_path(), "r+b") as f:
+            f.truncate(os.path.getsize(self.segment_path()) - 3)
+        log, blocks, _ = self.replay()
+        self.assertEqual([b["height"] for b in blocks], [1, 2, 3, 4])
+        # 截断后继续追加，重放时不会读到残留的半条记录
+        log.append_block(make_block(5))
+        log.close()
+        _, blocks, _ = self.replay()
+        self.assertEqual([b["height"] for b in blocks], [1, 2, 3, 4, 5])
+
+    def test_corrupt_record_stops_replay(self):
+        self.write(5)
+        with open(self.segment_path(), "r+b") as f:
+            data = f.read()
+            f.seek(data.index(b'"b3"'))
+            f.write(b'"x3"')
+        _, blocks, _ = self.replay()
+        self.assertEqual([b["height"] for b in blocks], [1, 2])
+
+    def test_lost_index_is_rebuilt_from_segments(self):
+        # 段很小，记录分布在多个段中
+        self.write(20, segment_max_bytes=300)
+        self.assertTrue(os.path.exists(self.segment_path(3)))
+        index_path = os.path.join(self.directory, "blocks.idx")
+        with open(index_path, "r+b") as f:
+            f.truncate(0)
+        _, blocks, _ = self.replay(segment_max_bytes=300)
+        self.assertEqual([b["height"] for b in blocks], list(range(1, 21)))
+        # 索引已重写
+        self.assertGreater(os.path.getsize(index_path), 0)
+        _, blocks, _ = self.replay(segment_max_bytes=300)
+        self.assertEqual(len(blocks), 20)
+
+    def test_index_behind_after_segment_switch(self):
+        self.write(20, segment_max_bytes=300)
+        index_path = os.path.join(self.directory, "blocks.idx")
+        # 索引只记录了前5条
+        with open(index_path, "r+b") as f:
+            f.truncate(5 * INDEX_ENTRY.size)
+        _, blocks, _ = self.replay(segment_max_bytes=300)
+        self.assertEqual([b["height"] for b in blocks], list(range(1, 21)))
+
+
+if __name__ == "__main__":
+    unittest.main()
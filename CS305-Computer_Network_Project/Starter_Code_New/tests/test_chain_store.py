@@ -0,0 +1,87 @@
+import sys
+import os
+import threading
+import unittest
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from chain_store import ChainStore
+
+
+def make_chain(store, count, tag="a", parent=None, start_height=1):
+    previous = parent
+    for height in range(start_height, start_height + count):
+        block_id = f"{tag}{height}"
+        store.add_block({"block_id": block_id, "previous_block_id": previous, "height": height})
+        previous = block_id
+    return previous
+
+
+class BestChainTest(unittest.TestCase):
+    def test_reorg_to_higher_branch_records_depth(self):
+        store = ChainStore()
+        make_chain(store, 10)
+        make_chain(store, 6, tag="b", parent="a7", start_height=8)
+        self.assertEqual(store.tip_id, "b13")
+        self.assertEqual(store.reorgs, 1)
+        self.assertEqual(store.max_reorg_depth, 3)
+        self.assertTrue(store.on_best_chain("a7"))
+        self.assertFalse(store.on_best_chain("a8"))
+        self.assertEqual(store.inventory(), [f"a{h}" for h in range(1, 8)] + [f"b{h}" for h in range(8, 14)])
+
+    def test_equal_height_keeps_first_received(self):
+        store = ChainStore()
+        make_chain(store, 10)
+        make_chain(store, 3, tag="b", parent="a7", start_height=8)
+        self.assertEqual(store.tip_id, "a10")
+        self.assertEqual(store.reorgs, 0)
+        self.assertEqual(len(store.best), 10)
+
+    def test_branch_with_missing_ancestor_does_not_replace_best_chain(self):
+        store = ChainStore()
+        make_chain(store, 10)
+        # b8的前置区块b7不在store中：更高的分支连不到主链
+        make_chain(store, 10, tag="b", parent="b7", start_height=8)
+        self.assertEqual(store.tip_id, "a10")
+        self.assertEqual(sorted(store.best), list(range(1, 11)))
+        self.assertEqual(store.inventory(), [f"a{h}" for h in range(1, 11)])
+
+
+class LocatorTest(unittest.TestCase):
+    def test_locator_is_dense_near_tip_and_ends_at_genesis(self):
+        store = ChainStore()
+        make_chain(store, 1000)
+        locator = store.locator()
+        self.assertEqual(locator[:10], [f"a{h}" for h in range(1000, 990, -1)])
+        self.assertEqual(locator[-1], "a1")
+        self.assertLess(len(locator), 25)
+
+    def test_find_fork(self):
+        store = ChainStore()
+        make_chain(store, 1000)
+        other = ChainStore()
+        make_chain(other, 700)
+        make_chain(other, 500, tag="b", parent="a700", start_height=701)
+        fork_height = store.find_fork(other.locator())
+        self.assertLessEqual(fork_height, 700)
+        self.assertTrue(store.on_best_chain(f"a{fork_height}"))
+        self.assertIsNone(store.find_fork(["unknown"]))
+
+    def test_locator_with_gap_in_best_chain(self):
+        # ChainStore本身不校验高度：直接加入一个虚报高度的区块，主链在中间留下空缺
+        store = ChainStore()
+        make_chain(store, 20)
+        store.add_block({"block_id": "fake", "previous_block_id": "a1", "height": 10 ** 9})
+        result = []
+        worker = threading.Thread(target=lambda: result.append(store.locator()), daemon=True)
+        worker.start()
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive(), "locator() did not return")
+        self.assertEqual(result[0][0], "fake")
+        self.assertEqual(result[0][-1], "a1")
+
+
+if __name__ == "__main__":
+    unittest.main()
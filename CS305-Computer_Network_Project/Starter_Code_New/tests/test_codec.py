@@ -0,0 +1,61 @@
+import sys
+import os
+import unittest
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import codec
+from framing import FLAG_BINARY
+
+BLOCK_ID = "ab" * 32
+
+
+class BinaryCodecTest(unittest.TestCase):
+    def round_trip(self, message):
+        flags, payload = codec.encode_payload(message, codec.CODECS["binary"])
+        self.assertEqual(flags, FLAG_BINARY)
+        self.assertEqual(codec.decode_payload(flags, payload), message)
+        return payload
+
+    def test_round_trip_messages(self):
+        self.round_trip({"type": "PING", "sender_id": "5001", "timestamp": 1700000000.25, "message_id": "m-1"})
+        self.round_trip({"type": "INV", "sender_id": "5001", "block_ids": [BLOCK_ID, "00123"], "message_id": "7"})
+        self.round_trip({"type": "BLOCK_HEADERS", "sender_id": "5001", "start_height": 0, "end_height": -1,
+                         "is_full_chain": True, "message_id": "x",
+                         "headers": [{"block_id": BLOCK_ID, "previous_block_id": None, "height": 1}]})
+        self.round_trip({"type": "RELAY", "sender_id": "a", "target_id": "b", "message_id": "y",
+                         "payload": {"type": "TX", "id": "t", "from": "a", "to": "b", "amount": 3,
+                                     "timestamp": 1.5, "message_id": "z"}})
+
+    def test_binary_is_smaller_than_json(self):
+        message = {"type": "INV", "sender_id": "5001", "block_ids": [BLOCK_ID] * 20, "message_id": "1"}
+        payload = self.round_trip(message)
+        self.assertLess(len(payload), len(codec.CODECS["json"].encode(message)) // 2)
+
+    def test_falls_back_to_json(self):
+        # 未知消息类型、字段表之外的键、字段类型不符时都回退为json
+        for message in ({"type": "UNKNOWN", "sender_id": "a"},
+                        {"type": "PING", "sender_id": "a", "extra": 1},
+                        {"type": "PING", "sender_id": "a", "timestamp": "soon"},
+                        {"type": "PING", "sender_id": "a", "timestamp": 2 ** 70}):
+            flags, payload = codec.encode_payload(message, codec.CODECS["binary"])
+            self.assertEqual(flags, 0)
+            self.assertEqual(codec.decode_payload(flags, payload), message)
+
+    def test_corrupt_payload_raises_codec_error(self):
+        _, payload = codec.encode_payload({"type": "PING", "sender_id": "a", "message_id": "m"},
+                                          codec.CODECS["binary"])
+        for corrupt in (payload[:-1], payload + b"\x00", b"\xff" + payload[1:]):
+            with self.assertRaises(codec.CodecError):
+                codec.decode_payload(FLAG_BINARY, corrupt)
+
+    def test_choose_codec_requires_length_framing(self):
+        self.assertEqual(codec.choose_codec({"framing": "length", "codecs": ["binary", "json"]}).name, "binary")
+        self.assertEqual(codec.choose_codec({"framing": "newline", "codecs": ["binary"]}).name, "json")
+        self.assertEqual(codec.choose_codec({}).name, "json")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import os
+import unittest
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from dedup_cache import DedupCache
+
+
+class DedupCacheTest(unittest.TestCase):
+    def test_duplicate_within_expiry(self):
+        cache = DedupCache(600, bucket_seconds=60)
+        self.assertFalse(cache.seen("a", now=1000))
+        self.assertTrue(cache.seen("a", now=1500))
+
+    def test_whole_bucket_expires(self):
+        cache = DedupCache(120, bucket_seconds=60)
+        cache.seen("a", now=0)
+        cache.seen("b", now=150)
+        self.assertFalse(cache.seen("a", now=200))
+        self.assertEqual(cache.stats()["expired_buckets"], 1)
+
+    def test_cap_holds_within_one_bucket(self):
+        # 所有消息都落在同一个桶的时间段内（新节点只有一个桶，或突发流量）
+        for use_bloom in (False, True):
+            cache = DedupCache(600, bucket_seconds=60, max_entries=100, use_bloom=use_bloom)
+            for i in range(1000):
+                cache.seen(f"m{i}", now=1000 + i * 0.01)
+                self.assertLessEqual(len(cache), 100)
+            # 最近的消息仍然能被精确去重
+            self.assertTrue(cache.seen("m999", now=1011))
+
+    def test_cap_demotes_oldest_bucket_first(self):
+        cache = DedupCache(600, bucket_seconds=60, max_entries=10, use_bloom=True)
+        for i in range(8):
+            cache.seen(f"old{i}", now=0)
+        for i in range(8):
+            cache.seen(f"new{i}", now=60)
+        self.assertLessEqual(len(cache), 10)
+        self.assertEqual(cache.stats()["bloom_only_buckets"], 1)
+        # 释放了精确集合的旧桶仍由Bloom过滤器去重
+        self.assertTrue(cache.seen("old0", now=61))
+
+
+if __name__ == "__main__":
+    unittest.main()
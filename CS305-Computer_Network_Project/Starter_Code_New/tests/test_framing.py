@@ -0,0 +1,70 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import framing
+from framing import FrameBuffer, FrameError, encode_frame, encode_line
+
+
+def feed(buffer, data):
+    """模拟recv_into：按可写区域的大小分多次写入"""
+    while data:
+        area = buffer.writable()
+        n = min(len(area), len(data))
+        area[:n] = data[:n]
+        buffer.commit(n)
+        data = data[n:]
+
+
+def collect(buffer):
+    return [(flags, bytes(payload)) for flags, payload in buffer.frames()]
+
+
+class FrameBufferTest(unittest.TestCase):
+    def test_partial_frame_waits_for_rest(self):
+        buffer = FrameBuffer(size=64)
+        frame = encode_frame(b"hello world", flags=3)
+        for split in (2, framing.FRAME_HEADER_SIZE + 4):
+            feed(buffer, frame[:split])
+            self.assertEqual(collect(buffer), [])
+            feed(buffer, frame[split:])
+            self.assertEqual(collect(buffer), [(3, b"hello world")])
+
+    def test_mixed_length_and_line_frames(self):
+        buffer = FrameBuffer(size=64)
+        feed(buffer, encode_line(b'{"a": 1}') + encode_frame(b"xyz") + encode_line(b"tail"))
+        self.assertEqual(collect(buffer), [(0, b'{"a": 1}'), (0, b"xyz"), (0, b"tail")])
+
+    def test_frame_larger_than_buffer_grows_and_shrinks(self):
+        buffer = FrameBuffer(size=64)
+        payload = bytes(range(256)) * 10
+        feed(buffer, encode_frame(payload, flags=1))
+        self.assertEqual(collect(buffer), [(1, payload)])
+        buffer.writable()
+        self.assertEqual(len(buffer.buf), 64)
+
+    def test_oversized_frame_is_rejected(self):
+        buffer = FrameBuffer(size=64)
+        with mock.patch.object(framing, "MAX_FRAME_SIZE", 100):
+            feed(buffer, framing.FRAME_HEADER.pack(framing.FRAME_MAGIC, 0, 101))
+            with self.assertRaises(FrameError):
+                collect(buffer)
+
+    def test_unterminated_line_over_limit_is_rejected(self):
+        # 不以帧魔数开头的数据按换行分隔处理，一直没有换行符时也受长度上限约束
+        buffer = FrameBuffer(size=64)
+        with mock.patch.object(framing, "MAX_FRAME_SIZE", 100):
+            feed(buffer, b"x" * 50)
+            self.assertEqual(collect(buffer), [])
+            feed(buffer, b"x" * 60)
+            with self.assertRaises(FrameError):
+                collect(buffer)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from header_sync import HeaderSync
+
+
+def make_headers(count, tag="h"):
+    return [{"block_id": f"{tag}{h}", "previous_block_id": f"{tag}{h - 1}" if h > 1 else None, "height": h}
+            for h in range(1, count + 1)]
+
+
+class HeaderSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.sync = HeaderSync(range_size=10, pipeline=2, timeout=5)
+        self.sent = []
+        self.validated = []
+        self.sync.send = lambda peer_id, start, end: self.sent.append((peer_id, start, end)) or True
+        self.sync.on_validated = lambda headers, sender_id: self.validated.extend(headers)
+        patch = mock.patch.object(self.sync, "_fallback")
+        self.fallback = patch.start()
+        self.addCleanup(patch.stop)
+
+    def reply(self, peer_id, chain, start, now=0):
+        headers = [h for h in chain if start <= h["height"] < start + 10]
+        self.sync.on_headers({"headers": headers, "start_height": start}, peer_id, now=now)
+
+    def test_short_chains_finish_once_every_peer_answered(self):
+        self.sync.start("self", peers=["a", "b"])
+        self.reply("a", make_headers(3), 0)
+        self.assertIsNone(self.sync.sync_peer)
+        self.reply("b", make_headers(5), 0)
+        # 不需要等超时
+        self.assertEqual(self.sync.sync_peer, "b")
+        self.assertTrue(self.sync.finished)
+        self.assertEqual([h["height"] for h in self.validated], [1, 2, 3, 4, 5])
+
+    def test_silent_peer_only_delays_until_timeout(self):
+        self.sync.start("self", peers=["a", "b"])
+        self.reply("a", make_headers(3), 0)
+        self.sync.tick(now=self.sync.started_at + 1)
+        self.assertFalse(self.sync.finished)
+        self.sync.tick(now=self.sync.started_at + 6)
+        self.assertEqual(self.sync.sync_peer, "a")
+        self.assertTrue(self.sync.finished)
+        self.assertEqual(len(self.validated), 3)
+
+    def test_full_range_selects_sync_peer_and_fills_pipeline(self):
+        chain = make_headers(25)
+        self.sync.start("self", peers=["a", "b"])
+        self.reply("a", chain, 0)
+        self.assertEqual(self.sync.sync_peer, "a")
+        self.assertEqual(self.sent[-2:], [("a", 10, 19), ("a", 20, 29)])
+        # 乱序到达的段等前面的段校验后再校验
+        self.reply("a", chain, 20)
+        self.assertEqual(len(self.validated), 9)
+        self.reply("a", chain, 10)
+        self.assertTrue(self.sync.finished)
+        self.assertEqual([h["height"] for h in self.validated], list(range(1, 26)))
+
+    def test_range_that_does_not_link_falls_back(self):
+        chain = make_headers(25)
+        self.sync.start("self", peers=["a"])
+        self.reply("a", chain, 0)
+        self.reply("a", make_headers(25, tag="x"), 10)
+        self.assertIsNotNone(self.sync.failed)
+        self.fallback.assert_called_once()
+        self.assertEqual(len(self.validated), 9)
+
+    def test_unanswered_range_gives_up_after_max_attempts(self):
+        self.sync.start("self", peers=["a"])
+        now = self.sync.started_at
+        for _ in range(self.sync.max_attempts):
+            now += 6
+            self.sync.tick(now=now)
+        self.assertIsNotNone(self.sync.failed)
+        self.fallback.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
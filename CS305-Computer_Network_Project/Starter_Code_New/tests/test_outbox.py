@@ -0,0 +1,202 @@
+import sys
+import os
+import socket
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import outbox
+from peer_discovery import known_peers, peer_flags
+
+
+class RelayCircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breakers = outbox.CircuitBreakers()
+        patches = [
+            mock.patch.object(outbox, "circuit_breakers", self.breakers),
+            mock.patch.dict(peer_flags, {"nat_peer": {"nat": True}}),
+            mock.patch.dict(known_peers, {"nat_peer": ("127.0.0.1", 9001), "relay": ("127.0.0.1", 9002),
+                                          "direct": ("127.0.0.1", 9003)}),
+            mock.patch.object(outbox, "get_relay_peer", lambda self_id, dst_id: ("relay", "127.0.0.1", 9002)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def send(self, dst_id, connected):
+        """发送一条消息，实际连接是否成功由connected决定"""
+        message = {"type": "PING", "sender_id": "self", "message_id": "m"}
+        # 已达最大重试次数，失败的消息不再重新入队
+        entries = [(message, "127.0.0.1", 9001, 0, outbox.MAX_RETRIES)]
+
+        def fake_send_messages(ip, port, messages, on_complete=None):
+            on_complete([] if connected else list(messages))
+            return []
+
+        def on_complete(failed, link_peer):
+            outbox.handle_send_result(dst_id, failed, entries, link_peer=link_peer)
+
+        with mock.patch.object(outbox, "send_messages", fake_send_messages):
+            outbox.relay_or_direct_send_batch("self", dst_id, [message], on_complete)
+
+    def test_relay_failure_is_recorded_against_relay(self):
+        for _ in range(outbox.BREAKER_FAILURE_THRESHOLD):
+            self.send("nat_peer", connected=False)
+        self.assertTrue(self.breakers.is_open("relay"))
+        self.assertFalse(self.breakers.is_open("nat_peer"))
+        self.assertEqual(self.breakers.failures["nat_peer"], 0)
+
+    def test_direct_failure_is_recorded_against_target(self):
+        self.send("direct", connected=False)
+        self.assertEqual(self.breakers.failures["direct"], 1)
+        self.send("direct", connected=True)
+        self.assertEqual(self.breakers.failures["direct"], 0)
+
+
+class RetryAttemptTest(unittest.TestCase):
+    def test_attempt_count_travels_with_queue_entry(self):
+        timer = mock.Mock()
+        first = {"type": "PING", "message_id": "1"}
+        second = {"type": "PING", "message_id": "2"}
+        # 内容相同但不是同一个对象的消息不应被当成失败的消息
+        entries = [(first, "127.0.0.1", 9001, 0, 0), (dict(second), "127.0.0.1", 9001, 0, 0),
+                   (second, "127.0.0.1", 9001, 0, 2)]
+        with mock.patch.object(outbox, "timer_queue", timer):
+            outbox.handle_send_result("peer", [first, second], entries)
+        scheduled = [call.args[4] for call in timer.schedule.call_args_list]
+        self.assertEqual(len(scheduled), 2)
+        self.assertIs(scheduled[0][0], first)
+        self.assertEqual(scheduled[0][4], 1)
+        self.assertIs(scheduled[1][0], second)
+        self.assertEqual(scheduled[1][4], 3)
+
+    def test_gives_up_after_max_retries(self):
+        timer = mock.Mock()
+        message = {"type": "PING", "message_id": "1"}
+        with mock.patch.object(outbox, "timer_queue", timer):
+            outbox.handle_send_result("peer", [message], [(message, "127.0.0.1", 9001, 0, outbox.MAX_RETRIES)])
+        timer.schedule.assert_not_called()
+
+
+class BatchedWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+        self.fail_on_write = None
+        test = self
+
+        class FakePool:
+            def sendall(self, ip, port, data):
+                if len(test.writes) == test.fail_on_write:
+                    raise ConnectionResetError("reset")
+                test.writes.append(data)
+
+        class ImmediateTimer:
+            def schedule(self, delay, func, *args):
+                func(*args)
+
+        patches = [
+            mock.patch.object(outbox, "connection_pool", FakePool()),
+            mock.patch.object(outbox, "timer_queue", ImmediateTimer()),
+            mock.patch.object(outbox, "passes_network_conditions", lambda ip, port, message: True),
+            mock.patch.object(outbox, "prepare_message", lambda ip, port, message: (message["type"], message["data"])),
+            mock.patch.object(outbox, "BATCH_MAX_BYTES", 100),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def send(self, sizes):
+        messages = [{"type": "TX", "data": bytes([65 + i]) * size} for i, size in enumerate(sizes)]
+        results = []
+        dropped = outbox.send_messages("127.0.0.1", 9001, messages, results.append)
+        self.assertEqual(dropped, [])
+        return messages, results[0]
+
+    def test_messages_are_coalesced_up_to_byte_limit(self):
+        _, failed = self.send([40, 40, 40, 150, 30])
+        self.assertEqual(failed, [])
+        # 单条超过上限的消息单独写出
+        self.assertEqual([len(data) for data in self.writes], [80, 40, 150, 30])
+        self.assertEqual(b"".join(self.writes)[:80], b"A" * 40 + b"B" * 40)
+
+    def test_failed_write_returns_unsent_messages(self):
+        self.fail_on_write = 1
+        messages, failed = self.send([60, 60, 60])
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(failed, messages[1:])
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_is_alive_detects_closed_peer(self):
+        local, remote = socket.socketpair()
+        self.addCleanup(local.close)
+        self.assertTrue(outbox.ConnectionPool._is_alive(local))
+        remote.close()
+        self.assertFalse(outbox.ConnectionPool._is_alive(local))
+
+    def test_is_alive_with_fd_above_1024(self):
+        try:
+            import resource
+        except ImportError:
+            self.skipTest("resource模块不可用")
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 1500:
+            self.skipTest("文件描述符上限太低")
+        local, remote = socket.socketpair()
+        high_fd = os.dup2(local.detach(), 1500)
+        high = socket.socket(fileno=high_fd)
+        self.addCleanup(high.close)
+        self.assertTrue(outbox.ConnectionPool._is_alive(high))
+        remote.close()
+        self.assertFalse(outbox.ConnectionPool._is_alive(high))
+
+    def test_reuses_idle_connection(self):
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+        port = server.getsockname()[1]
+        pool = outbox.ConnectionPool(idle_timeout=0)
+        self.addCleanup(pool.evict_idle)
+        pool.sendall("127.0.0.1", port, b"a")
+        accepted, _ = server.accept()
+        self.addCleanup(accepted.close)
+        pool.sendall("127.0.0.1", port, b"b")
+        self.assertEqual(pool.stats()["hits"], 1)
+        self.assertEqual(pool.stats()["misses"], 1)
+        received = b""
+        while len(received) < 2:
+            received += accepted.recv(2)
+        self.assertEqual(received, b"ab")
+
+
+class PeerQueueTest(unittest.TestCase):
+    def test_full_queue_evicts_oldest_lowest_priority(self):
+        queue = outbox.PeerQueue(limit=3)
+        queue.push(1, "high")
+        queue.push(3, "low-old")
+        queue.push(3, "low-new")
+        self.assertEqual(queue.push(2, "medium"), (True, "low-old"))
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.pop_batch(10), ["high", "medium", "low-new"])
+        self.assertEqual(len(queue), 0)
+
+    def test_full_queue_rejects_equal_or_lower_priority(self):
+        queue = outbox.PeerQueue(limit=2)
+        queue.push(2, "a")
+        queue.push(2, "b")
+        self.assertEqual(queue.push(2, "c"), (False, None))
+        self.assertEqual(queue.push(3, "d"), (False, None))
+        self.assertEqual(queue.counts(), {2: 2})
+
+    def test_pop_batch_takes_higher_priority_first(self):
+        queue = outbox.PeerQueue(limit=10)
+        for priority in (4, 3, 2, 1):
+            queue.push(priority, priority)
+        self.assertEqual(queue.pop_batch(2), [1, 2])
+        self.assertEqual(queue.lowest_priority(), 4)
+        self.assertEqual(len(queue), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import rate_limits
+from rate_limits import SlidingWindowCounter, RateLimiterGroup
+
+
+class SlidingWindowCounterTest(unittest.TestCase):
+    def test_limit_within_window(self):
+        counter = SlidingWindowCounter(limit=3, window=10)
+        self.assertEqual([counter.hit(100.0) for _ in range(4)], [True, True, True, False])
+
+    def test_old_slices_expire(self):
+        counter = SlidingWindowCounter(limit=3, window=10, slices=10)
+        counter.hit(100.0)
+        counter.hit(105.0)
+        counter.hit(105.0)
+        self.assertFalse(counter.hit(109.5))
+        # 第一条消息所在的时间片移出窗口后释放一个名额
+        self.assertTrue(counter.hit(110.5))
+        self.assertEqual(counter.count(110.5), 3)
+        # 整个窗口过期
+        self.assertEqual(counter.count(200.0), 0)
+
+    def test_count_rejected(self):
+        counter = SlidingWindowCounter(limit=2, window=10)
+        for _ in range(5):
+            counter.hit(100.0, count_rejected=True)
+        self.assertEqual(counter.count(100.0), 5)
+        # 被限制的消息也占用窗口，持续超限的节点要等整个窗口过去
+        self.assertFalse(counter.hit(108.0, count_rejected=True))
+        self.assertTrue(counter.hit(111.0, count_rejected=True))
+
+
+class RateLimiterGroupTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patch = mock.patch.object(rate_limits.time, "monotonic", lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_peers_are_limited_separately(self):
+        limiter = RateLimiterGroup("test", limit=2, window=10)
+        self.assertEqual([limiter.is_limited("a") for _ in range(3)], [False, False, True])
+        self.assertFalse(limiter.is_limited("b"))
+        self.now += 11
+        self.assertFalse(limiter.is_limited("a"))
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    def test_type_and_peer_limits(self):
+        limiter = RateLimiterGroup("test", limit=1, window=10)
+        limiter.set_type_limit("BLOCK", 3)
+        limiter.set_peer_limit("fast", 5)
+        # 设置了类型限制的消息单独计数，不占用节点的默认配额
+        self.assertEqual([limiter.is_limited("a", "BLOCK") for _ in range(4)], [False, False, False, True])
+        self.assertFalse(limiter.is_limited("a", "TX"))
+        self.assertTrue(limiter.is_limited("a", "PING"))
+        self.assertEqual(sum(limiter.is_limited("fast") for _ in range(6)), 1)
+
+    def test_configure_resets_counters(self):
+        limiter = RateLimiterGroup("test", limit=1, window=10)
+        limiter.is_limited("a")
+        self.assertTrue(limiter.is_limited("a"))
+        limiter.configure(limit=2)
+        self.assertFalse(limiter.is_limited("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import sys
+import os
+import threading
+import unittest
+from unittest import mock
+
+# 添加Starter_Code_New目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import snapshot
+from chain_store import ChainStore
+from block_handler import compute_block_hash
+
+
+def make_blocks(count, parent=None, start_height=1):
+    """生成区块ID为真实哈希、相互链接的区块"""
+    blocks = []
+    for height in range(start_height, start_height + count):
+        block = {"previous_block_id": parent, "height": height, "transactions": []}
+        block["block_id"] = parent = compute_block_hash(block)
+        blocks.append(block)
+    return blocks
+
+
+def make_download(blocks, chunk_blocks=10):
+    """为blocks生成清单并选定，返回下载状态和分块"""
+    chunks = [blocks[i:i + chunk_blocks] for i in range(0, len(blocks), chunk_blocks)]
+    chunk_hashes = [snapshot.compute_chunk_hash(chunk) for chunk in chunks]
+    last = blocks[-1]
+    manifest = {
+        "height": last["height"],
+        "block_id": last["block_id"],
+        "chunk_hashes": chunk_hashes,
+        "snapshot_hash": snapshot.compute_snapshot_hash(last["height"], last["block_id"], chunk_hashes)
+    }
+    download = snapshot.SnapshotDownload()
+    download.add_manifest("peer", manifest)
+    download.choose()
+    return download, chunks
+
+
+class InitialSyncTest(unittest.TestCase):
+    def run_sync(self, fake_sync):
+        event = threading.Event()
+        with mock.patch.object(snapshot, "initial_sync_done", event), \
+                mock.patch.object(snapshot, "snapshot_sync", fake_sync):
+            returned = snapshot.start_snapshot_sync("self")
+            self.assertIs(returned, event)
+            self.assertTrue(event.wait(5))
+
+    def test_event_set_after_sync_finishes(self):
+        calls = []
+        self.run_sync(lambda self_id: calls.append(self_id))
+        self.assertEqual(calls, ["self"])
+
+    def test_event_set_when_sync_raises(self):
+        def failing_sync(self_id):
+            raise RuntimeError("boom")
+        self.run_sync(failing_sync)
+
+
+
+class SnapshotDownloadTest(unittest.TestCase):
+    def test_applies_chunks_in_order(self):
+        download, chunks = make_download(make_blocks(25))
+        store = ChainStore()
+        # 后面的分块先到，等前面的分块到达后一起应用
+        self.assertTrue(download.add_chunk(download.manifest["snapshot_hash"], 2, chunks[2]))
+        self.assertEqual(download.apply_ready(store), 0)
+        for index in (0, 1):
+            self.assertTrue(download.add_chunk(download.manifest["snapshot_hash"], index, chunks[index]))
+        self.assertEqual(download.apply_ready(store), 25)
+        self.assertTrue(download.done)
+        self.assertEqual(store.tip_id, download.manifest["block_id"])
+
+    def test_rejects_chunk_with_wrong_hash(self):
+        download, chunks = make_download(make_blocks(20))
+        snapshot_hash = download.manifest["snapshot_hash"]
+        self.assertFalse(download.add_chunk(snapshot_hash, 0, chunks[1]))
+        self.assertFalse(download.add_chunk(snapshot_hash, 0, chunks[0][:-1]))
+        self.assertFalse(download.add_chunk("other", 0, chunks[0]))
+        self.assertFalse(download.add_chunk(snapshot_hash, 5, chunks[0]))
+        self.assertEqual(download.received, {})
+
+    def test_rejects_manifest_with_wrong_snapshot_hash(self):
+        download, _ = make_download(make_blocks(10))
+        manifest = dict(download.manifest, height=download.manifest["height"] + 1)
+        self.assertFalse(snapshot.SnapshotDownload().add_manifest("peer", manifest))
+
+    def test_rejects_chunk_that_does_not_link(self):
+        # 分块哈希与清单一致，但第二个分块不接在第一个分块之后（清单本身由恶意节点生成）
+        first = make_blocks(10)
+        other = make_blocks(10, parent="unknown", start_height=11)
+        download, chunks = make_download(first + other)
+        for index, chunk in enumerate(chunks):
+            self.assertTrue(download.add_chunk(download.manifest["snapshot_hash"], index, chunk))
+        with self.assertRaises(snapshot.SnapshotError):
+            download.apply_ready(ChainStore())
+
+    def test_rejects_block_with_wrong_id(self):
+        blocks = make_blocks(10)
+        blocks[4] = dict(blocks[4], transactions=["forged"])
+        download, chunks = make_download(blocks)
+        download.add_chunk(download.manifest["snapshot_hash"], 0, chunks[0])
+        with self.assertRaises(snapshot.SnapshotError):
+            download.apply_ready(ChainStore())
+
+
+class SnapshotProducerTest(unittest.TestCase):
+    def test_replaced_snapshot_is_served_until_idle(self):
+        store = ChainStore()
+        blocks = make_blocks(110)
+        for block in blocks:
+            store.add_block(block)
+        producer = snapshot.SnapshotProducer(store, chunk_blocks=50, retain_seconds=30)
+        old = producer.refresh()
+        for block in make_blocks(100, parent=blocks[-1]["block_id"], start_height=111):
+            store.add_block(block)
+        new = producer.refresh()
+        self.assertNotEqual(old.snapshot_hash, new.snapshot_hash)
+
+        now = old.created + 1
+        # 进行中的下载还能取到旧快照的分块，每次请求都会延长保留时间
+        self.assertEqual(producer.get_chunk(old.snapshot_hash, 0, now=now), old.chunks[0])
+        self.assertEqual(producer.get_chunk(old.snapshot_hash, 1, now=now + 20), old.chunks[1])
+        self.assertEqual(producer.get_chunk(new.snapshot_hash, 3, now=now + 45), new.chunks[3])
+        self.assertIsNotNone(producer.get_chunk(old.snapshot_hash, 0, now=now + 45))
+        # 超过保留时间没有再被请求后丢弃
+        self.assertIsNone(producer.get_chunk(old.snapshot_hash, 0, now=now + 80))
+        self.assertEqual(producer.stats()["retired"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()